@@ -1,6 +1,30 @@
+DEFAULT_ANTIBODIES = ['Antibody']
+
+
+def antibody_parameter(name, mAb):
+    """
+    Name of an antibody-specific parameter that the default antibody shares under its original name
+    """
+    return name if mAb == 'Antibody' else f"{name}_{mAb}"
+
 
 # Aggregation reactions
-def build_reactions():
+def build_reactions(antibodies=None):
+    """
+    Build the Geerts reaction list
+
+    Parameters:
+    -----------
+    antibodies : list of str or None
+        Antibody species names (e.g. ['Lecanemab', 'Donanemab']), each with its own
+        __<mAb> complexes, binding constants (k0_<mAb> ... k3_<mAb>), reflection
+        coefficients, FcRn and clearance reactions; ['Antibody'] when None, which
+        reproduces the single-antibody model
+    """
+    antibodies = DEFAULT_ANTIBODIES if antibodies is None else list(antibodies)
+    monomer_species = [('AB40_O1', None), ('AB42_O1', None)]
+    antibody_species = [(Species, mAb) for mAb in antibodies
+                        for Species in [f'AB40_O1__{mAb}', f'AB42_O1__{mAb}', mAb]]
     all_reactions = []
     counter = 0
     for Species in ['AB40', 'AB42']:
@@ -29,18 +53,19 @@ def build_reactions():
                 
                 all_reactions.append(Reaction_dict)
 
-    for Species in ['AB40', 'AB42']:
-        for Comp in ['ISF','PVS','BBB','BCSFB','BrainPlasma','CM','LV','TFV','SAS' ]:
-            counter += 1
-            Reaction_name = f"Monomer binding antibody"
-            Reactants = f"[{Species}_O1_{Comp},Antibody_{Comp}]"
-            Products = f"[{Species}_O1__Antibody_{Comp}]"
-            Rate_type = "MA"
-            Rate_eqtn_prototype = f"k0_Antibody"            
-            Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,
-            }
+    for mAb in antibodies:
+        for Species in ['AB40', 'AB42']:
+            for Comp in ['ISF','PVS','BBB','BCSFB','BrainPlasma','CM','LV','TFV','SAS' ]:
+                counter += 1
+                Reaction_name = f"Monomer binding antibody"
+                Reactants = f"[{Species}_O1_{Comp},{mAb}_{Comp}]"
+                Products = f"[{Species}_O1__{mAb}_{Comp}]"
+                Rate_type = "MA"
+                Rate_eqtn_prototype = f"k0_{mAb}"            
+                Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,
+                }
             
-            all_reactions.append(Reaction_dict)
+                all_reactions.append(Reaction_dict)
 
     for Species in ['AB40', 'AB42']:
         for Comp in ['central']:
@@ -62,43 +87,46 @@ def build_reactions():
             Rate_eqtn_prototype = f"k0_Antibody * (AB40_O1_central/V_central) * (Antibody_central/V_centralAntibody) * (V_centralAntibody - V_central)"            
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
     
-    for Species in ['AB40', 'AB42']:
-        for n in range(2, 18):
-            for Comp in ['ISF','PVS']:
-                counter += 1
-                Reaction_name = f"Oligomer binding antibody"
-                Reactants = f"[{Species}_O{n}_{Comp},Antibody_{Comp}]"
-                Products = f"[{Species}_O{n}__Antibody_{Comp}]"
-                Rate_type = "MA"
-                Rate_eqtn_prototype = f"k1_Antibody"            
-                Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
+    for mAb in antibodies:
+        for Species in ['AB40', 'AB42']:
+            for n in range(2, 18):
+                for Comp in ['ISF','PVS']:
+                    counter += 1
+                    Reaction_name = f"Oligomer binding antibody"
+                    Reactants = f"[{Species}_O{n}_{Comp},{mAb}_{Comp}]"
+                    Products = f"[{Species}_O{n}__{mAb}_{Comp}]"
+                    Rate_type = "MA"
+                    Rate_eqtn_prototype = f"k1_{mAb}"            
+                    Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
                 
-                all_reactions.append(Reaction_dict)
+                    all_reactions.append(Reaction_dict)
 
-    for Species in ['AB40', 'AB42']:
-        for n in range(18, 25):
+    for mAb in antibodies:
+        for Species in ['AB40', 'AB42']:
+            for n in range(18, 25):
+                for Comp in ['ISF','PVS']:
+                    counter += 1
+                    Reaction_name = f"Proto binding antibody"
+                    Reactants = f"[{Species}_O{n}_{Comp},{mAb}_{Comp}]"
+                    Products = f"[{Species}_O{n}__{mAb}_{Comp}]"
+                    Rate_type = "MA"
+                    Rate_eqtn_prototype = f"k2_{mAb}"            
+                    Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
+                
+                    all_reactions.append(Reaction_dict)            
+    
+    for mAb in antibodies:
+        for Species in ['AB40', 'AB42']:
             for Comp in ['ISF','PVS']:
                 counter += 1
-                Reaction_name = f"Proto binding antibody"
-                Reactants = f"[{Species}_O{n}_{Comp},Antibody_{Comp}]"
-                Products = f"[{Species}_O{n}__Antibody_{Comp}]"
+                Reaction_name = f"Plaque binding antibody"
+                Reactants = f"[{Species}_O25_{Comp},{mAb}_{Comp}]"
+                Products = f"[{Species}_O25__{mAb}_{Comp}]"
                 Rate_type = "MA"
-                Rate_eqtn_prototype = f"k2_Antibody"            
+                Rate_eqtn_prototype = f"k3_{mAb}"            
                 Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
-                
-                all_reactions.append(Reaction_dict)            
-    
-    for Species in ['AB40', 'AB42']:
-        for Comp in ['ISF','PVS']:
-            counter += 1
-            Reaction_name = f"Plaque binding antibody"
-            Reactants = f"[{Species}_O25_{Comp},Antibody_{Comp}]"
-            Products = f"[{Species}_O25__Antibody_{Comp}]"
-            Rate_type = "MA"
-            Rate_eqtn_prototype = f"k3_Antibody"            
-            Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
 
-            all_reactions.append(Reaction_dict)
+                all_reactions.append(Reaction_dict)
 
     for Species in ['AB40', 'AB42']:
         for n in range(13, 19):
@@ -135,17 +163,18 @@ def build_reactions():
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
     
-    for Species in ['AB40', 'AB42']:
-        for n in range(1, 26):
-            for Comp in ['ISF']:
-                counter += 1
-                Reaction_name = f"Microglia Degradation Abeta-Antibody"
-                Reactants = f"[{Species}_O{n}__Antibody_{Comp}]"
-                Products = f"[0]"
-                Rate_type = "MA"
-                Rate_eqtn_prototype = f"Microglia*(Microglia_high_frac*Microglia_high_rate_mAb + (1.0 - Microglia_high_frac)*Microglia_low_rate_mAb)"            
-                Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
-                all_reactions.append(Reaction_dict)
+    for mAb in antibodies:
+        for Species in ['AB40', 'AB42']:
+            for n in range(1, 26):
+                for Comp in ['ISF']:
+                    counter += 1
+                    Reaction_name = f"Microglia Degradation Abeta-Antibody"
+                    Reactants = f"[{Species}_O{n}__{mAb}_{Comp}]"
+                    Products = f"[0]"
+                    Rate_type = "MA"
+                    Rate_eqtn_prototype = f"Microglia*(Microglia_high_frac*{antibody_parameter('Microglia_high_rate_mAb', mAb)} + (1.0 - Microglia_high_frac)*{antibody_parameter('Microglia_low_rate_mAb', mAb)})"            
+                    Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
+                    all_reactions.append(Reaction_dict)
 
     for Species in ['AB40', 'AB42']:
         for Comp in ['ISF']:
@@ -256,21 +285,22 @@ def build_reactions():
                 Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
                 all_reactions.append(Reaction_dict)
     
-    for Species in ['AB40', 'AB42']:
-        for Comp in [['PVS','centralAntibody']]:
-            for n in range(2, 25):
-                counter += 1
-                Comp1 = Comp[0]
-                Comp2 = Comp[1]
-                Reaction_name = f"Flow PVS to central oligomer/proto-Antibody"
-                Reactants = f"[{Species}_O{n}__Antibody_{Comp1}]"
-                Products = f"[0]"
-                Rate_type = "UDF"
-                Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_Antibody) * Q_PVS"
-                Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
-                all_reactions.append(Reaction_dict)
+    for mAb in antibodies:
+        for Species in ['AB40', 'AB42']:
+            for Comp in [['PVS','centralAntibody']]:
+                for n in range(2, 25):
+                    counter += 1
+                    Comp1 = Comp[0]
+                    Comp2 = Comp[1]
+                    Reaction_name = f"Flow PVS to central oligomer/proto-Antibody"
+                    Reactants = f"[{Species}_O{n}__{mAb}_{Comp1}]"
+                    Products = f"[0]"
+                    Rate_type = "UDF"
+                    Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_{mAb}) * Q_PVS"
+                    Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
+                    all_reactions.append(Reaction_dict)
 
-    for Species in ['AB40_O1', 'AB42_O1', 'AB40_O1__Antibody', 'AB42_O1__Antibody','Antibody']:
+    for Species, mAb in monomer_species + antibody_species:
         for Comp in [['PVS','central'],['ISF','central'],['ISF','LV'],['ISF','TFV'],['BrainPlasma','ISF'],['BrainPlasma','LV'],['BrainPlasma','TFV'],['LV','TFV'],['TFV','CM'],['CM','SAS'],['SAS','ISF'],['SAS','central'],['BrainPlasma','central'],['central','BrainPlasma']]:
             counter += 1
             Comp1 = Comp[0]
@@ -290,7 +320,7 @@ def build_reactions():
                         Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_Abeta) * Q_PVS" 
                     else:
                         Comp2 = 'centralAntibody'
-                        Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_Antibody) * Q_PVS"
+                        Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_{mAb}) * Q_PVS"
                         Products = f"[{Species}_{Comp2}]"        
                 case ['ISF','central']: 
                     Reaction_name = f"Flow ISF to central "
@@ -298,7 +328,7 @@ def build_reactions():
                         Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_Abeta) * (Qbrain_ISF - Q_PVS)"
                     else:
                         Comp2 = 'centralAntibody'
-                        Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_Antibody) * (Qbrain_ISF - Q_PVS)"
+                        Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_{mAb}) * (Qbrain_ISF - Q_PVS)"
                         Products = f"[{Species}_{Comp2}]"
                 case ['ISF','LV']:
                     Reaction_name = f"Flow ISF to LV "
@@ -333,7 +363,7 @@ def build_reactions():
                         Rate_eqtn_prototype = f"(1 - sigma_{Comp1}_{Comp2}_Abeta)*Q_CSF"
                     else:
                         Comp2 = 'centralAntibody'
-                        Rate_eqtn_prototype = f"(1 - sigma_{Comp1}_{Comp2}_Antibody)*Q_CSF"
+                        Rate_eqtn_prototype = f"(1 - sigma_{Comp1}_{Comp2}_{mAb})*Q_CSF"
                         Products = f"[{Species}_{Comp2}]"
                 case ['BrainPlasma','central']:
                     Reaction_name = f"Flow BrainPlasma to central Abeta"
@@ -354,7 +384,7 @@ def build_reactions():
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict) 
     
-    for Species in ['AB40_O1', 'AB42_O1','Antibody']:
+    for Species, mAb in monomer_species + [(mAb, mAb) for mAb in antibodies]:
         for Comp in [['ISF','PVS']]:
             counter += 1
             Comp1 = Comp[0]
@@ -365,12 +395,12 @@ def build_reactions():
             Reaction_name = f"Flow ISF to PVS "
             if Species == 'AB40_O1' or Species == 'AB42_O1' :
                 Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_O1) * Q_PVS"
-            elif Species == 'Antibody':
-                Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_Antibody) * Q_PVS"         
+            else:
+                Rate_eqtn_prototype = f"(1.0 - sigma_{Comp1}_{Comp2}_{mAb}) * Q_PVS"         
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict) 
 
-    for Species in ['AB40_O1', 'AB42_O1', 'AB40_O1__Antibody', 'AB42_O1__Antibody','Antibody']:
+    for Species, mAb in monomer_species + antibody_species:
         for Comp in ['BBB','BCSFB']:
             counter += 1
             Reaction_name = f"{Comp} Abeta Monomer/Antibody degradation "
@@ -381,7 +411,7 @@ def build_reactions():
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
     
-    for Species in ['AB40_O1', 'AB42_O1', 'AB40_O1__Antibody', 'AB42_O1__Antibody','Antibody']:
+    for Species, mAb in monomer_species + antibody_species:
         for Comp in [['ISF','BBB'],['BrainPlasma','BBB'],['BrainPlasma','BCSFB'],['TFV','BCSFB'],['LV','BCSFB']]:
             counter += 1
             Comp1 = Comp[0]
@@ -404,7 +434,7 @@ def build_reactions():
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
 
-    for Species in ['AB40_O1__Antibody', 'AB42_O1__Antibody','Antibody']:
+    for Species, mAb in antibody_species:
         for Comp in [['BBB','ISF'],['BCSFB','LV'],['BCSFB','TFV'],['BBB','BrainPlasma'],['BCSFB','BrainPlasma']]:
             counter += 1
             Comp1 = Comp[0]
@@ -427,14 +457,14 @@ def build_reactions():
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
     
-    for Species in ['AB40_O1__Antibody', 'AB42_O1__Antibody','Antibody']:
+    for Species, mAb in antibody_species:
         for Comp in ['BBB','BCSFB']:
             counter += 1
             Reaction_name = f"{Comp} Binding to FCRn"
             Reactants = f"[{Species}_{Comp},FCRn_{Comp}]"
             Products = f"[{Species}__FCRn_{Comp}]"
             Rate_type = "RMA"
-            Rate_eqtn_prototype = f"[kon_FCRn,koff_FCRn]"
+            Rate_eqtn_prototype = f"[{antibody_parameter('kon_FCRn', mAb)},{antibody_parameter('koff_FCRn', mAb)}]"
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
 
@@ -449,14 +479,14 @@ def build_reactions():
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
 
-    for Species in ['AB40_O1__Antibody', 'AB42_O1__Antibody','Antibody']:
+    for Species, mAb in antibody_species:
         for Comp in ['centralAntibody']:
             counter += 1
             Reaction_name = f"centralAntibody clearance 1"
             Reactants = f"[{Species}_{Comp}]"
             Products = f"[0]"
             Rate_type = "UDF"
-            Rate_eqtn_prototype = f"Antibody_CL"
+            Rate_eqtn_prototype = f"{mAb}_CL"
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
 
@@ -473,7 +503,7 @@ def build_reactions():
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
 
-    for Species in ['AB40_O1__Antibody', 'AB42_O1__Antibody','Antibody']:
+    for Species, mAb in antibody_species:
         for Comp in [['centralAntibody','peripheralAntibody'],['peripheralAntibody','centralAntibody']]:
             counter += 1
             Comp1 = Comp[0]
@@ -482,11 +512,11 @@ def build_reactions():
             Reactants = f"[{Species}_{Comp1}]"
             Products = f"[{Species}_{Comp2}]"
             Rate_type = "UDF"
-            Rate_eqtn_prototype = f"Antibody_CLd2"
+            Rate_eqtn_prototype = f"{mAb}_CLd2"
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
     
-    for Species in ['Antibody']:
+    for Species in antibodies:
         for Comp in [['SubCutComp','centralAntibody']]:
             counter += 1
             Comp1 = Comp[0]
@@ -495,18 +525,18 @@ def build_reactions():
             Reactants = f"[{Species}_{Comp1}]"
             Products = f"[{Species}_{Comp2}]"
             Rate_type = "UDF"
-            Rate_eqtn_prototype = f"SubCut_ka*V_SubCutComp*SubCut_bioavailability"
+            Rate_eqtn_prototype = f"{antibody_parameter('SubCut_ka', Species)}*V_SubCutComp*{antibody_parameter('SubCut_bioavailability', Species)}"
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
     
-    for Species in ['Antibody']:
+    for Species in antibodies:
         for Comp in ['SubCutComp']:
             counter += 1
             Reaction_name = f"Subcutaneous clearance"
             Reactants = f"[{Species}_{Comp}]"
             Products = f"[0]"
             Rate_type = "MA"
-            Rate_eqtn_prototype = f"SubCut_ka*(1.0 - SubCut_bioavailability)"
+            Rate_eqtn_prototype = f"{antibody_parameter('SubCut_ka', Species)}*(1.0 - {antibody_parameter('SubCut_bioavailability', Species)})"
             Reaction_dict = {"Reaction_name": Reaction_name,"Reactants": Reactants,"Products": Products,"Rate_type": Rate_type,"Rate_eqtn_prototype": Rate_eqtn_prototype,}
             all_reactions.append(Reaction_dict)
 
@@ -515,11 +545,12 @@ def build_reactions():
 
 
 
-all_reactions = build_reactions()
+if __name__ == "__main__":
+    all_reactions = build_reactions()
 
-with open("Geerts_all_reactions.txt", "w", encoding="utf-8") as f:
-    for reaction in all_reactions:
-        f.write(str(reaction) + "\n")
+    with open("Geerts_all_reactions.txt", "w", encoding="utf-8") as f:
+        for reaction in all_reactions:
+            f.write(str(reaction) + "\n")
 
-# print(all_reactions)
+    # print(all_reactions)
 
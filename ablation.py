@@ -0,0 +1,258 @@
+"""
+Mechanism Ablation
+Switch off families of reactions (by Reaction_name) in the compiled model, singly and in pairs,
+simulate the registered trials for each ablation in parallel and rank the ablations by impact
+"""
+
+import argparse
+import itertools
+import re
+
+import numpy as np
+import pandas as pd
+
+from parallel import parallel_imap
+from population import DEFAULT_MEASURES
+from trial_registry import arm_values, compile_plan, load_registry, run_plan
+
+# Mechanism families: name -> regular expression matched (case-insensitively)
+# against the Reaction_name of every reaction
+REACTION_FAMILIES = {
+    'PDMA': r'\(PDMA\)',
+    'Plaque formation': r'^Plaque Formation$',
+    'O24 split': r'^O24 split$',
+    'Microglia degradation of Abeta': r'^Microglia Degradation Abeta$',
+    'Microglia degradation of plaque': r'^Microglia Degradation Plaque$',
+    'Microglia degradation of antibody complexes': r'^Microglia Degradation Abeta-Antibody$',
+    'IDE degradation': r'^IDE Degradation',
+    'Antibody binding to monomer': r'^Monomer binding (to )?antibody',
+    'Antibody binding to oligomers': r'^Oligomer binding antibody$',
+    'Antibody binding to protofibrils': r'^Proto binding antibody$',
+    'Antibody binding to plaque': r'^Plaque binding antibody$',
+    'Perivascular clearance': r'^Flow (ISF|PVS) to (PVS|central) oligomer/proto',
+    'FcRn binding': r'Binding to FCRn$',
+    'FcRn-mediated return': r'FCRn-mediated return',
+    'BBB/BCSFB degradation': r'(BBB|BCSFB) Abeta Monomer/Antibody degradation',
+}
+
+
+def family_reactions(model, families=None):
+    """
+    Indices into model.reactions of every family
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    families : dict, list of str or None
+        Mapping family -> Reaction_name pattern, or names of REACTION_FAMILIES;
+        all of REACTION_FAMILIES when None
+
+    Returns:
+    --------
+    dict
+        Family -> list of reaction indices
+    """
+    if families is None:
+        families = REACTION_FAMILIES
+    elif not isinstance(families, dict):
+        unknown = [name for name in families if name not in REACTION_FAMILIES]
+        if unknown:
+            raise KeyError(f"Unknown reaction families: {', '.join(unknown)}")
+        families = {name: REACTION_FAMILIES[name] for name in families}
+    members = {}
+    for family, pattern in families.items():
+        regex = re.compile(pattern, re.IGNORECASE)
+        members[family] = [i for i, reaction in enumerate(model.reactions)
+                           if regex.search(reaction['Reaction_name'].strip())]
+        if not members[family]:
+            raise ValueError(f"Reaction family '{family}' ({pattern}) matches no reaction")
+    return members
+
+
+def ablation_multipliers(model, members, ablated):
+    """
+    Per-reaction rate multipliers with the reactions of the ablated families set to zero
+    """
+    multipliers = np.ones(len(model.reactions))
+    for family in ablated:
+        multipliers[members[family]] = 0.0
+    return multipliers
+
+
+def ablation_sets(families, pairs=True):
+    """
+    The ablations to run: the intact model (empty tuple), every family and, optionally, every pair
+    """
+    families = list(families)
+    sets = [()] + [(family,) for family in families]
+    if pairs:
+        sets += list(itertools.combinations(families, 2))
+    return sets
+
+
+def plan_readouts(plan, results, measures=None):
+    """
+    Every arm-visit read-out of a run_plan result, per trial measure
+
+    Returns:
+    --------
+    dict
+        Measure -> 1-D array over the arms (in plan order) and their visits
+    """
+    measures = dict(DEFAULT_MEASURES if measures is None else measures)
+    readouts = {}
+    for measure, output in measures.items():
+        values = [arm_values(plan, results, study, series, output)[1]
+                  for (study, series), arm in plan.arms.items() if output in arm['outputs']]
+        if values:
+            readouts[measure] = np.concatenate(values)
+    return readouts
+
+
+_MODEL = None
+_PARAMS = None
+_PLAN = None
+_OPTIONS = None
+
+
+def _init_worker(model, params, plan, options):
+    global _MODEL, _PARAMS, _PLAN, _OPTIONS
+    _MODEL, _PARAMS, _PLAN, _OPTIONS = model, params, plan, options
+
+
+def _ablation_task(multipliers):
+    """
+    The whole plan for one ablation, None when its baseline cannot be integrated
+    """
+    model = _MODEL.with_rate_multipliers(multipliers)
+    try:
+        return run_plan(model, _PARAMS, _PLAN, processes=1, **_OPTIONS)
+    except (ArithmeticError, ValueError, RuntimeError):
+        return None
+
+
+def _rms(values):
+    return float(np.sqrt(np.nanmean(values ** 2))) if np.any(np.isfinite(values)) else np.nan
+
+
+def run_ablations(model, params, plan=None, families=None, pairs=True, measures=None, processes=None,
+                  **options):
+    """
+    Simulate the trials of a plan with each reaction family, and each pair, switched off
+
+    The ablated models apply their rate multipliers at runtime and share
+    the compiled kernels, C library included, of `model` (see
+    GeertsModel.with_rate_multipliers); every ablation, baseline included,
+    runs as one task on the worker pool. Impact is the RMS change of the
+    arm-visit read-outs from the intact model, and 'score' the sum over
+    measures of that change relative to the RMS of the intact read-outs.
+    For pairs, 'interaction' is the same relative RMS of the part of the
+    change that the two single ablations do not add up to.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    params : dict
+        Parameter set
+    plan : SimulationPlan or None
+        Output of trial_registry.compile_plan, every registered trial when None
+    families : dict, list of str or None
+        Families to ablate, see family_reactions
+    pairs : bool, default True
+        Also run every pairwise ablation
+    measures : dict or None
+        Trial measure -> read-out, population.DEFAULT_MEASURES when None
+    processes : int or None
+        Worker processes
+    **options
+        Passed to simulate (method, rtol, atol, backend)
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per ablation ranked by 'score': 'ablation', 'families',
+        'n_reactions', 'n_failed' (read-outs that could not be simulated),
+        'score', 'interaction', and 'rms_<measure>' and 'max_<measure>'
+        changes per measure
+    """
+    measures = dict(DEFAULT_MEASURES if measures is None else measures)
+    plan = compile_plan(load_registry(), measures=measures) if plan is None else plan
+    members = family_reactions(model, families)
+    sets = ablation_sets(members, pairs)
+    tasks = [ablation_multipliers(model, members, ablated) for ablated in sets]
+
+    readouts = {}
+    for ablated, results in zip(sets, parallel_imap(_ablation_task, tasks, processes=processes,
+                                                    initializer=_init_worker,
+                                                    initargs=(model, params, plan, options))):
+        if results is not None:
+            readouts[ablated] = plan_readouts(plan, results, measures)
+    if () not in readouts:
+        raise RuntimeError("The intact model could not be simulated")
+    reference = readouts[()]
+    scale = {measure: _rms(values) for measure, values in reference.items()}
+
+    def change(ablated):
+        if ablated not in readouts:
+            return {measure: np.full_like(values, np.nan) for measure, values in reference.items()}
+        return {measure: readouts[ablated][measure] - values for measure, values in reference.items()}
+
+    rows = []
+    for ablated in sets[1:]:
+        delta = change(ablated)
+        row = {'ablation': ' + '.join(ablated), 'families': ablated,
+               'n_reactions': int(np.sum(tasks[sets.index(ablated)] == 0.0)),
+               'n_failed': int(sum(np.sum(~np.isfinite(values)) for values in delta.values())),
+               'score': sum(_rms(values) / scale[measure] for measure, values in delta.items()),
+               'interaction': np.nan}
+        if len(ablated) == 2:
+            first, second = change(ablated[:1]), change(ablated[1:])
+            row['interaction'] = sum(_rms(values - first[measure] - second[measure]) / scale[measure]
+                                     for measure, values in delta.items())
+        for measure, values in delta.items():
+            row[f'rms_{measure}'] = _rms(values)
+            finite = np.isfinite(values)
+            row[f'max_{measure}'] = float(np.max(np.abs(values[finite]))) if np.any(finite) else np.nan
+        rows.append(row)
+    table = pd.DataFrame(rows)
+    return table.sort_values('score', ascending=False, na_position='first', ignore_index=True)
+
+
+def main(argv=None):
+    from geerts_cli import load_model, load_parameters
+
+    parser = argparse.ArgumentParser(description="Rank reaction-family ablations by their impact on "
+                                                 "the registered trials")
+    parser.add_argument('params_file', nargs='?',
+                        help="Parameter set (.csv with Name/Value columns or .json)")
+    parser.add_argument('--families', nargs='+', default=None, choices=sorted(REACTION_FAMILIES),
+                        metavar='FAMILY', help="Families to ablate (default: all)")
+    parser.add_argument('--studies', nargs='+', default=None, help="Studies to simulate (default: all)")
+    parser.add_argument('--singles', action='store_true', help="Skip pairwise ablations")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes")
+    parser.add_argument('--output', default=None, help="Write the table to this CSV file")
+    parser.add_argument('--list', action='store_true', help="List the families and their reactions")
+    args = parser.parse_args(argv)
+
+    model = load_model()
+    members = family_reactions(model, args.families)
+    if args.list:
+        for family, indices in members.items():
+            names = sorted({model.reactions[i]['Reaction_name'].strip() for i in indices})
+            print(f"{family} ({len(indices)} reactions): {'; '.join(names)}")
+        return 0
+    if args.params_file is None:
+        parser.error("a parameter file is required")
+    plan = compile_plan(load_registry(), args.studies)
+    table = run_ablations(model, load_parameters({'params_file': args.params_file}), plan, args.families,
+                          pairs=not args.singles, processes=args.processes)
+    if args.output:
+        table.drop(columns='families').to_csv(args.output, index=False)
+    print(table.drop(columns='families').to_string(index=False, float_format='{:.4g}'.format))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,241 @@
+"""
+Arrow-Plus-Banded Linear Solver
+BDF variant whose Newton systems are solved by a banded LU on the aggregation chains and a
+Schur-complement step for the monomer/plaque/antibody couplings and compartment transport
+"""
+
+import numpy as np
+from scipy import sparse
+from scipy.integrate import BDF
+from scipy.linalg import lu_factor, lu_solve
+from scipy.linalg.lapack import dgbtrf, dgbtrs
+from scipy.sparse.csgraph import connected_components, reverse_cuthill_mckee
+from scipy.sparse.linalg import splu
+
+
+class ArrowBandedStructure:
+    """
+    Partition of the species into a banded block and a general block
+
+    Parameters:
+    -----------
+    banded : numpy.ndarray
+        Species in the banded block, in band order
+    general : numpy.ndarray
+        All other species (border species coupled to many others, and
+        components whose bandwidth is too large), solved by sparse LU
+    bandwidth : int
+        Half-bandwidth of the banded block
+    sparsity : scipy.sparse matrix or None
+        Jacobian pattern, used to find the few general species coupled to the
+        banded block
+    """
+
+    def __init__(self, banded, general, bandwidth, sparsity=None):
+        self.banded = np.asarray(banded, dtype=int)
+        self.general = np.asarray(general, dtype=int)
+        self.bandwidth = int(bandwidth)
+        self.order = np.concatenate([self.banded, self.general])
+
+        # Couplings between the blocks; all of them when the pattern is unknown
+        if sparsity is None:
+            self.coupled_columns = np.arange(len(self.general))
+            self.coupled_rows = np.arange(len(self.general))
+        else:
+            pattern = sparse.csr_matrix(sparsity)
+            upper = pattern[self.banded][:, self.general].tocsc()
+            lower = pattern[self.general][:, self.banded].tocsr()
+            self.coupled_columns = np.flatnonzero(np.diff(upper.indptr))
+            self.coupled_rows = np.flatnonzero(np.diff(lower.indptr))
+
+        # Where each species lands in [banded, general] order, and the slot of each
+        # general species among the coupled columns/rows (-1 when uncoupled)
+        self.position = np.empty(len(self.order), dtype=int)
+        self.position[self.order] = np.arange(len(self.order))
+        self.column_slot = np.full(len(self.general), -1)
+        self.column_slot[self.coupled_columns] = np.arange(len(self.coupled_columns))
+        self.row_slot = np.full(len(self.general), -1)
+        self.row_slot[self.coupled_rows] = np.arange(len(self.coupled_rows))
+
+    def __repr__(self):
+        return (f"<ArrowBandedStructure banded={len(self.banded)} (bandwidth {self.bandwidth}), "
+                f"general={len(self.general)}>")
+
+
+def arrow_banded_structure(sparsity, max_bandwidth=8, border_degree=None):
+    """
+    Recognise the arrow-plus-banded structure of a Jacobian sparsity pattern
+
+    Species coupled to more than border_degree others (the monomers, plaque
+    and free antibody, which react with every oligomer) form the border. The
+    rest splits into connected components, each reordered by reverse
+    Cuthill-McKee; components within max_bandwidth (the oligomer chains)
+    form the banded block and the others (compartment transport) join the
+    border in the general block.
+
+    Parameters:
+    -----------
+    sparsity : scipy.sparse matrix or numpy.ndarray
+        Jacobian sparsity pattern
+    max_bandwidth : int, default 8
+        Largest half-bandwidth accepted for the banded block
+    border_degree : int or None
+        Coupling count above which a species is a border species, default
+        2 * max_bandwidth (such a species cannot fit in the band)
+
+    Returns:
+    --------
+    ArrowBandedStructure
+    """
+    border_degree = 2 * max_bandwidth if border_degree is None else border_degree
+    graph = sparse.csr_matrix(sparsity, dtype=float)
+    graph = ((abs(graph) + abs(graph.T)) != 0).astype(float).tolil()
+    graph.setdiag(0)
+    graph = graph.tocsr()
+    graph.eliminate_zeros()
+    degree = np.diff(graph.indptr)
+
+    border = np.flatnonzero(degree > border_degree)
+    rest = np.flatnonzero(degree <= border_degree)
+    subgraph = graph[rest][:, rest]
+    n_components, labels = connected_components(subgraph, directed=False)
+    banded, general, bandwidth = [], [border], 0
+    for component in range(n_components):
+        members = np.flatnonzero(labels == component)
+        block = subgraph[members][:, members].tocsr()
+        order = reverse_cuthill_mckee(block, symmetric_mode=True)
+        coo = block[order][:, order].tocoo()
+        width = int(np.max(np.abs(coo.row - coo.col))) if coo.nnz else 0
+        if width <= max_bandwidth:
+            banded.append(rest[members[order]])
+            bandwidth = max(bandwidth, width)
+        else:
+            general.append(rest[members])
+    banded = np.concatenate(banded) if banded else np.array([], dtype=int)
+    return ArrowBandedStructure(banded, np.sort(np.concatenate(general)), bandwidth, sparsity)
+
+
+class ArrowBandedLU:
+    """
+    Factorisation of A = [[B, E], [F, C]] with B banded
+
+    B is factored by LAPACK banded LU in O(n * bandwidth^2). The Schur
+    complement S = C - F B^-1 E only involves the few columns of E and rows
+    of F that are non-zero. S is factored by dense LU when it has at most
+    dense_limit rows and by general sparse LU otherwise.
+
+    Parameters:
+    -----------
+    A : scipy.sparse matrix or numpy.ndarray
+        Matrix to factor (n x n)
+    structure : ArrowBandedStructure
+        Partition from arrow_banded_structure
+    dense_limit : int, default 200
+        Largest Schur complement factored densely
+    """
+
+    def __init__(self, A, structure, dense_limit=200):
+        self.structure = structure
+        s = structure
+        # Blocks are scattered from the non-zeros of A in O(nnz), never densified
+        if sparse.issparse(A):
+            A = sparse.csc_matrix(A)
+            A.sum_duplicates()
+            rows, data = A.indices, A.data
+            cols = np.repeat(np.arange(A.shape[1]), np.diff(A.indptr))
+        else:
+            A = np.asarray(A)
+            rows, cols = np.nonzero(A)
+            data = A[rows, cols]
+        rows, cols = s.position[rows], s.position[cols]
+        n_banded, width = len(s.banded), s.bandwidth
+        upper, left = rows < n_banded, cols < n_banded
+
+        # LAPACK band storage with width extra rows for pivoting fill-in
+        inside = upper & left & (np.abs(rows - cols) <= width)
+        band = np.zeros((3 * width + 1, n_banded))
+        band[2 * width + rows[inside] - cols[inside], cols[inside]] = data[inside]
+        self.lu, self.piv, info = dgbtrf(band, width, width)
+        if info > 0:
+            raise np.linalg.LinAlgError("Singular banded block")
+        if info < 0:
+            raise np.linalg.LinAlgError(f"Banded LU failed (dgbtrf info {info})")
+
+        E = np.zeros((n_banded, len(s.coupled_columns)))
+        inside = upper & ~left
+        slots = s.column_slot[cols[inside] - n_banded]
+        E[rows[inside][slots >= 0], slots[slots >= 0]] = data[inside][slots >= 0]
+        self.W = self._solve_banded(E)
+        self.F = np.zeros((len(s.coupled_rows), n_banded))
+        inside = ~upper & left
+        slots = s.row_slot[rows[inside] - n_banded]
+        self.F[slots[slots >= 0], cols[inside][slots >= 0]] = data[inside][slots >= 0]
+        correction = self.F @ self.W
+        inside = ~upper & ~left
+        entries = (data[inside], (rows[inside] - n_banded, cols[inside] - n_banded))
+        if len(s.general) <= dense_limit:
+            schur = np.zeros((len(s.general), len(s.general)))
+            schur[entries[1]] = entries[0]
+            schur[np.ix_(s.coupled_rows, s.coupled_columns)] -= correction
+            factors = lu_factor(schur, overwrite_a=True, check_finite=False)
+            self._solve_schur = lambda rhs: lu_solve(factors, rhs, check_finite=False)
+        else:
+            schur = sparse.csr_matrix(entries, shape=(len(s.general), len(s.general)))
+            i, j = np.meshgrid(s.coupled_rows, s.coupled_columns, indexing='ij')
+            schur = schur - sparse.csr_matrix((correction.ravel(), (i.ravel(), j.ravel())),
+                                              shape=schur.shape)
+            self._solve_schur = splu(sparse.csc_matrix(schur)).solve
+
+    def _solve_banded(self, b):
+        x, info = dgbtrs(self.lu, self.structure.bandwidth, self.structure.bandwidth, b, self.piv)
+        if info != 0:
+            raise np.linalg.LinAlgError(f"Banded solve failed (dgbtrs info {info})")
+        return x
+
+    def solve(self, b):
+        s = self.structure
+        x_banded = self._solve_banded(b[s.banded])
+        rhs = b[s.general]
+        rhs[s.coupled_rows] -= self.F @ x_banded
+        x_general = self._solve_schur(rhs)
+        x_banded -= self.W @ x_general[s.coupled_columns]
+        x = np.empty_like(b)
+        x[s.banded] = x_banded
+        x[s.general] = x_general
+        return x
+
+
+class ArrowBDF(BDF):
+    """
+    scipy BDF whose Newton matrices are factored with ArrowBandedLU
+
+    Parameters:
+    -----------
+    structure : ArrowBandedStructure or None
+        Partition to use, recognised from jac_sparsity when None
+    max_bandwidth : int, default 8
+        Passed to arrow_banded_structure when recognising the structure
+    **options
+        Passed to scipy.integrate.BDF (jac or jac_sparsity, rtol, atol, ...)
+    """
+
+    def __init__(self, fun, t0, y0, t_bound, structure=None, max_bandwidth=8, **options):
+        super().__init__(fun, t0, y0, t_bound, **options)
+        if structure is None:
+            pattern = options.get('jac_sparsity')
+            if pattern is None:
+                raise ValueError("ArrowBDF needs a structure or jac_sparsity")
+            structure = arrow_banded_structure(pattern, max_bandwidth)
+        if not len(structure.banded) or np.iscomplexobj(self.y):
+            return
+        self.structure = structure
+
+        def lu(A):
+            self.nlu += 1
+            return ArrowBandedLU(A, structure)
+
+        def solve_lu(LU, b):
+            return LU.solve(b)
+
+        self.lu = lu
+        self.solve_lu = solve_lu
@@ -0,0 +1,102 @@
+"""
+Checkpoint/Restart
+Compact .npz checkpoints with atomic writes, and capture and restore of the full BDF solver
+state so an interrupted integration of the compiled model resumes bit-for-bit
+"""
+
+import os
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+
+# Scalar attributes of scipy's BDF (and ArrowBDF) that determine the next step
+SOLVER_SCALARS = ('t', 'h_abs', 'order', 'n_equal_steps', 'nfev', 'njev', 'nlu')
+
+
+def write_checkpoint(path, **arrays):
+    """
+    Atomically write arrays to an .npz file (a partial file never replaces a good one)
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path):
+    """
+    All arrays of an .npz checkpoint, loaded into memory
+    """
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _pack_matrix(prefix, matrix):
+    if sparse.issparse(matrix):
+        matrix = sparse.csc_matrix(matrix)
+        return {f'{prefix}_data': matrix.data, f'{prefix}_indices': matrix.indices,
+                f'{prefix}_indptr': matrix.indptr, f'{prefix}_shape': np.array(matrix.shape)}
+    return {prefix: np.asarray(matrix)}
+
+
+def _unpack_matrix(prefix, state):
+    if f'{prefix}_data' in state:
+        return sparse.csc_matrix((state[f'{prefix}_data'], state[f'{prefix}_indices'],
+                                  state[f'{prefix}_indptr']), shape=tuple(state[f'{prefix}_shape']))
+    return state[prefix].copy() if prefix in state else None
+
+
+def track_factorizations(solver):
+    """
+    Keep a copy of the matrix behind the solver's current LU factorisation
+
+    BDF reuses a factorisation across step-size changes, so it cannot be
+    rebuilt from the current step size; re-factorising the recorded matrix
+    reproduces it exactly.
+    """
+    factorize = solver.lu
+
+    def lu(matrix):
+        solver.lu_matrix = matrix.copy()
+        return factorize(matrix)
+    solver.lu = lu
+    solver.lu_matrix = None
+    return solver
+
+
+def solver_state(solver):
+    """
+    Arrays describing a BDF solver between steps, prefixed 'solver_'
+    """
+    state = {name: np.asarray(getattr(solver, name)) for name in SOLVER_SCALARS}
+    state.update(y=solver.y, D=solver.D, **_pack_matrix('J', solver.J))
+    if solver.jac_factor is not None:
+        state['jac_factor'] = solver.jac_factor
+    if solver.LU is not None:
+        state.update(_pack_matrix('lu_matrix', solver.lu_matrix))
+    return {f'solver_{key}': value for key, value in state.items()}
+
+
+def restore_solver(solver, checkpoint):
+    """
+    Put a freshly constructed (tracked) BDF solver into a saved state
+    """
+    state = {key[len('solver_'):]: value for key, value in checkpoint.items()
+             if key.startswith('solver_')}
+    for name in SOLVER_SCALARS:
+        setattr(solver, name, state[name].item())
+    solver.y = state['y'].copy()
+    solver.D = state['D'].copy()
+    solver.J = _unpack_matrix('J', state)
+    solver.jac_factor = state['jac_factor'].copy() if 'jac_factor' in state else None
+    solver.h_abs_old = None
+    solver.error_norm_old = None
+    solver.t_old = None
+    matrix = _unpack_matrix('lu_matrix', state)
+    nlu = solver.nlu
+    solver.LU = None if matrix is None else solver.lu(matrix)
+    solver.nlu = nlu
+    return solver
+
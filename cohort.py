@@ -0,0 +1,296 @@
+"""
+Compact Virtual Cohorts
+Population container with one shared species and parameter index, contiguous parameter,
+state and output blocks, slot-based per-patient handles and zero-copy arm/cohort slicing
+"""
+
+import numpy as np
+
+from geerts_model import simulate, simulate_baseline
+from parallel import parallel_imap
+from population import BASELINE_EFFECT, omega_name
+
+
+class Patient:
+    """
+    Lightweight handle on one row of a Cohort; all data are views into its blocks
+    """
+
+    __slots__ = ('cohort', 'index')
+
+    def __init__(self, cohort, index):
+        self.cohort = cohort
+        self.index = index
+
+    def __repr__(self):
+        return f"<Patient {self.index} of {len(self.cohort)}>"
+
+    @property
+    def parameters(self):
+        return self.cohort.parameters[self.index]
+
+    @property
+    def baseline_years(self):
+        return float(self.cohort.baseline_years[self.index])
+
+    @property
+    def state(self):
+        return None if self.cohort.states is None else self.cohort.states[self.index]
+
+    @property
+    def outputs(self):
+        """
+        Read-outs (arms x outputs x times)
+        """
+        return None if self.cohort.outputs is None else self.cohort.outputs[:, self.index]
+
+    def parameter_dict(self):
+        """
+        Parameter set as a dict, for simulate
+        """
+        return self.cohort.parameter_dict(self.index)
+
+    def species(self, name):
+        """
+        Treatment-start amount of a species
+        """
+        return self.state[self.cohort.species_index[name]]
+
+
+class Cohort:
+    """
+    Virtual patients stored as contiguous blocks
+
+    Names are held once (shared with the model) and per-patient data live in
+    row blocks: parameters (n x n_parameters, float64), baseline_years (n,),
+    optional treatment-start states (n x n_species, float64) and read-outs
+    (n_arms x n x n_outputs x n_times, float64 or float32). Memory is
+    therefore linear in the number of patients with no per-patient Python
+    objects; Patient handles are created on access.
+
+    Slicing a cohort with a slice (cohort[10:20]) or selecting an arm
+    (cohort.arm('placebo')) returns views that share the blocks; index lists
+    copy, as in NumPy.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model, whose species and parameter names are shared
+    parameters : numpy.ndarray
+        Parameter block (n x len(model.parameters)) in model.parameters order
+    baseline_years : array-like or float, default 20
+        Untreated history length per patient
+    constants : dict or None
+        Entries shared by every patient that are not model parameters, e.g.
+        the read-out calibration (see geerts_model.OBSERVABLE_DEFAULTS)
+    """
+
+    def __init__(self, model, parameters, baseline_years=20.0, constants=None):
+        self.species = model.species
+        self.species_index = model.species_index
+        self.parameter_names = model.parameters
+        self.parameter_index = model.parameter_index
+        self.parameters = np.ascontiguousarray(parameters, dtype=float)
+        if self.parameters.shape[1:] != (len(self.parameter_names),):
+            raise ValueError(f"Parameter block must have {len(self.parameter_names)} columns")
+        self.baseline_years = np.broadcast_to(np.asarray(baseline_years, dtype=float),
+                                              (len(self.parameters),)).copy()
+        self.constants = dict(constants or {})
+        self.states = None
+        self.outputs = None
+        self.arm_labels = []
+        self.output_names = []
+        self.t_weeks = None
+
+    @classmethod
+    def from_draws(cls, model, params, effects, draws, baseline_years=20.0):
+        """
+        Cohort with log-normal random effects, as population.individual_parameters
+
+        Parameters:
+        -----------
+        model : GeertsModel
+            Compiled model
+        params : dict
+            Typical values, plus omega_<effect> for every random effect
+        effects : list of str
+            Parameters with random effects, or BASELINE_EFFECT
+        draws : numpy.ndarray
+            Standard-normal draws (n x n_effects)
+        baseline_years : float, default 20
+            Typical untreated history length
+        """
+        draws = np.asarray(draws, dtype=float)
+        parameters = np.tile(model.parameter_vector(params), (len(draws), 1))
+        years = np.full(len(draws), float(baseline_years))
+        for column, effect in enumerate(effects):
+            scale = np.exp(params.get(omega_name(effect), 0.0) * draws[:, column])
+            if effect == BASELINE_EFFECT:
+                years *= scale
+            else:
+                parameters[:, model.parameter_index[effect]] *= scale
+        omegas = {omega_name(effect) for effect in effects}
+        constants = {key: value for key, value in params.items()
+                     if key not in model.parameter_index and key not in omegas}
+        return cls(model, parameters, years, constants)
+
+    def __len__(self):
+        return len(self.parameters)
+
+    def __repr__(self):
+        return (f"<Cohort {len(self)} patients, {len(self.arm_labels)} arms, "
+                f"{self.nbytes / 1e6:.2f} MB>")
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            index = range(len(self))[index]
+            return Patient(self, index)
+        return self.select(index)
+
+    def __iter__(self):
+        return (Patient(self, i) for i in range(len(self)))
+
+    @property
+    def nbytes(self):
+        """
+        Bytes held by the data blocks (shared blocks count in full)
+        """
+        blocks = [self.parameters, self.baseline_years, self.states, self.outputs]
+        return sum(block.nbytes for block in blocks if block is not None)
+
+    def select(self, patients):
+        """
+        Sub-cohort sharing the blocks (a view for slices, a copy for index arrays)
+        """
+        view = object.__new__(Cohort)
+        view.__dict__.update(self.__dict__)
+        view.parameters = self.parameters[patients]
+        view.baseline_years = self.baseline_years[patients]
+        view.states = None if self.states is None else self.states[patients]
+        view.outputs = None if self.outputs is None else self.outputs[:, patients]
+        return view
+
+    def arm(self, label):
+        """
+        Read-outs of one arm (n x outputs x times), a view
+        """
+        return self.outputs[self.arm_labels.index(label)]
+
+    def output(self, name, arm=None):
+        """
+        One read-out (arms x n x times, or n x times for one arm), a view
+        """
+        values = self.outputs[:, :, self.output_names.index(name)]
+        return values if arm is None else values[self.arm_labels.index(arm)]
+
+    def parameter_dict(self, index):
+        """
+        Parameter set of one patient as a dict
+        """
+        return {**self.constants, **dict(zip(self.parameter_names, self.parameters[index].tolist()))}
+
+    def allocate(self, arms, outputs, t_eval_weeks, output_dtype=np.float64, keep_states=False):
+        """
+        Allocate the output block (and optionally the state block) for a simulation
+        """
+        self.arm_labels = list(arms)
+        self.output_names = list(outputs)
+        self.t_weeks = np.asarray(t_eval_weeks, dtype=float)
+        self.outputs = np.full((len(self.arm_labels), len(self), len(self.output_names), len(self.t_weeks)),
+                               np.nan, dtype=output_dtype)
+        self.states = np.full((len(self), len(self.species)), np.nan) if keep_states else None
+
+
+_MODEL = None
+_NAMES = None
+
+
+def _init_worker(model):
+    global _MODEL, _NAMES
+    _MODEL = model
+    _NAMES = model.parameters
+
+
+def _chunk_task(task):
+    """
+    Baselines and all arms of a range of patients, as compact arrays
+    """
+    parameters, years, constants, arms, t_weeks, outputs, output_dtype, keep_states, options = task
+    values = np.full((len(arms), len(parameters), len(outputs), len(t_weeks)), np.nan, dtype=output_dtype)
+    states = np.full((len(parameters), _MODEL.n_species), np.nan) if keep_states else None
+    solver_options = {key: options[key] for key in ('method', 'rtol', 'atol', 'backend') if key in options}
+    # Changes from baseline are recorded as levels and differenced afterwards
+    levels = list(dict.fromkeys(name[:-len('_change')] if name.endswith('_change') else name
+                                for name in outputs))
+    rows = [levels.index(name[:-len('_change')] if name.endswith('_change') else name) for name in outputs]
+    change = np.array([name.endswith('_change') for name in outputs])
+    for i, (row, years_i) in enumerate(zip(parameters, years)):
+        params = {**constants, **dict(zip(_NAMES, row.tolist()))}
+        try:
+            y0 = simulate_baseline(_MODEL, params, years_i, **solver_options).final_state
+            if keep_states:
+                states[i] = y0
+            for a, regimen in enumerate(arms):
+                y = simulate(_MODEL, params, t_weeks, y0=y0, regimen=regimen, outputs=levels, **options).y[rows]
+                y[change] -= y[change, :1]
+                values[a, i] = y
+        except (ArithmeticError, ValueError, RuntimeError):
+            continue
+    return values, states
+
+
+def simulate_cohort(model, cohort, arms, t_eval_weeks, outputs=('SUVR_change',), output_dtype=np.float64,
+                    keep_states=False, chunk_size=16, processes=None, **options):
+    """
+    Simulate every arm for every patient of a cohort, filling its blocks in place
+
+    Patients are sent to the workers in chunks of rows of the parameter
+    block; each chunk's read-outs are copied into the preallocated output
+    block as soon as it finishes; with at most two chunks per worker in
+    flight (see parallel.parallel_imap), peak memory stays at the blocks
+    plus a few chunks per worker.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    cohort : Cohort
+        Patients to simulate
+    arms : dict
+        Arm label -> regimen dict or None (placebo)
+    t_eval_weeks : array-like
+        Output times from treatment start, starting at 0
+    outputs : sequence of str
+        Species and/or 'plaque', 'SUVR', 'Centiloid' and their '_change' from
+        treatment start
+    output_dtype : numpy dtype, default float64
+        Storage type of the read-outs; float32 halves the output block
+    keep_states : bool, default False
+        Keep each patient's treatment-start state in cohort.states
+    chunk_size : int, default 16
+        Patients per task
+    processes : int or None
+        Worker processes
+    **options
+        Passed to simulate (method, rtol, atol, backend)
+
+    Returns:
+    --------
+    Cohort
+        The same cohort; failed patients are NaN
+    """
+    cohort.allocate(arms, outputs, t_eval_weeks, output_dtype, keep_states)
+    starts = range(0, len(cohort), chunk_size)
+    tasks = ((cohort.parameters[start:start + chunk_size], cohort.baseline_years[start:start + chunk_size],
+              cohort.constants, list(arms.values()), cohort.t_weeks, cohort.output_names, output_dtype,
+              keep_states, options)
+             for start in starts)
+    for start, (values, states) in zip(starts, parallel_imap(_chunk_task, tasks, processes=processes,
+                                                             initializer=_init_worker, initargs=(model,))):
+        cohort.outputs[:, start:start + values.shape[1]] = values
+        if keep_states:
+            cohort.states[start:start + len(states)] = states
+    failed = np.sum(~np.all(np.isfinite(cohort.outputs), axis=(0, 2, 3)))
+    if failed:
+        print(f"Cohort: {failed} of {len(cohort)} patients failed")
+    return cohort
@@ -0,0 +1,257 @@
+"""
+Variance-Reduced Ensemble Simulation
+Virtual-cohort estimates of trial arm means and treatment-minus-control differences using
+common random numbers, antithetic or randomized quasi-Monte Carlo draws and control variates
+"""
+
+import numpy as np
+from scipy.stats import norm, qmc
+
+from population import simulate_population
+
+SAMPLING = ('random', 'antithetic', 'sobol')
+
+
+class DrawStream:
+    """
+    Extendable stream of standard-normal subject draws grouped into independent units
+
+    Standard errors are computed from unit means, which are independent and
+    identically distributed for every sampling scheme:
+
+    - 'random': each subject is a unit
+    - 'antithetic': each pair (z, -z) is a unit, cancelling the part of the
+      response that is odd in z
+    - 'sobol': each of `replicates` independently scrambled Sobol sequences
+      is a unit (randomized QMC); every draw doubles the replicate length,
+      keeping the sequences balanced
+
+    Parameters:
+    -----------
+    n_effects : int
+        Random effects per subject
+    sampling : str, default 'antithetic'
+        One of SAMPLING
+    seed : int or None
+        Seed of the stream
+    replicates : int, default 8
+        Scrambled sequences for 'sobol'
+    """
+
+    def __init__(self, n_effects, sampling='antithetic', seed=None, replicates=8):
+        if sampling not in SAMPLING:
+            raise ValueError(f"Unknown sampling: {sampling}")
+        self.n_effects = n_effects
+        self.sampling = sampling
+        self.rng = np.random.default_rng(seed)
+        self.n_units = 0
+        if sampling == 'sobol':
+            seeds = self.rng.integers(2 ** 32, size=replicates)
+            self.engines = [qmc.Sobol(n_effects, scramble=True, seed=int(s)) for s in seeds]
+            self.n_units = replicates
+
+    def draw(self, n):
+        """
+        Next draws for about n more subjects
+
+        Returns:
+        --------
+        tuple
+            (draws (subjects x n_effects), unit id per subject)
+        """
+        if self.sampling == 'random':
+            units = self.n_units + np.arange(n)
+            self.n_units += n
+            return self.rng.standard_normal((n, self.n_effects)), units
+        if self.sampling == 'antithetic':
+            pairs = max(1, n // 2)
+            z = self.rng.standard_normal((pairs, self.n_effects))
+            units = self.n_units + np.arange(pairs)
+            self.n_units += pairs
+            return np.concatenate([z, -z]), np.concatenate([units, units])
+        drawn = self.engines[0].num_generated
+        m = max(drawn, 2 ** int(np.ceil(np.log2(max(1, n / len(self.engines))))))
+        points = [engine.random(m) for engine in self.engines]
+        z = norm.ppf(np.clip(np.concatenate(points), 1e-12, 1 - 1e-12))
+        return z, np.repeat(np.arange(len(self.engines)), m)
+
+
+def unit_means(values, units):
+    """
+    Average per-subject values (subjects x ...) over subjects of the same unit
+
+    Returns:
+    --------
+    numpy.ndarray
+        Unit means (n_units x ...), in order of unit id
+    """
+    ids, inverse, counts = np.unique(units, return_inverse=True, return_counts=True)
+    sums = np.zeros((len(ids),) + values.shape[1:])
+    np.add.at(sums, inverse, values)
+    return sums / counts.reshape((-1,) + (1,) * (values.ndim - 1))
+
+
+def draw_controls(draws):
+    """
+    Control variates with known mean zero: the draws z and z^2 - 1
+    """
+    return np.concatenate([draws, draws ** 2 - 1.0], axis=1)
+
+
+def control_variate_mean(y, controls=None):
+    """
+    Mean of i.i.d. values with regression control variates of known mean zero
+
+    The estimate is the intercept of the least-squares fit y = a + C b, i.e.
+    mean(y) - b . mean(C); its standard error comes from the residuals.
+    Controls without variation (e.g. the linear draws under antithetic
+    pairing) are dropped.
+
+    Parameters:
+    -----------
+    y : numpy.ndarray
+        Unit values (n_units x ...)
+    controls : numpy.ndarray or None
+        Unit control values (n_units x n_controls)
+
+    Returns:
+    --------
+    tuple
+        (mean, standard error) arrays of shape y.shape[1:]
+    """
+    n = len(y)
+    flat = y.reshape(n, -1)
+    if controls is not None:
+        controls = controls[:, np.std(controls, axis=0) > 1e-12 * (1 + np.abs(controls).max())]
+    if controls is None or controls.shape[1] == 0 or n <= controls.shape[1] + 2:
+        se = flat.std(axis=0, ddof=1) / np.sqrt(n) if n > 1 else np.full(flat.shape[1], np.inf)
+        return flat.mean(axis=0).reshape(y.shape[1:]), se.reshape(y.shape[1:])
+    design = np.column_stack([np.ones(n), controls])
+    coefficients, *_ = np.linalg.lstsq(design, flat, rcond=None)
+    residuals = flat - design @ coefficients
+    dof = n - design.shape[1]
+    # Variance of the intercept at the known control mean (zero)
+    cov = np.linalg.pinv(design.T @ design)[0, 0]
+    se = np.sqrt(cov * np.sum(residuals ** 2, axis=0) / dof)
+    return coefficients[0].reshape(y.shape[1:]), se.reshape(y.shape[1:])
+
+
+def arm_difference(model, params, arms, effects, t_eval_weeks=(0.0, 78.0), outputs=('SUVR_change',),
+                   reference=None, target_se=None, target=None, sampling='antithetic', controls=True,
+                   batch=32, max_subjects=1024, seed=None, replicates=8, baseline_years=20.0,
+                   processes=None, **options):
+    """
+    Estimate arm means and treatment-minus-reference differences of a virtual cohort
+
+    Every subject is simulated in all arms (common random numbers), so the
+    paired differences are free of between-subject variability that the
+    arms share; with the placebo arm as reference, the subject's untreated
+    trajectory acts as a control variate with coefficient one. Subjects are
+    added in rounds of about `batch` until the standard error of every
+    difference at `target` is at most target_se, or max_subjects is reached.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    params : dict
+        Typical values and omega_<effect> SDs, see population.individual_parameters
+    arms : dict
+        Arm label -> regimen dict or None (placebo)
+    effects : list of str
+        Parameters with random effects (and/or population.BASELINE_EFFECT)
+    t_eval_weeks : array-like
+        Output times from treatment start, starting at 0
+    outputs : sequence of str
+        Read-outs, see SimulationResult.observable
+    reference : str or None
+        Arm subtracted from the others, the first placebo arm (else the first arm) when None
+    target_se : float or None
+        Required standard error of the differences; a single round of
+        max_subjects when None
+    target : tuple or None
+        (output, time_weeks) the precision applies to, the last time of the
+        first output when None
+    sampling : str, default 'antithetic'
+        'random', 'antithetic' or 'sobol', see DrawStream
+    controls : bool, default True
+        Use the draws z and z^2 - 1 as control variates (not with 'sobol',
+        whose replicate means already balance them)
+    batch : int, default 32
+        Subjects per round ('sobol' doubles the cohort each round instead)
+    max_subjects : int, default 1024
+        Largest cohort
+    seed : int or None
+        Seed of the draws
+    replicates : int, default 8
+        Scrambled sequences for 'sobol'
+    baseline_years : float, default 20
+        Typical untreated history length
+    processes : int or None
+        Worker processes
+    **options
+        Passed to population.simulate_population (method, rtol, atol, backend)
+
+    Returns:
+    --------
+    dict
+        'mean' and 'mean_se' (arm -> outputs x times), 'difference' and
+        'difference_se' (arm -> outputs x times, non-reference arms),
+        'n_subjects', 'n_simulations', 'converged' and 'history' (list of
+        (n_subjects, largest target SE) per round)
+    """
+    labels = list(arms)
+    if reference is None:
+        reference = next((label for label in labels if arms[label] is None), labels[0])
+    t_weeks = np.asarray(t_eval_weeks, dtype=float)
+    outputs = list(outputs)
+    output, time = target if target is not None else (outputs[0], t_weeks[-1])
+    position = (outputs.index(output), int(np.argmin(np.abs(t_weeks - time))))
+    reference_index = labels.index(reference)
+    others = [i for i in range(len(labels)) if i != reference_index]
+    use_controls = controls and sampling != 'sobol'
+
+    stream = DrawStream(len(effects), sampling, seed, replicates)
+    values, draws, units, history = [], [], [], []
+    converged = False
+    while True:
+        drawn = sum(len(d) for d in draws)
+        size = min(batch if target_se is not None else max_subjects, max_subjects - drawn)
+        if size <= 0 or (sampling == 'sobol' and drawn and 2 * drawn > max_subjects):
+            # Sobol rounds double the cohort, which must stay within max_subjects
+            break
+        z, unit = stream.draw(size)
+        result = simulate_population(model, params, [arms[label] for label in labels], t_weeks,
+                                     effects, z, outputs, baseline_years, processes, **options)
+        keep = np.all(np.isfinite(result), axis=(1, 2, 3))
+        if not np.all(keep):
+            print(f"Ensemble: dropping {np.sum(~keep)} subjects whose integration failed")
+        values.append(result[keep])
+        draws.append(z[keep])
+        units.append(unit[keep])
+
+        subjects = np.concatenate(values)
+        unit_values = unit_means(subjects, np.concatenate(units))
+        unit_controls = (unit_means(draw_controls(np.concatenate(draws)), np.concatenate(units))
+                         if use_controls else None)
+        differences = unit_values[:, others] - unit_values[:, [reference_index]]
+        difference, difference_se = control_variate_mean(differences, unit_controls)
+        worst = np.max(difference_se[(slice(None),) + position])
+        history.append((len(subjects), float(worst)))
+        print(f"Ensemble: {len(subjects)} subjects, target SE {worst:.3g}")
+        if target_se is None or worst <= target_se:
+            converged = target_se is not None
+            break
+
+    mean, mean_se = control_variate_mean(unit_values, unit_controls)
+    return {
+        'mean': {label: mean[i] for i, label in enumerate(labels)},
+        'mean_se': {label: mean_se[i] for i, label in enumerate(labels)},
+        'difference': {labels[i]: difference[j] for j, i in enumerate(others)},
+        'difference_se': {labels[i]: difference_se[j] for j, i in enumerate(others)},
+        'reference': reference,
+        'n_subjects': len(subjects),
+        'n_simulations': len(subjects) * len(labels),
+        'converged': converged,
+        'history': history,
+    }
@@ -0,0 +1,71 @@
+"""
+Integration Events
+Threshold crossings of observables or species located by root finding during
+integration, used to record clinical milestones, end runs early or stop dosing
+"""
+
+from geerts_model import output_weights
+
+ACTIONS = ('record', 'terminate', 'stop_dosing')
+
+# Amyloid-negativity thresholds used by the donanemab trials
+TRAILBLAZER_COMPLETION_CENTILOID = 24.1
+TRAILBLAZER_CLEARANCE_CENTILOID = 11.0
+
+
+class ObservableEvent:
+    """
+    Crossing of a threshold by an observable or a species amount
+
+    Parameters:
+    -----------
+    name : str
+        Label used in the event log
+    quantity : str
+        'plaque', 'SUVR', 'Centiloid' or a species name (e.g. 'Antibody_ISF')
+    threshold : float
+        Value whose crossing triggers the event
+    direction : int, default -1
+        -1 for falling through the threshold, +1 for rising, 0 for either
+    action : str, default 'record'
+        'record' (log every crossing), 'terminate' (end the run at the first
+        crossing) or 'stop_dosing' (cancel all later doses at the first
+        crossing and continue, as in the donanemab stop-on-clearance protocol)
+
+    Examples:
+    ---------
+    >>> cleared = ObservableEvent('amyloid cleared', 'Centiloid', 24.1, action='stop_dosing')
+    >>> result = simulate(model, params, [0, 78], y0=baseline, regimen=regimen, events=[cleared])
+    >>> result.event_times('amyloid cleared')
+    """
+
+    def __init__(self, name, quantity, threshold, direction=-1, action='record'):
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown event action: {action}")
+        if quantity.endswith('_change'):
+            raise ValueError("Events on changes from baseline are not supported; use an absolute threshold")
+        self.name = name
+        self.quantity = quantity
+        self.threshold = float(threshold)
+        self.direction = direction
+        self.action = action
+
+    def bind(self, model, params):
+        """
+        Event function g(t, y) for scipy.integrate.solve_ivp
+
+        All supported quantities are affine in the state, so the weights are
+        computed once here and each evaluation is a single dot product.
+        """
+        weights, offset = output_weights(model, [self.quantity], params)
+        weights = weights[0]
+        shift = offset[0] - self.threshold
+
+        def g(t, y):
+            return weights @ y + shift
+
+        g.terminal = self.action != 'record'
+        g.direction = self.direction
+        g.event = self
+        return g
+
@@ -0,0 +1,219 @@
+"""
+Parameter Fitting Utilities
+Bounded local optimisation of an objective over named model parameters, with checkpoints
+that replay the evaluated-point archive to resume an interrupted fit exactly
+"""
+
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy.optimize import minimize
+
+from checkpoint import read_checkpoint, write_checkpoint
+from simulation_cache import cache_key
+
+
+def to_search_space(values, log_scale=True):
+    """
+    Map positive parameter values to the optimiser's search space (log10)
+    """
+    values = np.asarray(values, dtype=float)
+    if not log_scale:
+        return values.copy()
+    if np.any(values <= 0):
+        raise ValueError("Log-scaled parameters must be strictly positive")
+    return np.log10(values)
+
+
+def from_search_space(z, log_scale=True):
+    """
+    Map search-space coordinates back to parameter values
+    """
+    z = np.asarray(z, dtype=float)
+    return 10.0 ** z if log_scale else z.copy()
+
+
+def search_bounds(names, bounds=None, log_scale=True):
+    """
+    Convert per-parameter bounds to search-space bounds
+
+    Parameters:
+    -----------
+    names : list of str
+        Free parameter names
+    bounds : dict or None
+        Mapping name -> (lower, upper) in natural units; missing entries are unbounded
+    log_scale : bool
+        Whether the search space is log10
+
+    Returns:
+    --------
+    list of tuple
+        (lower, upper) search-space bounds, None where unbounded
+    """
+    bounds = bounds or {}
+    result = []
+    for name in names:
+        lower, upper = bounds.get(name, (None, None))
+        if log_scale:
+            lower = None if lower is None or lower <= 0 else np.log10(lower)
+            upper = None if upper is None else np.log10(upper)
+        result.append((lower, upper))
+    return result
+
+
+class ObjectiveInSearchSpace:
+    """
+    Picklable wrapper evaluating a dict-based objective at search-space points
+
+    Non-finite objective values are replaced by a large penalty so failed
+    solves steer the optimiser away instead of aborting the fit.
+    """
+
+    def __init__(self, objective, names, fixed=None, log_scale=True, penalty=1e12):
+        self.objective = objective
+        self.names = list(names)
+        self.fixed = dict(fixed or {})
+        self.log_scale = log_scale
+        self.penalty = penalty
+
+    def params(self, z):
+        params = dict(self.fixed)
+        params.update(zip(self.names, from_search_space(z, self.log_scale)))
+        return params
+
+    def __call__(self, z):
+        value = self.objective(self.params(z))
+        return float(value) if np.isfinite(value) else self.penalty
+
+
+class ArchivedObjective:
+    """
+    Search-space objective that archives every evaluation and replays archived ones
+
+    The archive (points and values in evaluation order) is written to an
+    .npz checkpoint at most every `interval` seconds and when the fit ends.
+    scipy's optimisers are deterministic, so rerunning a fit from the same
+    start against the archive replays the interrupted run without calling
+    the objective, which reconstructs the optimiser state exactly, and then
+    continues with new evaluations.
+
+    Parameters:
+    -----------
+    objective : callable
+        Objective of a search-space point, e.g. ObjectiveInSearchSpace
+    path : str or Path
+        Checkpoint file (.npz); an existing one is loaded
+    fingerprint : str
+        Identity of the fit; a checkpoint with another fingerprint is refused
+    interval : float, default 60
+        Seconds between checkpoints
+    """
+
+    def __init__(self, objective, path, fingerprint, interval=60.0):
+        self.objective = objective
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self.interval = interval
+        self.points, self.values = [], []
+        if self.path.exists():
+            saved = read_checkpoint(self.path)
+            if str(saved['fingerprint']) != fingerprint:
+                raise ValueError(f"Checkpoint {self.path} belongs to a different fit")
+            self.points, self.values = list(saved['points']), saved['values'].tolist()
+        self.archive = {point.tobytes(): value for point, value in zip(self.points, self.values)}
+        self.n_replayed = 0
+        self.last_write = time.monotonic()
+
+    def __call__(self, z):
+        z = np.asarray(z, dtype=float)
+        key = z.tobytes()
+        if key in self.archive:
+            self.n_replayed += 1
+            return self.archive[key]
+        value = self.objective(z)
+        self.points.append(z.copy())
+        self.values.append(value)
+        self.archive[key] = value
+        if time.monotonic() - self.last_write >= self.interval:
+            self.save()
+        return value
+
+    def save(self):
+        """
+        Write the archive to the checkpoint file
+        """
+        write_checkpoint(self.path, fingerprint=self.fingerprint, points=np.array(self.points),
+                         values=np.array(self.values, dtype=float))
+        self.last_write = time.monotonic()
+
+
+def fit_parameters(objective, x0, names=None, fixed=None, bounds=None, log_scale=True,
+                   method='Nelder-Mead', options=None, callback=None, checkpoint_path=None,
+                   checkpoint_interval=60.0):
+    """
+    Fit named parameters by minimising an objective
+
+    Parameters:
+    -----------
+    objective : callable
+        Takes a dict of parameter values and returns a scalar, e.g. a negative
+        log-likelihood against the trial data
+    x0 : dict
+        Starting values for the free parameters
+    names : list of str or None
+        Free parameter names, defaults to the keys of x0
+    fixed : dict or None
+        Parameters held constant and passed through to the objective
+    bounds : dict or None
+        Mapping name -> (lower, upper) in natural units
+    log_scale : bool, default True
+        Optimise log10 of the parameters (rates span many orders of magnitude)
+    method : str, default 'Nelder-Mead'
+        Method passed to scipy.optimize.minimize
+    options : dict or None
+        Options passed to scipy.optimize.minimize
+    callback : callable or None
+        Called with the current parameter dict after every iteration
+        (including replayed ones when resuming)
+    checkpoint_path : str or Path or None
+        Checkpoint file (.npz) of the evaluated-point archive, see
+        ArchivedObjective; rerunning the same fit with the same file resumes
+        it, finishing exactly as the uninterrupted fit would
+    checkpoint_interval : float, default 60
+        Seconds between checkpoints
+
+    Returns:
+    --------
+    dict
+        'params' (free parameters at the optimum), 'fun', 'success', 'nfev'
+        and the raw scipy 'result'
+    """
+    names = list(x0) if names is None else list(names)
+    wrapped = ObjectiveInSearchSpace(objective, names, fixed=fixed, log_scale=log_scale)
+    z0 = to_search_space([x0[name] for name in names], log_scale)
+    if checkpoint_path is not None:
+        fingerprint = cache_key('fit', names, z0, wrapped.fixed, bounds, log_scale, method, options)
+        wrapped = ArchivedObjective(wrapped, checkpoint_path, fingerprint, checkpoint_interval)
+        if wrapped.values:
+            print(f"Resuming fit from {checkpoint_path}: {len(wrapped.values)} archived evaluations")
+
+    scipy_callback = None
+    if callback is not None:
+        def scipy_callback(intermediate_result):
+            z = getattr(intermediate_result, 'x', intermediate_result)
+            callback(dict(zip(names, from_search_space(z, log_scale))))
+
+    result = minimize(wrapped, z0, method=method,
+                      bounds=search_bounds(names, bounds, log_scale),
+                      options=options, callback=scipy_callback)
+    if checkpoint_path is not None:
+        wrapped.save()
+    return {
+        'params': dict(zip(names, from_search_space(result.x, log_scale))),
+        'fun': float(result.fun),
+        'success': bool(result.success),
+        'nfev': int(result.nfev),
+        'result': result,
+    }
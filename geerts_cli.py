@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Geerts Command-Line Interface
+Single entry point for model, simulation, queue and plotting tasks that imports heavy
+libraries only in the subcommand that needs them and loads a prebuilt model artifact
+
+Usage:
+    python geerts_cli.py [--antibodies Lecanemab Donanemab] build-model [--strict]
+    python geerts_cli.py lint [--strict]
+    python geerts_cli.py info [--species] [--parameters]
+    python geerts_cli.py --timings simulate PAYLOAD
+    python geerts_cli.py plot suvr
+    python geerts_cli.py queue status
+    python geerts_cli.py diff OLD NEW
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+_START = time.perf_counter()
+
+ROOT = Path(__file__).resolve().parent
+# Same location as the compiled C kernels (c_backend.CACHE_DIR), without importing numpy
+ARTIFACT_DIR = Path(os.environ.get('GEERTS_CACHE_DIR', ROOT / '.model_cache'))
+# Bump when the artifact layout changes so stale artifacts are not reused
+ARTIFACT_VERSION = 1
+# Files whose contents determine the compiled model
+MODEL_SOURCES = ('Geerts_reactions_full4.py', 'geerts_model.py')
+
+PLOTTERS = {
+    'suvr': 'suvr_plotter',
+    'lecanemab': 'lecanemab_plotter',
+    'donanemab': 'donanemab_plotter',
+    'emerge-engage': 'emerge_engage_plotter',
+    'dian-tu': 'dian_tu_plotter',
+}
+
+# Phase -> seconds, reported by --timings
+TIMINGS = {}
+
+
+@contextmanager
+def timed(phase):
+    """
+    Record the wall time of a block in TIMINGS
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        TIMINGS[phase] = TIMINGS.get(phase, 0.0) + time.perf_counter() - start
+
+
+def report_timings(stream=None):
+    """
+    Print the recorded phases and the time since this module was imported
+    """
+    stream = sys.stderr if stream is None else stream
+    for phase, seconds in TIMINGS.items():
+        print(f"{phase}: {1000 * seconds:.0f} ms", file=stream)
+    print(f"total since start: {1000 * (time.perf_counter() - _START):.0f} ms", file=stream)
+
+
+def source_hash(sources=MODEL_SOURCES):
+    """
+    SHA-256 of the model source files, identifying artifacts without building the model
+    """
+    digest = hashlib.sha256(f"v{ARTIFACT_VERSION}".encode())
+    for name in sources:
+        digest.update((ROOT / name).read_bytes())
+    return digest.hexdigest()
+
+
+def artifact_path(antibodies=None, artifact_dir=None):
+    """
+    Path of the pickled model for the current sources and antibody list
+
+    A JSON sidecar with the same stem (.json) holds metadata that can be read
+    without importing numpy.
+    """
+    artifact_dir = ARTIFACT_DIR if artifact_dir is None else Path(artifact_dir)
+    label = '-'.join(antibodies) if antibodies else 'default'
+    return artifact_dir / f"model_{source_hash()[:16]}_{label}.pkl"
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(suffix=path.suffix, dir=path.parent)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def build_model_artifact(antibodies=None, artifact_dir=None, lint=True, strict=False):
+    """
+    Compile the model and write it (with its metadata sidecar) to the artifact cache
+
+    The reaction list is checked with model_lint first; a list that fails the
+    gate (errors, or warnings when strict) is not saved.
+
+    Returns:
+    --------
+    tuple
+        (GeertsModel, artifact path)
+    """
+    import pickle
+    with timed('import geerts_model'):
+        from geerts_model import GeertsModel
+    with timed('model build'):
+        model = GeertsModel(antibodies=antibodies)
+    if lint:
+        with timed('lint'):
+            from model_lint import DEFAULT_SOURCE, gate, lint_reactions, print_findings
+            findings = lint_reactions(model.reactions, DEFAULT_SOURCE)
+        if not gate(findings, strict):
+            print_findings([item for item in findings if item['severity'] != 'info'], sys.stderr)
+            raise ValueError("Reaction list failed the lint gate; see model_lint.py")
+    path = artifact_path(antibodies, artifact_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _write_atomic(path, pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL))
+    metadata = {'model_hash': model.model_hash, 'antibodies': antibodies or [],
+                'n_species': model.n_species, 'n_fluxes': model.n_fluxes,
+                'n_reactions': len(model.reactions), 'species': model.species,
+                'parameters': model.parameters}
+    _write_atomic(path.with_suffix('.json'), json.dumps(metadata, indent=1).encode())
+    return model, path
+
+
+def load_model(antibodies=None, artifact_dir=None):
+    """
+    Compiled model from the artifact cache, built and saved on first use
+
+    Unpickling imports geerts_model (numpy/scipy) but skips build_reactions()
+    and compilation.
+    """
+    import pickle
+    path = artifact_path(antibodies, artifact_dir)
+    if path.exists():
+        with timed('import geerts_model'):
+            import geerts_model  # noqa: F401 (imported by unpickling; timed separately)
+        with timed('model load (artifact)'):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+    model, _ = build_model_artifact(antibodies, artifact_dir)
+    return model
+
+
+def model_metadata(antibodies=None, artifact_dir=None):
+    """
+    Artifact metadata (counts, species and parameter names), building the artifact if needed
+    """
+    path = artifact_path(antibodies, artifact_dir).with_suffix('.json')
+    if not path.exists():
+        build_model_artifact(antibodies, artifact_dir)
+    with timed('metadata load'):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+
+def load_parameters(payload):
+    """
+    Parameter set of a payload as in job_queue.job_parameters, read without pandas
+    """
+    params = {}
+    if payload.get('params_file'):
+        path = Path(payload['params_file'])
+        with open(path, encoding='utf-8', newline='') as f:
+            if path.suffix == '.csv':
+                import csv
+                params = {}
+                for row in csv.DictReader(f):
+                    try:
+                        params[row['Name']] = float(row['Value'])
+                    except (TypeError, ValueError):
+                        params[row['Name']] = float('nan')
+            else:
+                params = json.load(f)
+    return {**params, **payload.get('params', {}), **payload.get('overrides', {})}
+
+
+def _load_payload(text):
+    path = Path(text)
+    if path.suffix == '.json' and path.exists():
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return json.loads(text)
+
+
+def run_simulate(payload, antibodies=None, stream=None):
+    """
+    Simulate one treatment window (job_queue 'simulate' payload) and print it as CSV
+    """
+    stream = sys.stdout if stream is None else stream
+    model = load_model(antibodies)
+    with timed('import geerts_model'):
+        from geerts_model import simulate_treatment
+    outputs = payload.get('outputs', ['SUVR', 'Centiloid'])
+    options = {key: payload[key] for key in ('method', 'rtol', 'atol', 'backend') if key in payload}
+    with timed('simulate'):
+        result = simulate_treatment(model, load_parameters(payload), payload.get('t_eval_weeks', [0.0, 78.0]),
+                                    payload.get('regimen'), payload.get('baseline_years', 20.0),
+                                    outputs=outputs, **options)
+    print(','.join(['t_weeks'] + list(outputs)), file=stream)
+    for j, t in enumerate(result.t_weeks):
+        print(','.join([f"{t:g}"] + [f"{result.y[i, j]:.10g}" for i in range(len(outputs))]), file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Geerts model command-line tools")
+    parser.add_argument('--timings', action='store_true', help="Report import, load and run times on stderr")
+    parser.add_argument('--antibodies', nargs='+', default=None,
+                        help="Antibodies of the model (default: the single generic antibody)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build-model', help="Lint and compile the model and save the artifact")
+    build.add_argument('--no-lint', action='store_true', help="Skip the reaction list checks")
+    build.add_argument('--strict', action='store_true', help="Refuse to build on lint warnings too")
+
+    info = commands.add_parser('info', help="Show model size from the artifact metadata")
+    info.add_argument('--species', action='store_true', help="List species")
+    info.add_argument('--parameters', action='store_true', help="List parameters")
+
+    simulate = commands.add_parser('simulate', help="Simulate a treatment window and print CSV")
+    simulate.add_argument('payload', help="Payload as a JSON string or a .json file "
+                                          "(keys as for job_queue.py 'simulate' jobs)")
+
+    plot = commands.add_parser('plot', help="Run one of the trial data plotters")
+    plot.add_argument('name', choices=sorted(PLOTTERS))
+
+    for name, text in (('lint', "Reaction list checks, see model_lint.py"),
+                       ('queue', "Job queue commands, see job_queue.py"),
+                       ('diff', "Reaction list diff, see model_diff.py")):
+        commands.add_parser(name, help=text, add_help=False)
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    args, extra = parser.parse_known_args(argv)
+    if args.command in ('lint', 'queue', 'diff'):
+        # Everything after the subcommand belongs to the forwarded tool
+        forwarded = argv[argv.index(args.command) + 1:]
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    TIMINGS['startup'] = time.perf_counter() - _START
+
+    status = 0
+    if args.command == 'build-model':
+        try:
+            _, path = build_model_artifact(args.antibodies, lint=not args.no_lint, strict=args.strict)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 1
+        print(path)
+    elif args.command == 'info':
+        metadata = model_metadata(args.antibodies)
+        print(f"model {metadata['model_hash'][:12]}: {metadata['n_reactions']} reactions, "
+              f"{metadata['n_species']} species, {metadata['n_fluxes']} fluxes, "
+              f"{len(metadata['parameters'])} parameters")
+        for key in ('species', 'parameters'):
+            if getattr(args, key):
+                print('\n'.join(metadata[key]))
+    elif args.command == 'simulate':
+        run_simulate(_load_payload(args.payload), args.antibodies)
+    elif args.command == 'plot':
+        import runpy
+        with timed('plot'):
+            runpy.run_module(PLOTTERS[args.name], run_name='__main__')
+    elif args.command == 'lint':
+        with timed('import model_lint'):
+            import model_lint
+        status = model_lint.main(forwarded)
+    elif args.command == 'queue':
+        with timed('import job_queue'):
+            import job_queue
+        status = job_queue.main(forwarded)
+    elif args.command == 'diff':
+        with timed('import model_diff'):
+            import model_diff
+        status = model_diff.main(forwarded)
+    if args.timings:
+        report_timings()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
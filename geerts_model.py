@@ -0,0 +1,1251 @@
+"""
+Geerts Model Compiler and Integrator
+Compiles the reaction list from build_reactions() into NumPy kernels and integrates it
+with antibody dosing
+
+Conventions:
+- States are amounts in the units implied by the parameter set; rate prototypes are
+  used exactly as written in the reaction list.
+- Model time is in seconds (the rate constants in params/ are per second); the
+  public API takes and returns times in weeks.
+- "MA" and "UDF" reactions are mass action with the prototype as rate constant,
+  "RMA" reactions are reversible mass action with [forward, reverse] constants,
+  and "custom*" prototypes are the full reaction rate.
+"""
+
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+from scipy.integrate import BDF, DOP853, LSODA, RK23, RK45, Radau, solve_ivp
+
+from arrow_solver import ArrowBDF, arrow_banded_structure
+from checkpoint import (read_checkpoint, restore_solver, solver_state, track_factorizations,
+                        write_checkpoint)
+from Geerts_reactions_full4 import build_reactions
+
+SECONDS_PER_DAY = 86400.0
+SECONDS_PER_WEEK = 7.0 * SECONDS_PER_DAY
+WEEKS_PER_YEAR = 52.0
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+# Calibration of the imaging read-outs. SUVR is linear in total ISF plaque
+# (free and antibody-bound O25); Centiloids follow the Klunk et al (2015) PiB
+# scale anchored at young-control and typical-AD SUVR.
+OBSERVABLE_DEFAULTS = {
+    'SUVR_intercept': 1.009,
+    'SUVR_per_plaque': 1.0,
+    'Centiloid_SUVR_0': 1.009,
+    'Centiloid_SUVR_100': 2.076,
+}
+
+# Antibody dosing defaults
+DEFAULT_BODY_WEIGHT_KG = 70.0
+DEFAULT_MW_ANTIBODY = 150000.0
+DOSE_COMPARTMENTS = {'IV': 'centralAntibody', 'SC': 'SubCutComp'}
+
+SOLVERS = {'BDF': BDF, 'BDF-arrow': ArrowBDF, 'Radau': Radau, 'LSODA': LSODA, 'RK45': RK45, 'RK23': RK23,
+           'DOP853': DOP853}
+IMPLICIT_SOLVERS = ('BDF', 'BDF-arrow', 'Radau', 'LSODA')
+
+
+def parse_species(text):
+    """
+    Parse a Reactants/Products string such as '[A, B]' into a list; '[0]' is empty
+    """
+    names = [name.strip() for name in text.strip().strip('[]').split(',')]
+    return [name for name in names if name and name != '0']
+
+
+def normalize_expression(expression):
+    """
+    Rewrite a rate prototype as a Python expression ('^' -> '**', no padding)
+    """
+    return re.sub(r'\s+', ' ', expression.strip()).replace('^', '**')
+
+
+def split_rate_prototype(reaction):
+    """
+    Split a reaction's prototype into (forward, reverse) expressions
+
+    Only RMA reactions have a reverse expression; it is None otherwise.
+    """
+    prototype = reaction['Rate_eqtn_prototype'].strip()
+    if reaction['Rate_type'] == 'RMA':
+        forward, reverse = prototype.strip('[]').split(',')
+        return normalize_expression(forward), normalize_expression(reverse)
+    return normalize_expression(prototype), None
+
+
+def canonical_reaction(reaction):
+    """
+    Whitespace- and order-insensitive form of a reaction
+
+    Returns:
+    --------
+    tuple
+        (Reaction_name, sorted reactants, sorted products, Rate_type, forward, reverse)
+    """
+    forward, reverse = split_rate_prototype(reaction)
+    return (reaction['Reaction_name'].strip(),
+            tuple(sorted(parse_species(reaction['Reactants']))),
+            tuple(sorted(parse_species(reaction['Products']))),
+            reaction['Rate_type'].strip(), forward, reverse)
+
+
+def reaction_list_hash(reactions):
+    """
+    Order-independent SHA-256 of a reaction list, used to key caches of results
+    """
+    digest = hashlib.sha256()
+    for item in sorted(repr(canonical_reaction(reaction)) for reaction in reactions):
+        digest.update(item.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def parameter_hash(params, names=None):
+    """
+    SHA-256 of the values of the named parameters (all when names is None)
+    """
+    names = sorted(params) if names is None else sorted(names)
+    digest = hashlib.sha256()
+    for name in names:
+        digest.update(f"{name}={float(params[name])!r};".encode('utf-8'))
+    return digest.hexdigest()
+
+
+class GeertsModel:
+    """
+    Reaction network compiled into vectorised NumPy kernels
+
+    Every reaction becomes one flux (two for RMA). A flux is
+    k(y, p) * y[a] * y[b] where a, b are its mass-action reactants; rate
+    constants that do not depend on the state are evaluated once per parameter
+    set, the rest by a generated kernel on each call. The right-hand side is
+    the sparse stoichiometry matrix times the flux vector. States may be 1-D or
+    2-D (species x batch), so several virtual patients or arms can share one
+    call.
+
+    Parameters:
+    -----------
+    reactions : list of dict or None
+        Reaction dicts as produced by build_reactions(), built when None
+    antibodies : list of str or None
+        Antibodies passed to build_reactions() when reactions is None, e.g.
+        ['Lecanemab', 'Donanemab'] for head-to-head or combination arms
+    """
+
+    def __init__(self, reactions=None, antibodies=None):
+        self.reactions = build_reactions(antibodies) if reactions is None else list(reactions)
+        self.model_hash = reaction_list_hash(self.reactions)
+        # Hash of the reaction network alone, which generated kernels are keyed on;
+        # model_hash also covers the runtime flux_multipliers
+        self.network_hash = self.model_hash
+        self.flux_multipliers = None
+        self._compile()
+
+    def _compile(self):
+        species, seen = [], set()
+        for reaction in self.reactions:
+            for name in parse_species(reaction['Reactants']) + parse_species(reaction['Products']):
+                if name not in seen:
+                    seen.add(name)
+                    species.append(name)
+        self.species = species
+        self.species_index = {name: i for i, name in enumerate(species)}
+        n_species = len(species)
+
+        fluxes = []
+        for r, reaction in enumerate(self.reactions):
+            reactants = parse_species(reaction['Reactants'])
+            products = parse_species(reaction['Products'])
+            forward, reverse = split_rate_prototype(reaction)
+            mass_action = not reaction['Rate_type'].startswith('custom')
+            fluxes.append({'reaction': r, 'expression': forward, 'consumed': reactants,
+                           'produced': products, 'mass_action': reactants if mass_action else []})
+            if reverse is not None:
+                fluxes.append({'reaction': r, 'expression': reverse, 'consumed': products,
+                               'produced': reactants, 'mass_action': products})
+        self.fluxes = fluxes
+        self.flux_reaction = np.array([flux['reaction'] for flux in fluxes])
+
+        names = set()
+        for flux in fluxes:
+            names.update(IDENTIFIER.findall(flux['expression']))
+        self.parameters = sorted(names - seen)
+        self.parameter_index = {name: i for i, name in enumerate(self.parameters)}
+        par_rows, par_cols = [], []
+        for j, flux in enumerate(fluxes):
+            for name in set(IDENTIFIER.findall(flux['expression'])) - seen:
+                par_rows.append(j)
+                par_cols.append(self.parameter_index[name])
+        self.flux_parameters = sparse.csr_matrix(
+            (np.ones(len(par_rows)), (par_rows, par_cols)), shape=(len(fluxes), len(self.parameters)))
+
+        max_order = max([len(flux['mass_action']) for flux in fluxes] + [1])
+        self.mass_action_index = np.full((max_order, len(fluxes)), n_species)
+        rows, cols, values = [], [], []
+        dep_rows, dep_cols = [], []
+        static_expr, dynamic_expr = [], []
+        self.static_flux, self.dynamic_flux = [], []
+        for j, flux in enumerate(fluxes):
+            for order, name in enumerate(flux['mass_action']):
+                self.mass_action_index[order, j] = self.species_index[name]
+            for name, coefficient in ([(name, -1.0) for name in flux['consumed']]
+                                      + [(name, 1.0) for name in flux['produced']]):
+                rows.append(self.species_index[name])
+                cols.append(j)
+                values.append(coefficient)
+            state_names = [name for name in IDENTIFIER.findall(flux['expression']) if name in seen]
+            for name in set(flux['mass_action']) | set(state_names):
+                dep_rows.append(j)
+                dep_cols.append(self.species_index[name])
+            if state_names:
+                self.dynamic_flux.append(j)
+                dynamic_expr.append(flux['expression'])
+            else:
+                self.static_flux.append(j)
+                static_expr.append(flux['expression'])
+        self.static_flux = np.array(self.static_flux, dtype=int)
+        self.dynamic_flux = np.array(self.dynamic_flux, dtype=int)
+
+        shape = (n_species, len(fluxes))
+        self.stoichiometry = sparse.csr_matrix((values, (rows, cols)), shape=shape)
+        self.flux_dependencies = sparse.csr_matrix(
+            (np.ones(len(dep_rows)), (dep_rows, dep_cols)), shape=(len(fluxes), n_species))
+        self.jac_sparsity = ((abs(self.stoichiometry) @ self.flux_dependencies) != 0).astype(float)
+
+        self.kernel_source = self._generate_kernels(static_expr, dynamic_expr)
+        self._load_kernels()
+
+    def _to_python(self, expression):
+        """
+        Replace species and parameter names by y[...] and p[...] lookups
+        """
+        def lookup(match):
+            name = match.group(0)
+            if name in self.species_index:
+                return f"y[{self.species_index[name]}]"
+            return f"p[{self.parameter_index[name]}]"
+        return IDENTIFIER.sub(lookup, expression)
+
+    def _generate_kernels(self, static_expr, dynamic_expr):
+        """
+        Generate the source of the static and dynamic rate-constant kernels
+        """
+        lines = ["def static_rates(p):", "    return np.array(["]
+        lines += [f"        {self._to_python(expr)}," for expr in static_expr]
+        lines += ["    ])", "", "def dynamic_rates(y, p):", "    return np.array(["]
+        lines += [f"        {self._to_python(expr)}," for expr in dynamic_expr]
+        lines += ["    ])", ""]
+        return "\n".join(lines)
+
+    def _load_kernels(self):
+        namespace = {'np': np}
+        exec(compile(self.kernel_source, f"<geerts kernels {self.network_hash[:12]}>", 'exec'),
+             namespace)
+        self._static_rates = namespace['static_rates']
+        self._dynamic_rates = namespace['dynamic_rates']
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_static_rates', None)
+        state.pop('_dynamic_rates', None)
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('network_hash', state['model_hash'])
+        state.setdefault('flux_multipliers', None)
+        self.__dict__.update(state)
+        self._load_kernels()
+
+    @property
+    def n_species(self):
+        return len(self.species)
+
+    @property
+    def n_fluxes(self):
+        return len(self.fluxes)
+
+    def parameter_vector(self, params):
+        """
+        Order a parameter dict as the kernels expect
+
+        Parameters:
+        -----------
+        params : dict
+            Mapping parameter name -> value; extra entries are ignored
+
+        Returns:
+        --------
+        numpy.ndarray
+            Parameter values in self.parameters order
+        """
+        missing = [name for name in self.parameters if name not in params]
+        if missing:
+            raise KeyError(f"Missing {len(missing)} model parameters: {', '.join(missing)}")
+        return np.array([float(params[name]) for name in self.parameters])
+
+    def rate_constants(self, p):
+        """
+        Evaluate the state-independent rate constants for a parameter vector
+
+        Returns:
+        --------
+        numpy.ndarray
+            Rate constant per flux; entries of dynamic fluxes are placeholders
+        """
+        k = np.zeros(self.n_fluxes, dtype=np.result_type(p, float))
+        if len(self.static_flux):
+            k[self.static_flux] = self._static_rates(p)
+        return k
+
+    def flux_rates(self, y, p, k=None):
+        """
+        Flux of every reaction direction
+
+        Parameters:
+        -----------
+        y : numpy.ndarray
+            State, shape (n_species,) or (n_species, batch)
+        p : numpy.ndarray
+            Parameter vector from parameter_vector
+        k : numpy.ndarray or None
+            Precomputed rate_constants(p)
+
+        Returns:
+        --------
+        numpy.ndarray
+            Fluxes, shape (n_fluxes,) or (n_fluxes, batch)
+        """
+        k = self.rate_constants(p) if k is None else k
+        if y.ndim == 2:
+            k = np.repeat(k[:, None], y.shape[1], axis=1)
+        else:
+            k = k.copy()
+        k = k.astype(np.result_type(k, y), copy=False)
+        if len(self.dynamic_flux):
+            k[self.dynamic_flux] = self._dynamic_rates(y, p)
+        y_ext = np.concatenate([y, np.ones((1,) + y.shape[1:], dtype=y.dtype)])
+        for order in range(self.mass_action_index.shape[0]):
+            k = k * y_ext[self.mass_action_index[order]]
+        if self.flux_multipliers is not None:
+            k = k * (self.flux_multipliers[:, None] if k.ndim == 2 else self.flux_multipliers)
+        return k
+
+    def rhs(self, y, p, k=None):
+        """
+        Time derivative of the state (see flux_rates for shapes)
+        """
+        return self.stoichiometry @ self.flux_rates(y, p, k)
+
+    def rhs_function(self, params):
+        """
+        Build f(t, y) for a fixed parameter set, as used by the integrators
+        """
+        p = self.parameter_vector(params)
+        k = self.rate_constants(p)
+
+        def f(t, y):
+            return self.rhs(y, p, k)
+        return f
+
+    def derivative_functions(self, params, backend='numpy'):
+        """
+        Build f(t, y) and, when available, an exact jac(t, y)
+
+        Parameters:
+        -----------
+        params : dict
+            Parameter set
+        backend : str, default 'numpy'
+            'numpy' (generated Python kernels, no Jacobian), 'transport'
+            (NumPy kernels for the nonlinear fluxes plus the linear part as
+            one sparse matrix, with an exact Jacobian, see transport.py),
+            'complex-step' (NumPy kernels with a sparse complex-step
+            Jacobian, see complex_step.py), 'c' (generated C compiled on
+            first use, see c_backend.py) or 'auto' (C when a compiler is
+            available, NumPy otherwise)
+
+        Returns:
+        --------
+        tuple
+            (f, jac) where jac is None for the NumPy backend
+        """
+        if backend not in ('numpy', 'transport', 'complex-step', 'c', 'auto'):
+            raise ValueError(f"Unknown backend: {backend}")
+        if backend == 'transport':
+            operator = self.transport_operator()
+            return operator.rhs_function(params), operator.jacobian_function(params)
+        if backend == 'complex-step':
+            return self.rhs_function(params), self.rate_derivatives().jacobian_function(params)
+        if backend != 'numpy':
+            from c_backend import load_c_kernels
+            kernels = load_c_kernels(self, required=backend == 'c')
+            if kernels is not None:
+                p = self.parameter_vector(params)
+
+                m = self.flux_multipliers
+
+                def f(t, y):
+                    return kernels.rhs(y, p, m)
+
+                def jac(t, y):
+                    return kernels.jac(y, p, m)
+                return f, jac
+        return self.rhs_function(params), None
+
+    def transport_operator(self):
+        """
+        TransportOperator of the linear fluxes, built on first use
+        """
+        if getattr(self, '_transport', None) is None:
+            from transport import TransportOperator
+            self._transport = TransportOperator(self)
+        return self._transport
+
+    def rate_derivatives(self):
+        """
+        RateDerivatives (complex-step flux derivatives), built on first use
+        """
+        if getattr(self, '_rate_derivatives', None) is None:
+            from complex_step import RateDerivatives
+            self._rate_derivatives = RateDerivatives(self)
+        return self._rate_derivatives
+
+    def with_rate_multipliers(self, multipliers):
+        """
+        Copy of the model with every reaction's rate scaled, sharing the compiled kernels
+
+        The multipliers become a per-flux vector (flux_multipliers) applied at
+        runtime by every backend, so the generated Python and C kernels, keyed
+        on network_hash, are reused; a zero removes a reaction (both directions
+        of an RMA) from the network. Multipliers of an already scaled model
+        compound.
+
+        Parameters:
+        -----------
+        multipliers : array-like
+            One factor per entry of self.reactions
+
+        Returns:
+        --------
+        GeertsModel
+            Model with its own model_hash (the network_hash when every factor
+            is one), so caches and checkpoints of the original are not reused
+        """
+        multipliers = np.asarray(multipliers, dtype=float)
+        if multipliers.shape != (len(self.reactions),):
+            raise ValueError(f"Expected {len(self.reactions)} rate multipliers, "
+                             f"got shape {multipliers.shape}")
+        flux_multipliers = multipliers[self.flux_reaction]
+        if self.flux_multipliers is not None:
+            flux_multipliers = flux_multipliers * self.flux_multipliers
+        model = object.__new__(GeertsModel)
+        model.__dict__.update(self.__dict__)
+        if np.all(flux_multipliers == 1.0):
+            model.flux_multipliers = None
+            model.model_hash = self.network_hash
+        else:
+            model.flux_multipliers = flux_multipliers
+            digest = hashlib.sha256(self.network_hash.encode('utf-8') + flux_multipliers.tobytes())
+            model.model_hash = digest.hexdigest()
+        model._transport = None
+        model._rate_derivatives = None
+        return model
+
+    def initial_state(self, values=None):
+        """
+        Zero state with optional named initial amounts
+        """
+        y0 = np.zeros(self.n_species)
+        for name, value in (values or {}).items():
+            y0[self.species_index[name]] = value
+        return y0
+
+    def species_matching(self, pattern):
+        """
+        Indices of species whose names match a regular expression
+        """
+        regex = re.compile(pattern)
+        return np.array([i for i, name in enumerate(self.species) if regex.search(name)], dtype=int)
+
+    def parameter_species(self, names=None):
+        """
+        Species whose time derivative depends directly on each parameter
+
+        Returns:
+        --------
+        dict
+            Parameter name -> list of species names
+        """
+        incidence = (abs(self.stoichiometry) @ self.flux_parameters).tocsc()
+        return {name: [self.species[i] for i in
+                       incidence.indices[incidence.indptr[k]:incidence.indptr[k + 1]]]
+                for k, name in enumerate(self.parameters) if names is None or name in names}
+
+    def affected_species(self, names):
+        """
+        Species whose trajectories can change when the named parameters change
+
+        Follows the Jacobian sparsity graph from the species each parameter
+        acts on directly.
+        """
+        graph = self.jac_sparsity.tocsc()
+        reached = {self.species_index[species] for affected in self.parameter_species(names).values()
+                   for species in affected}
+        frontier = list(reached)
+        while frontier:
+            j = frontier.pop()
+            for i in graph.indices[graph.indptr[j]:graph.indptr[j + 1]]:
+                if i not in reached:
+                    reached.add(i)
+                    frontier.append(i)
+        return [self.species[i] for i in sorted(reached)]
+
+    def untreated_zero_species(self, initial_species=()):
+        """
+        Species that stay exactly zero without dosing
+
+        Starting from a state that is zero except for initial_species, a flux
+        can only become non-zero when none of its mass-action reactants is
+        stuck at zero (custom-rate fluxes are assumed non-zero). Species that
+        no such flux produces stay zero; with the default zero initial state
+        these are the antibody, its complexes and the FcRn pools.
+        """
+        zero = set(range(self.n_species)) - {self.species_index[name] for name in initial_species}
+        changed = True
+        while changed:
+            changed = False
+            for flux in self.fluxes:
+                if any(self.species_index[name] in zero for name in flux['mass_action']):
+                    continue
+                for name in flux['produced']:
+                    if self.species_index[name] in zero:
+                        zero.discard(self.species_index[name])
+                        changed = True
+        return [self.species[i] for i in sorted(zero)]
+
+    def treatment_parameters(self, initial_species=()):
+        """
+        Parameters that cannot affect the untreated trajectory
+
+        A parameter qualifies when every flux using it has a mass-action
+        reactant among untreated_zero_species, so the flux vanishes until the
+        first dose (e.g. k0_Antibody..k3_Antibody, Antibody_CL, kon_FCRn).
+        """
+        zero = set(self.untreated_zero_species(initial_species))
+        silent = np.array([any(name in zero for name in flux['mass_action']) for flux in self.fluxes])
+        incidence = self.flux_parameters.tocsc()
+        return [name for k, name in enumerate(self.parameters)
+                if silent[incidence.indices[incidence.indptr[k]:incidence.indptr[k + 1]]].all()]
+
+    def untreated_parameters(self, initial_species=()):
+        """
+        Parameters the untreated trajectory may depend on (complement of treatment_parameters)
+        """
+        treatment = set(self.treatment_parameters(initial_species))
+        return [name for name in self.parameters if name not in treatment]
+
+
+_DEFAULT_MODEL = None
+
+
+def default_model():
+    """
+    The compiled model for the current build_reactions(), built once per process
+    """
+    global _DEFAULT_MODEL
+    if _DEFAULT_MODEL is None:
+        _DEFAULT_MODEL = GeertsModel()
+    return _DEFAULT_MODEL
+
+
+def dose_schedule(regimen, params=None):
+    """
+    Expand a regimen into individual doses
+
+    Parameters:
+    -----------
+    regimen : dict
+        'dose_mg_per_kg' or 'dose_mg' (maintenance dose), 'interval_weeks',
+        and 'n_doses' or 'duration_weeks'; optional 'route' ('IV' or 'SC'),
+        'start_weeks', 'body_weight_kg', 'antibody' (species prefix, default
+        'Antibody') and 'titration', a list of {'dose_mg_per_kg' or 'dose_mg',
+        'n_doses'} given before the maintenance dose
+    params : dict or None
+        Parameter set; 'MW_<antibody>' (g/mol, falling back to 'MW_Antibody')
+        converts mg to nmol when present
+
+    Returns:
+    --------
+    list of tuple
+        (time_weeks, species, amount_nmol) sorted by time
+    """
+    params = params or {}
+    weight = regimen.get('body_weight_kg', DEFAULT_BODY_WEIGHT_KG)
+    antibody = regimen.get('antibody', 'Antibody')
+    mw = params.get(f"MW_{antibody}", params.get('MW_Antibody', DEFAULT_MW_ANTIBODY))
+    route = regimen.get('route', 'IV')
+    species = f"{antibody}_{DOSE_COMPARTMENTS[route]}"
+    interval = regimen['interval_weeks']
+
+    def amount(step):
+        dose_mg = step['dose_mg'] if 'dose_mg' in step else step['dose_mg_per_kg'] * weight
+        return dose_mg * 1e6 / mw
+
+    steps = [(amount(step), int(step['n_doses'])) for step in regimen.get('titration', [])]
+    if 'n_doses' in regimen:
+        n_maintenance = int(regimen['n_doses'])
+    else:
+        n_total = int(np.floor(regimen['duration_weeks'] / interval + 1e-9))
+        n_maintenance = max(n_total - sum(n for _, n in steps), 0)
+    steps.append((amount(regimen), n_maintenance))
+
+    doses, i = [], 0
+    t0 = regimen.get('start_weeks', 0.0)
+    for dose_amount, n in steps:
+        for _ in range(n):
+            if dose_amount > 0:
+                doses.append((t0 + i * interval, species, dose_amount))
+            i += 1
+    return doses
+
+
+class SimulationResult:
+    """
+    Trajectory of a Geerts model simulation
+
+    Attributes:
+    -----------
+    t_weeks : numpy.ndarray
+        Output times in weeks
+    y : numpy.ndarray
+        States, shape (n_species, n_times), or only the recorded outputs,
+        shape (len(outputs), n_times)
+    outputs : list of str or None
+        Names of the rows of y when a subset was recorded, None for all species
+    events : list of dict
+        Event crossings ('event', 'action', 't_weeks', 'state') in time order
+    interpolant : HermiteInterpolant or None
+        Dense interpolant of the outputs when simulated with dense=True
+    """
+
+    def __init__(self, model, t_weeks, y, params, events=None, outputs=None, final_state=None,
+                 interpolant=None):
+        self.model = model
+        self.t_weeks = np.asarray(t_weeks, dtype=float)
+        self.y = y
+        self.params = params
+        self.events = sorted(events or [], key=lambda entry: entry['t_weeks'])
+        self.outputs = None if outputs is None else list(outputs)
+        self._final_state = final_state
+        self.interpolant = interpolant
+
+    def event_times(self, name):
+        """
+        Times in weeks at which the named event occurred
+        """
+        return np.array([entry['t_weeks'] for entry in self.events if entry['event'] == name])
+
+    def _row(self, name):
+        if name not in self.outputs:
+            raise KeyError(f"{name} was not recorded; outputs are {self.outputs}")
+        return self.y[self.outputs.index(name)]
+
+    def species(self, name):
+        if self.outputs is not None:
+            return self._row(name)
+        return self.y[self.model.species_index[name]]
+
+    def observable(self, name):
+        """
+        Derived read-out: 'plaque', 'SUVR', 'Centiloid', or their '_change' from the first time
+        """
+        if self.outputs is None:
+            return observable(self.model, self.y, name, self.params)
+        if name.endswith('_change') and name not in self.outputs:
+            values = self._row(name[:-len('_change')])
+            return values - values[..., :1]
+        return self._row(name)
+
+    @property
+    def final_state(self):
+        if self._final_state is not None:
+            return self._final_state.copy()
+        return self.y[:, -1].copy()
+
+
+class HermiteInterpolant:
+    """
+    Piecewise cubic Hermite interpolant of recorded outputs over solver steps
+
+    Stores each output and its time derivative at every accepted step, so the
+    memory is O(steps x outputs) rather than O(steps x species). A dose
+    appears as two knots at the same time; evaluating exactly at a dose time
+    gives the pre-dose value, as in simulate.
+
+    Attributes:
+    -----------
+    t_weeks : numpy.ndarray
+        Knot times in weeks
+    z, dz : numpy.ndarray
+        Outputs and their derivatives per week at the knots, shape (n_outputs, n_knots)
+    outputs : list of str
+        Output names
+    """
+
+    def __init__(self, t_weeks, z, dz, outputs):
+        self.t_weeks = np.asarray(t_weeks, dtype=float)
+        self.z = np.asarray(z, dtype=float)
+        self.dz = np.asarray(dz, dtype=float)
+        self.outputs = list(outputs)
+
+    @property
+    def nbytes(self):
+        return self.t_weeks.nbytes + self.z.nbytes + self.dz.nbytes
+
+    def __call__(self, t_weeks, name=None):
+        """
+        Evaluate all outputs, or only the named one, at times in weeks
+        """
+        t = np.atleast_1d(np.asarray(t_weeks, dtype=float))
+        i = np.clip(np.searchsorted(self.t_weeks, t, side='left') - 1, 0, len(self.t_weeks) - 2)
+        t0, t1 = self.t_weeks[i], self.t_weeks[i + 1]
+        h = t1 - t0
+        s = (t - t0) / h
+        rows = slice(None) if name is None else self.outputs.index(name)
+        z0, z1 = self.z[rows, i], self.z[rows, i + 1]
+        dz0, dz1 = self.dz[rows, i] * h, self.dz[rows, i + 1] * h
+        return ((2 * s ** 3 - 3 * s ** 2 + 1) * z0 + (s ** 3 - 2 * s ** 2 + s) * dz0
+                + (-2 * s ** 3 + 3 * s ** 2) * z1 + (s ** 3 - s ** 2) * dz1)
+
+
+def observable(model, y, name, params=None):
+    """
+    Imaging read-outs computed from states
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    y : numpy.ndarray
+        States, shape (n_species, ...) with time along the last axis
+    name : str
+        'plaque', 'SUVR', 'Centiloid', 'SUVR_change' or 'Centiloid_change';
+        changes are relative to the first time point
+    params : dict or None
+        Overrides for OBSERVABLE_DEFAULTS
+
+    Returns:
+    --------
+    numpy.ndarray
+        Observable with the state axis removed
+    """
+    calibration = {**OBSERVABLE_DEFAULTS, **{key: params[key] for key in OBSERVABLE_DEFAULTS
+                                             if params and key in params}}
+    if name.endswith('_change'):
+        values = observable(model, y, name[:-len('_change')], params)
+        return values - values[..., :1]
+    plaque = y[model.species_matching(r'_O25_.*ISF$')].sum(axis=0)
+    if name == 'plaque':
+        return plaque
+    suvr = calibration['SUVR_intercept'] + calibration['SUVR_per_plaque'] * plaque
+    if name == 'SUVR':
+        return suvr
+    if name == 'Centiloid':
+        return 100.0 * (suvr - calibration['Centiloid_SUVR_0']) / (
+            calibration['Centiloid_SUVR_100'] - calibration['Centiloid_SUVR_0'])
+    raise ValueError(f"Unknown observable: {name}")
+
+
+def output_weights(model, outputs, params=None):
+    """
+    Affine map from states to recorded outputs
+
+    Species amounts and the plaque, SUVR and Centiloid read-outs are all
+    affine in the state, so outputs = weights @ y + offset.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    outputs : list of str
+        Species names and/or 'plaque', 'SUVR', 'Centiloid'
+    params : dict or None
+        Read-out calibration overrides, see observable
+
+    Returns:
+    --------
+    tuple
+        (weights of shape (len(outputs), n_species), offset of shape (len(outputs),))
+    """
+    weights = np.zeros((len(outputs), model.n_species))
+    offset = np.zeros(len(outputs))
+    for row, name in enumerate(outputs):
+        if name in model.species_index:
+            weights[row, model.species_index[name]] = 1.0
+        else:
+            offset[row] = observable(model, np.zeros((model.n_species, 1)), name, params)[0]
+            weights[row] = observable(model, np.eye(model.n_species), name, params) - offset[row]
+    return weights, offset
+
+
+def simulate(model, params, t_eval_weeks, y0=None, regimen=None, doses=None, method='BDF',
+             rtol=1e-6, atol=1e-12, backend='auto', events=None, outputs=None, dense=False,
+             checkpoint=None, checkpoint_interval=60.0):
+    """
+    Integrate the model with bolus antibody doses
+
+    Observations at a dose time are recorded before that dose (trough).
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    params : dict
+        Parameter set
+    t_eval_weeks : array-like
+        Output times in weeks; integration runs from the first to the last
+    y0 : numpy.ndarray or None
+        State at the first output time, zeros when None
+    regimen : dict, list of dict or None
+        Dosing regimen, see dose_schedule, or several given together
+        (combination, or switching via 'start_weeks'); with a multi-antibody
+        model (GeertsModel(antibodies=[...])) they may dose different antibodies
+    doses : list of tuple or None
+        Explicit (time_weeks, species, amount) doses, used instead of regimen
+    method : str, default 'BDF'
+        scipy.integrate.solve_ivp method, or 'BDF-arrow' for BDF with the
+        arrow-plus-banded linear solver (see arrow_solver.py)
+    rtol, atol : float
+        Solver tolerances
+    backend : str, default 'auto'
+        RHS backend, see GeertsModel.derivative_functions
+    events : list of events.ObservableEvent or None
+        Threshold crossings located during integration; a 'terminate' event
+        ends the trajectory at the crossing, 'stop_dosing' cancels later doses
+    outputs : list of str or None
+        Record only these species and/or read-outs ('plaque', 'SUVR',
+        'Centiloid') instead of the full state; memory is then
+        O(observations x outputs). final_state is kept either way.
+    dense : bool, default False
+        Step the solver directly and keep a HermiteInterpolant of the outputs
+        at every accepted step in .interpolant, for evaluation at any time;
+        not combinable with events
+    checkpoint : str or Path or None
+        Checkpoint file (.npz) for long runs with 'BDF' or 'BDF-arrow': the
+        solver state is saved periodically and an existing checkpoint of
+        the same simulation is resumed, giving the uninterrupted result bit
+        for bit (with the same backend); not combinable with events or dense
+    checkpoint_interval : float, default 60
+        Seconds of wall time between checkpoints
+
+    Returns:
+    --------
+    SimulationResult
+        Trajectory at t_eval_weeks, with crossings in .events
+    """
+    t_eval = np.asarray(t_eval_weeks, dtype=float) * SECONDS_PER_WEEK
+    t_start, t_end = t_eval[0], t_eval[-1]
+    if doses is None:
+        regimens = [regimen] if isinstance(regimen, dict) else regimen or []
+        doses = [dose for item in regimens for dose in dose_schedule(item, params)]
+    doses = sorted((t * SECONDS_PER_WEEK, model.species_index[name], amount)
+                   for t, name, amount in doses)
+    doses = [dose for dose in doses if t_start <= dose[0] < t_end]
+
+    f, jac = model.derivative_functions(params, backend)
+    y = model.initial_state() if y0 is None else np.array(y0, dtype=float)
+    options = _jacobian_options(model.jac_sparsity, method, jac)
+    project = None
+    if outputs is not None or dense:
+        names = list(model.species) if outputs is None else list(outputs)
+        weights, offset = output_weights(model, names, params)
+
+        def project(y):
+            return weights @ y + (offset[:, None] if y.ndim == 2 else offset)
+
+    if checkpoint is not None:
+        if events or dense:
+            raise ValueError("Events and dense output are not supported with checkpoints")
+        if method not in ('BDF', 'BDF-arrow'):
+            raise ValueError(f"Checkpoints need method 'BDF' or 'BDF-arrow', not {method}")
+        digest = hashlib.sha256(repr((model.model_hash, parameter_hash(params), method, rtol, atol,
+                                      backend, outputs, doses)).encode())
+        digest.update(t_eval.tobytes())
+        digest.update(y.tobytes())
+        out, y = _integrate_checkpointed(SOLVERS[method], f, y, t_eval, doses, rtol, atol, options,
+                                         project or (lambda states: states), checkpoint,
+                                         digest.hexdigest(), checkpoint_interval)
+        return SimulationResult(model, t_eval / SECONDS_PER_WEEK, out, params, outputs=outputs,
+                                final_state=y)
+
+    if dense:
+        if events:
+            raise ValueError("Events are not supported with dense=True")
+        interpolant, y = _integrate_dense(f, y, t_eval, doses, method, rtol, atol, options,
+                                          project, lambda dy: weights @ dy, names)
+        return SimulationResult(model, t_eval / SECONDS_PER_WEEK,
+                                interpolant(t_eval / SECONDS_PER_WEEK), params, outputs=names,
+                                final_state=y, interpolant=interpolant)
+
+    bound_events = [event.bind(model, params) for event in events or []]
+    t_out, out, log, y = _integrate(f, y, t_eval, doses, method, rtol, atol, options,
+                                    bound_events, project)
+    return SimulationResult(model, t_out / SECONDS_PER_WEEK, out, params, log, outputs=outputs,
+                            final_state=y)
+
+
+def _integrate(f, y, t_eval, doses, method, rtol, atol, jacobian_options, events=(),
+               project=None):
+    """
+    Integrate segment by segment between bolus doses (time_s, state_index, amount)
+
+    events are solve_ivp event functions carrying an ObservableEvent as
+    .event (see events.py). Terminal ones act once: 'terminate' ends the run
+    and 'stop_dosing' drops all later doses before integration resumes.
+    project maps states (n_state, ...) to the recorded outputs.
+
+    Returns:
+    --------
+    tuple
+        (t_out, y_out, event_log, final_state); when a run terminates, the
+        output stops at the last observation before the event and the event
+        state is appended
+    """
+    project = (lambda states: states) if project is None else project
+    out = np.empty((len(project(y)), len(t_eval)))
+    log = []
+    active = list(events)
+    next_obs = 0
+    t = t_eval[0]
+    boundaries = sorted({dose[0] for dose in doses} | {t_eval[-1]})
+    dose_pos = 0
+
+    for boundary in boundaries:
+        mask = np.arange(len(t_eval)) >= next_obs
+        segment = np.flatnonzero(mask & (t_eval <= boundary))
+        pending = segment
+        while boundary > t:
+            times = t_eval[pending]
+            if not len(times) or times[-1] != boundary:
+                times = np.append(times, boundary)
+            sol = solve_ivp(f, (t, boundary), y, method=SOLVERS[method], t_eval=times, rtol=rtol,
+                            atol=atol, events=active or None, **jacobian_options)
+            if sol.status < 0:
+                raise RuntimeError(f"Integration failed between t = {t / SECONDS_PER_WEEK:.3f} and "
+                                   f"{boundary / SECONDS_PER_WEEK:.3f} weeks: {sol.message}")
+            n_obs = min(len(sol.t), len(pending))
+            if n_obs:
+                out[:, pending[:n_obs]] = project(sol.y[:, :n_obs])
+            pending = pending[n_obs:]
+            for g, t_events, y_events in zip(active, sol.t_events or [], sol.y_events or []):
+                log += [{'event': g.event.name, 'action': g.event.action,
+                         't_weeks': te / SECONDS_PER_WEEK, 'state': ye.copy()}
+                        for te, ye in zip(t_events, y_events)]
+            if sol.status == 0:
+                y = sol.y[:, -1].copy()
+                t = boundary
+                break
+            i = next(i for i, g in enumerate(active) if g.terminal and len(sol.t_events[i]))
+            t, y = sol.t_events[i][-1], sol.y_events[i][-1].copy()
+            if active[i].event.action == 'terminate':
+                n_done = pending[0] if len(pending) else segment[-1] + 1 if len(segment) else next_obs
+                return (np.append(t_eval[:n_done], t), np.column_stack([out[:, :n_done], project(y)]),
+                        log, y)
+            del active[i]
+            doses = doses[:dose_pos]
+        out[:, pending] = project(y[:, None])
+        next_obs = segment[-1] + 1 if len(segment) else next_obs
+        while dose_pos < len(doses) and doses[dose_pos][0] == boundary:
+            y[doses[dose_pos][1]] += doses[dose_pos][2]
+            dose_pos += 1
+        t = boundary
+    return t_eval, out, log, y
+
+
+def _integrate_dense(f, y, t_eval, doses, method, rtol, atol, jacobian_options, project,
+                     project_rate, names):
+    """
+    Step the solver between doses, keeping projected outputs and rates at every step
+
+    Returns:
+    --------
+    tuple
+        (HermiteInterpolant over t_eval[0]..t_eval[-1], final state)
+    """
+    knots, z, dz = [], [], []
+
+    def record(t, state):
+        knots.append(t / SECONDS_PER_WEEK)
+        z.append(project(state))
+        dz.append(project_rate(f(t, state)) * SECONDS_PER_WEEK)
+
+    t = t_eval[0]
+    dose_pos = 0
+    for boundary in sorted({dose[0] for dose in doses} | {t_eval[-1]}):
+        if boundary > t:
+            solver = SOLVERS[method](f, t, y, boundary, rtol=rtol, atol=atol, **jacobian_options)
+            record(t, y)
+            while solver.status == 'running':
+                message = solver.step()
+                if solver.status == 'failed':
+                    raise RuntimeError(f"Integration failed at t = {solver.t / SECONDS_PER_WEEK:.3f} "
+                                       f"weeks: {message}")
+                record(solver.t, solver.y)
+            y = solver.y.copy()
+        while dose_pos < len(doses) and doses[dose_pos][0] == boundary:
+            y[doses[dose_pos][1]] += doses[dose_pos][2]
+            dose_pos += 1
+        t = boundary
+    return HermiteInterpolant(knots, np.array(z).T, np.array(dz).T, names), y
+
+
+def _integrate_checkpointed(solver_class, f, y, t_eval, doses, rtol, atol, jacobian_options,
+                            project, path, fingerprint, interval=60.0):
+    """
+    Integrate between bolus doses like _integrate, checkpointing the solver (see checkpoint.py)
+
+    The solver is stepped directly and observations are interpolated with
+    its dense output exactly as solve_ivp does for t_eval. At most every
+    `interval` seconds of wall time the position in the dose schedule, the
+    outputs so far and the solver state are written to `path`; a finished
+    run leaves a final checkpoint holding its result. Resuming from a
+    checkpoint with the same inputs gives the same result as the
+    uninterrupted run, bit for bit.
+
+    Parameters:
+    -----------
+    solver_class : type
+        BDF or a subclass (arrow_solver.ArrowBDF)
+    f : callable
+        Right-hand side f(t, y)
+    y : numpy.ndarray
+        State at t_eval[0]
+    t_eval : numpy.ndarray
+        Output times in seconds
+    doses : list of tuple
+        (time_s, state_index, amount) within [t_eval[0], t_eval[-1]), sorted
+    rtol, atol : float
+        Solver tolerances
+    jacobian_options : dict
+        Passed to the solver, see _jacobian_options
+    project : callable
+        Maps states (n_species, k) to the recorded outputs
+    path : str or Path
+        Checkpoint file (.npz)
+    fingerprint : str
+        Identity of the run; a checkpoint with another fingerprint is refused
+    interval : float, default 60
+        Seconds between checkpoints
+
+    Returns:
+    --------
+    tuple
+        (outputs (n_outputs x len(t_eval)), final state)
+    """
+    path = Path(path)
+    out = np.empty((len(project(y)), len(t_eval)))
+    boundaries = sorted({dose[0] for dose in doses} | {t_eval[-1]})
+    first, dose_pos, next_obs, t = 0, 0, 0, t_eval[0]
+    saved = None
+    if path.exists():
+        saved = read_checkpoint(path)
+        if str(saved['fingerprint']) != fingerprint:
+            raise ValueError(f"Checkpoint {path} belongs to a different simulation")
+        if bool(saved['done']):
+            return saved['out'].copy(), saved['y'].copy()
+        first, dose_pos, next_obs = (int(saved[key]) for key in ('boundary', 'dose_pos', 'next_obs'))
+        out = saved['out'].copy()
+        t = float(saved['solver_t'])
+
+    last_write = time.monotonic()
+    for b in range(first, len(boundaries)):
+        boundary = boundaries[b]
+        segment = np.flatnonzero((np.arange(len(t_eval)) >= next_obs) & (t_eval <= boundary))
+        if boundary > t:
+            times = t_eval[segment]
+            if not len(times) or times[-1] != boundary:
+                times = np.append(times, boundary)
+            start = y if saved is None else saved['solver_y']
+            solver = solver_class(f, float(t), start, boundary, rtol=rtol, atol=atol, **jacobian_options)
+            track_factorizations(solver)
+            position = 0
+            if saved is not None:
+                restore_solver(solver, saved)
+                position = int(saved['eval_pos'])
+                saved = None
+            while solver.status == 'running':
+                message = solver.step()
+                if solver.status == 'failed':
+                    raise RuntimeError(f"Integration failed at t = {solver.t / SECONDS_PER_WEEK:.3f} "
+                                       f"weeks: {message}")
+                stop = np.searchsorted(times, solver.t, side='right')
+                if stop > position:
+                    values = solver.dense_output()(times[position:stop])
+                    n_obs = min(stop, len(segment)) - position
+                    if n_obs > 0:
+                        out[:, segment[position:position + n_obs]] = project(values[:, :n_obs])
+                    if stop == len(times):
+                        y = values[:, -1].copy()
+                    position = stop
+                if solver.status == 'running' and time.monotonic() - last_write >= interval:
+                    write_checkpoint(path, fingerprint=fingerprint, done=False, boundary=b,
+                                     dose_pos=dose_pos, next_obs=next_obs, eval_pos=position, out=out,
+                                     **solver_state(solver))
+                    last_write = time.monotonic()
+        else:
+            out[:, segment] = project(y[:, None])
+        next_obs = segment[-1] + 1 if len(segment) else next_obs
+        while dose_pos < len(doses) and doses[dose_pos][0] == boundary:
+            y[doses[dose_pos][1]] += doses[dose_pos][2]
+            dose_pos += 1
+        t = boundary
+    write_checkpoint(path, fingerprint=fingerprint, done=True, out=out, y=y)
+    return out, y
+
+
+def _jacobian_options(jac_sparsity, method, jac=None):
+    if method not in IMPLICIT_SOLVERS:
+        return {}
+    options = {'structure': _arrow_structure(jac_sparsity)} if method == 'BDF-arrow' else {}
+    if jac is not None:
+        return {**options, 'jac': jac}
+    return {**options, 'jac_sparsity': jac_sparsity} if method != 'LSODA' else {}
+
+
+_arrow_structures = {}
+
+
+def _arrow_structure(jac_sparsity):
+    """
+    ArrowBandedStructure of a sparsity pattern, memoised by pattern
+    """
+    pattern = sparse.csr_matrix(jac_sparsity)
+    key = (pattern.shape, pattern.indptr.tobytes(), pattern.indices.tobytes())
+    if key not in _arrow_structures:
+        _arrow_structures[key] = arrow_banded_structure(pattern)
+    return _arrow_structures[key]
+
+
+def simulate_baseline(model, params, years, y0=None, n_points=2, **options):
+    """
+    Untreated natural history from y0 (zeros by default) over a number of years
+
+    Returns:
+    --------
+    SimulationResult
+        Trajectory on n_points evenly spaced times; final_state is the
+        pre-treatment state
+    """
+    t = np.linspace(0.0, years * WEEKS_PER_YEAR, max(n_points, 2))
+    return simulate(model, params, t, y0=y0, **options)
+
+
+class BaselineCache:
+    """
+    In-memory LRU cache of untreated pre-treatment states
+
+    Keyed by model hash, baseline duration and the values of the parameters
+    the untreated trajectory can depend on (GeertsModel.untreated_parameters),
+    so every regimen evaluated for the same virtual patient, and every fit
+    iteration that only moves antibody parameters, integrates only the
+    treatment window.
+
+    Parameters:
+    -----------
+    max_entries : int, default 256
+        Number of baseline states kept
+    """
+
+    def __init__(self, max_entries=256):
+        self.states = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._untreated = {}
+
+    def _untreated_parameters(self, model, y0):
+        initial = () if y0 is None else tuple(model.species[i] for i in np.flatnonzero(y0))
+        key = (model.model_hash, initial)
+        if key not in self._untreated:
+            self._untreated[key] = model.untreated_parameters(initial)
+        return self._untreated[key]
+
+    def key(self, model, params, years, y0=None):
+        names = self._untreated_parameters(model, y0)
+        start = None if y0 is None else np.asarray(y0, dtype=float).tobytes()
+        return (model.model_hash, parameter_hash(params, names), float(years), start)
+
+    def lookup(self, key):
+        """
+        Copy of the state cached under a key(), None (and a miss) when absent
+        """
+        if key not in self.states:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.states.move_to_end(key)
+        return self.states[key].copy()
+
+    def put(self, key, state):
+        """
+        Store a state integrated elsewhere (e.g. in a worker) under a key()
+        """
+        self.states[key] = np.array(state, dtype=float)
+        self.states.move_to_end(key)
+        if len(self.states) > self.max_entries:
+            self.states.popitem(last=False)
+
+    def get(self, model, params, years, y0=None, **options):
+        key = self.key(model, params, years, y0)
+        state = self.lookup(key)
+        if state is None:
+            state = simulate_baseline(model, params, years, y0=y0, **options).final_state
+            self.put(key, state)
+        return state.copy()
+
+
+def simulate_treatment(model, params, t_eval_weeks, regimen=None, baseline_years=20.0,
+                       baseline_cache=None, **options):
+    """
+    Simulate a treatment window from the cached untreated state at treatment start
+
+    The baseline is only re-integrated when a parameter outside
+    GeertsModel.treatment_parameters() changed, so objective functions that
+    vary antibody parameters pay for the treatment window alone.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    params : dict
+        Parameter set
+    t_eval_weeks : array-like
+        Output times in weeks from treatment start
+    regimen : dict, list of dict or None
+        Dosing regimen(s), see simulate
+    baseline_years : float, default 20
+        Untreated history before treatment
+    baseline_cache : BaselineCache or None
+        Shared cache of pre-treatment states
+    **options
+        Passed to simulate (e.g. outputs, events, rtol)
+
+    Returns:
+    --------
+    SimulationResult
+        Trajectory over the treatment window
+    """
+    baseline_cache = BaselineCache() if baseline_cache is None else baseline_cache
+    solver_options = {key: options[key] for key in ('method', 'rtol', 'atol', 'backend')
+                      if key in options}
+    y0 = baseline_cache.get(model, params, baseline_years, **solver_options)
+    return simulate(model, params, t_eval_weeks, y0=y0, regimen=regimen, **options)
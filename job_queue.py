@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+"""
+Simulation Job Queue
+SQLite-backed queue of simulation, sweep and fit jobs run on a local process pool with
+asyncio orchestration, partial-result checkpoints and crash recovery
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from parallel import resolve_processes
+
+DEFAULT_DB = 'jobs.sqlite'
+STATUSES = ('queued', 'running', 'done', 'failed', 'cancelled')
+# Seconds a running job stays owned by its service without a heartbeat
+DEFAULT_LEASE = 120.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    owner TEXT,
+    lease_expires REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, priority DESC, id);
+CREATE TABLE IF NOT EXISTS progress (
+    job_id INTEGER NOT NULL,
+    step TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (job_id, step)
+);
+"""
+
+
+@contextmanager
+def _connect(db_path):
+    """
+    Autocommit connection in WAL mode, closed on exit
+    """
+    conn = sqlite3.connect(str(db_path), timeout=60.0, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def _dumps(value):
+    return json.dumps(value, default=_jsonable)
+
+
+class JobQueue:
+    """
+    Persistent job queue in a single SQLite file
+
+    Jobs move queued -> running -> done/failed. A claimed job is leased to
+    the claiming queue ('owner', host:pid plus a random suffix) until
+    'lease_expires'; the service renews the leases of its running jobs while
+    they run. A running job whose lease has lapsed belongs to a crashed
+    service and is re-queued by recover(), so several services can share one
+    queue; handlers that checkpoint through JobProgress resume from their
+    last saved step.
+
+    Parameters:
+    -----------
+    db_path : str or Path
+        SQLite database, created when missing
+    lease_seconds : float, default DEFAULT_LEASE
+        Lease granted by claim() and renew()
+    """
+
+    def __init__(self, db_path=DEFAULT_DB, lease_seconds=DEFAULT_LEASE):
+        self.db_path = Path(db_path)
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        with _connect(self.db_path) as conn:
+            conn.executescript(SCHEMA)
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (('owner', 'TEXT'), ('lease_expires', 'REAL')):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    def submit(self, kind, payload, priority=0):
+        """
+        Add a job
+
+        Parameters:
+        -----------
+        kind : str
+            'simulate', 'sweep', 'fit' or 'module:function' for a custom handler
+        payload : dict
+            JSON-serialisable job description (see the handlers)
+        priority : int, default 0
+            Higher runs first
+
+        Returns:
+        --------
+        int
+            Job id
+        """
+        _handler(kind)
+        with _connect(self.db_path) as conn:
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, payload, priority, submitted) VALUES (?, ?, ?, ?)",
+                (kind, _dumps(payload), int(priority), time.time()))
+            return cursor.lastrowid
+
+    def claim(self):
+        """
+        Atomically mark the next queued job as running
+
+        Returns:
+        --------
+        dict or None
+            'id', 'kind' and 'payload' of the claimed job
+        """
+        with _connect(self.db_path) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT id, kind, payload FROM jobs WHERE status = 'queued' "
+                               "ORDER BY priority DESC, id LIMIT 1").fetchone()
+            if row is not None:
+                now = time.time()
+                conn.execute("UPDATE jobs SET status = 'running', started = ?, attempts = attempts + 1, "
+                             "owner = ?, lease_expires = ? WHERE id = ?",
+                             (now, self.owner, now + self.lease_seconds, row['id']))
+            conn.execute('COMMIT')
+        if row is None:
+            return None
+        return {'id': row['id'], 'kind': row['kind'], 'payload': json.loads(row['payload'])}
+
+    def renew(self, job_ids):
+        """
+        Extend the leases of running jobs this queue owns (the service heartbeat)
+        """
+        expires = time.time() + self.lease_seconds
+        with _connect(self.db_path) as conn:
+            conn.executemany("UPDATE jobs SET lease_expires = ? WHERE id = ? AND owner = ? "
+                             "AND status = 'running'",
+                             [(expires, job_id, self.owner) for job_id in job_ids])
+
+    def complete(self, job_id, result):
+        """
+        Store a result, unless the job was re-queued after its lease lapsed
+        """
+        with _connect(self.db_path) as conn:
+            return conn.execute("UPDATE jobs SET status = 'done', result = ?, error = NULL, "
+                                "finished = ?, lease_expires = NULL "
+                                "WHERE id = ? AND owner = ? AND status = 'running'",
+                                (_dumps(result), time.time(), job_id, self.owner)).rowcount > 0
+
+    def fail(self, job_id, error, max_attempts=1):
+        """
+        Record a failure; the job is re-queued while it has attempts left
+        """
+        with _connect(self.db_path) as conn:
+            attempts = conn.execute("SELECT attempts FROM jobs WHERE id = ?",
+                                    (job_id,)).fetchone()['attempts']
+            status = 'queued' if attempts < max_attempts else 'failed'
+            return conn.execute("UPDATE jobs SET status = ?, error = ?, finished = ?, "
+                                "lease_expires = NULL WHERE id = ? AND owner = ? AND status = 'running'",
+                                (status, error, time.time(), job_id, self.owner)).rowcount > 0
+
+    def recover(self, max_attempts=3):
+        """
+        Re-queue running jobs whose lease has lapsed (their service crashed)
+
+        Jobs of live services keep renewing their leases and are left alone.
+
+        Returns:
+        --------
+        int
+            Number of jobs re-queued
+        """
+        expired = "status = 'running' AND (lease_expires IS NULL OR lease_expires < ?)"
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("UPDATE jobs SET status = 'failed', error = 'Too many interrupted attempts', "
+                         f"lease_expires = NULL WHERE {expired} AND attempts >= ?", (now, max_attempts))
+            count = conn.execute("UPDATE jobs SET status = 'queued', lease_expires = NULL "
+                                 f"WHERE {expired}", (now,)).rowcount
+            conn.execute('COMMIT')
+            return count
+
+    def cancel(self, job_id):
+        with _connect(self.db_path) as conn:
+            return conn.execute("UPDATE jobs SET status = 'cancelled' WHERE id = ? AND status = 'queued'",
+                                (job_id,)).rowcount > 0
+
+    def requeue(self, job_id):
+        with _connect(self.db_path) as conn:
+            return conn.execute("UPDATE jobs SET status = 'queued', attempts = 0 WHERE id = ? "
+                                "AND status IN ('failed', 'cancelled')", (job_id,)).rowcount > 0
+
+    def job(self, job_id):
+        """
+        Full record of a job, with decoded payload, result and saved progress steps
+        """
+        with _connect(self.db_path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"No job {job_id}")
+            steps = conn.execute("SELECT COUNT(*) FROM progress WHERE job_id = ?",
+                                 (job_id,)).fetchone()[0]
+        record = dict(row)
+        record['payload'] = json.loads(record['payload'])
+        record['result'] = None if record['result'] is None else json.loads(record['result'])
+        record['progress_steps'] = steps
+        return record
+
+    def status(self, window_seconds=3600.0):
+        """
+        Queue depth and throughput
+
+        Returns:
+        --------
+        dict
+            Counts per status, 'queue_depth', 'throughput_per_hour' over the
+            last window, 'mean_runtime_s' of finished jobs and
+            'oldest_queued_age_s'
+        """
+        now = time.time()
+        with _connect(self.db_path) as conn:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            recent = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'done' AND finished >= ?",
+                                  (now - window_seconds,)).fetchone()[0]
+            runtime = conn.execute("SELECT AVG(finished - started) FROM jobs "
+                                   "WHERE status = 'done'").fetchone()[0]
+            oldest = conn.execute("SELECT MIN(submitted) FROM jobs "
+                                  "WHERE status = 'queued'").fetchone()[0]
+        return {
+            **{status: counts.get(status, 0) for status in STATUSES},
+            'queue_depth': counts.get('queued', 0),
+            'throughput_per_hour': recent * 3600.0 / window_seconds,
+            'mean_runtime_s': runtime,
+            'oldest_queued_age_s': None if oldest is None else now - oldest,
+        }
+
+
+class JobProgress:
+    """
+    Partial results of one job, persisted step by step
+
+    Handlers save each finished unit of work (a sweep point, the current fit
+    estimate) so a re-queued job skips what it already computed.
+    """
+
+    def __init__(self, db_path, job_id):
+        self.db_path = db_path
+        self.job_id = job_id
+
+    def save(self, step, data):
+        with _connect(self.db_path) as conn:
+            conn.execute("INSERT OR REPLACE INTO progress (job_id, step, data, updated) "
+                         "VALUES (?, ?, ?, ?)", (self.job_id, str(step), _dumps(data), time.time()))
+
+    def load(self):
+        """
+        Saved steps as a dict step -> data
+        """
+        with _connect(self.db_path) as conn:
+            rows = conn.execute("SELECT step, data FROM progress WHERE job_id = ?",
+                                (self.job_id,)).fetchall()
+        return {row['step']: json.loads(row['data']) for row in rows}
+
+
+def job_parameters(payload):
+    """
+    Parameter set of a job: 'params_file' (JSON dict or CSV with Name/Value
+    columns), updated with 'params' and then 'overrides'
+    """
+    params = {}
+    if payload.get('params_file'):
+        path = Path(payload['params_file'])
+        if path.suffix == '.csv':
+            table = pd.read_csv(path)
+            params = dict(zip(table['Name'], pd.to_numeric(table['Value'], errors='coerce')))
+        else:
+            with open(path, encoding='utf-8') as f:
+                params = json.load(f)
+    return {**params, **payload.get('params', {}), **payload.get('overrides', {})}
+
+
+_BASELINES = None
+
+
+def run_simulation(payload, progress=None):
+    """
+    'simulate' job: one treatment window from the untreated baseline
+
+    Payload keys: parameters (see job_parameters), 'regimen',
+    't_eval_weeks' (default [0, 78]), 'outputs' (default SUVR and
+    Centiloid) and 'baseline_years' (default 20).
+    """
+    global _BASELINES
+    from geerts_model import BaselineCache, default_model, simulate_treatment
+    if _BASELINES is None:
+        _BASELINES = BaselineCache()
+    outputs = payload.get('outputs', ['SUVR', 'Centiloid'])
+    result = simulate_treatment(default_model(), job_parameters(payload),
+                                payload.get('t_eval_weeks', [0.0, 78.0]), payload.get('regimen'),
+                                payload.get('baseline_years', 20.0), baseline_cache=_BASELINES,
+                                outputs=outputs)
+    return {'t_weeks': result.t_weeks, **{name: result.y[i] for i, name in enumerate(outputs)}}
+
+
+def run_sweep(payload, progress=None):
+    """
+    'sweep' job: a simulation per entry of 'points' (override dicts)
+
+    Each finished point is checkpointed, so a resumed sweep only runs the rest.
+    """
+    done = progress.load() if progress is not None else {}
+    results = []
+    for i, point in enumerate(payload['points']):
+        if str(i) in done:
+            results.append(done[str(i)])
+            continue
+        job = {**payload, 'overrides': {**payload.get('overrides', {}), **point}}
+        result = json.loads(_dumps(run_simulation(job)))
+        if progress is not None:
+            progress.save(i, result)
+        results.append(result)
+    return {'points': payload['points'], 'results': results}
+
+
+def run_fit(payload, progress=None):
+    """
+    'fit' job: fitting.fit_parameters on an objective built by a factory
+
+    Payload keys: 'objective' ('module:function' called with the payload,
+    returning objective(params_dict) -> float), 'x0' (free parameters and
+    start values), optional 'fixed', 'bounds', 'method', 'options' and
+    'trial' (for the factory). The current estimate is checkpointed after
+    every iteration and a resumed fit restarts from it. With
+    'checkpoint_path' the evaluated-point archive is saved there instead
+    and a resumed fit replays it, finishing exactly as if uninterrupted.
+    """
+    from fitting import fit_parameters
+    objective = _import(payload['objective'])(payload)
+    x0 = dict(payload['x0'])
+    saved = progress.load() if progress is not None else {}
+    if payload.get('checkpoint_path'):
+        # Replaying the archive repeats the earlier iterations, callbacks included
+        saved = {}
+    if 'estimate' in saved:
+        x0.update(saved['estimate']['params'])
+    iteration = saved.get('estimate', {}).get('iteration', 0)
+
+    def checkpoint(params):
+        nonlocal iteration
+        iteration += 1
+        if progress is not None:
+            progress.save('estimate', {'params': params, 'iteration': iteration})
+
+    fit = fit_parameters(objective, x0, fixed=payload.get('fixed'),
+                         bounds={key: tuple(value) for key, value in payload.get('bounds', {}).items()},
+                         method=payload.get('method', 'Nelder-Mead'),
+                         options=payload.get('options'), callback=checkpoint,
+                         checkpoint_path=payload.get('checkpoint_path'))
+    return {'params': fit['params'], 'fun': fit['fun'], 'success': bool(fit['success']),
+            'nfev': fit['nfev'], 'iterations': iteration}
+
+
+HANDLERS = {'simulate': run_simulation, 'sweep': run_sweep, 'fit': run_fit}
+
+
+def _import(path):
+    module_name, _, attribute = path.partition(':')
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def _handler(kind):
+    if kind in HANDLERS:
+        return HANDLERS[kind]
+    if ':' in kind:
+        return _import(kind)
+    raise ValueError(f"Unknown job kind: {kind}")
+
+
+def execute_job(db_path, job_id, kind, payload):
+    """
+    Run one job in a worker process and return its JSON-serialisable result
+    """
+    result = _handler(kind)(payload, JobProgress(db_path, job_id))
+    return json.loads(_dumps(result))
+
+
+def _report(queue):
+    status = queue.status()
+    runtime = status['mean_runtime_s']
+    print(f"[{time.strftime('%H:%M:%S')}] queued {status['queued']}, running {status['running']}, "
+          f"done {status['done']}, failed {status['failed']}; "
+          f"{status['throughput_per_hour']:.1f} jobs/h"
+          + (f", mean runtime {runtime:.1f} s" if runtime is not None else ""))
+
+
+async def serve(db_path=DEFAULT_DB, processes=None, until_empty=False, poll_interval=1.0,
+                report_interval=30.0, max_attempts=3, lease_seconds=DEFAULT_LEASE):
+    """
+    Run queued jobs on a process pool until stopped (or until the queue is empty)
+
+    The event loop claims jobs while workers are free, collects results as
+    they finish and prints a status line every report_interval seconds.
+    SIGINT/SIGTERM stop claiming new jobs and wait for running ones; after a
+    hard crash, the interrupted jobs are re-queued once their leases lapse,
+    by the next serve() or by any other service sharing the queue.
+
+    Parameters:
+    -----------
+    db_path : str or Path
+        Queue database
+    processes : int or None
+        Worker processes, None for one per CPU
+    until_empty : bool, default False
+        Return once no jobs are queued or running
+    poll_interval : float, default 1.0
+        Seconds between queue polls when idle
+    report_interval : float, default 30.0
+        Seconds between status lines
+    max_attempts : int, default 3
+        Attempts per job before it is marked failed
+    lease_seconds : float, default DEFAULT_LEASE
+        Lease on running jobs, renewed every loop; after a crash other
+        services wait this long before re-running the jobs
+
+    Returns:
+    --------
+    dict
+        Final queue status
+    """
+    queue = JobQueue(db_path, lease_seconds)
+    recovered = queue.recover(max_attempts)
+    if recovered:
+        print(f"Re-queued {recovered} interrupted job(s)")
+    processes = resolve_processes(processes)
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    running = {}
+    last_report = 0.0
+    pool = ProcessPoolExecutor(processes)
+    try:
+        while True:
+            while not stopping.is_set() and len(running) < processes:
+                job = queue.claim()
+                if job is None:
+                    break
+                future = loop.run_in_executor(pool, execute_job, str(queue.db_path), job['id'],
+                                              job['kind'], job['payload'])
+                running[future] = job
+
+            if not running and (until_empty or stopping.is_set()):
+                break
+            if running:
+                done, _ = await asyncio.wait(running, timeout=poll_interval,
+                                             return_when=FIRST_COMPLETED)
+            else:
+                done = set()
+                try:
+                    await asyncio.wait_for(stopping.wait(), timeout=poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            broken = False
+            for future in done:
+                job = running.pop(future)
+                try:
+                    queue.complete(job['id'], future.result())
+                except BrokenProcessPool:
+                    broken = True
+                    queue.fail(job['id'], "Worker process died", max_attempts)
+                except Exception:
+                    queue.fail(job['id'], traceback.format_exc(), max_attempts)
+            if broken:
+                print("Worker pool broke; restarting it")
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = ProcessPoolExecutor(processes)
+
+            if running:
+                queue.renew([job['id'] for job in running.values()])
+            if time.monotonic() - last_report >= report_interval:
+                recovered = queue.recover(max_attempts)
+                if recovered:
+                    print(f"Re-queued {recovered} job(s) of a crashed service")
+                _report(queue)
+                last_report = time.monotonic()
+    finally:
+        pool.shutdown(wait=True)
+    _report(queue)
+    return queue.status()
+
+
+def _load_payload(text):
+    path = Path(text)
+    if path.suffix == '.json' and path.exists():
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    return json.loads(text)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local job queue for Geerts model simulations and fits")
+    parser.add_argument('--db', default=DEFAULT_DB, help="Queue database (default: jobs.sqlite)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help="Queue a job")
+    submit.add_argument('kind', help="simulate, sweep, fit or module:function")
+    submit.add_argument('payload', help="Payload as a JSON string or a .json file")
+    submit.add_argument('--priority', type=int, default=0)
+
+    run = commands.add_parser('run', help="Run the worker service")
+    run.add_argument('--processes', type=int, default=None)
+    run.add_argument('--until-empty', action='store_true', help="Exit when the queue is drained")
+    run.add_argument('--report-interval', type=float, default=30.0)
+    run.add_argument('--max-attempts', type=int, default=3)
+    run.add_argument('--lease', type=float, default=DEFAULT_LEASE,
+                     help="Seconds before another service may re-run a job of this one after a crash")
+
+    status = commands.add_parser('status', help="Show queue depth and throughput")
+    status.add_argument('--json', action='store_true')
+
+    show = commands.add_parser('show', help="Show one job")
+    show.add_argument('job_id', type=int)
+
+    for name, text in (('cancel', "Cancel a queued job"), ('requeue', "Re-queue a failed or cancelled job")):
+        command = commands.add_parser(name, help=text)
+        command.add_argument('job_id', type=int)
+
+    args = parser.parse_args(argv)
+    queue = JobQueue(args.db)
+
+    if args.command == 'submit':
+        print(queue.submit(args.kind, _load_payload(args.payload), args.priority))
+    elif args.command == 'run':
+        asyncio.run(serve(args.db, args.processes, args.until_empty,
+                          report_interval=args.report_interval, max_attempts=args.max_attempts,
+                          lease_seconds=args.lease))
+    elif args.command == 'status':
+        summary = queue.status()
+        if args.json:
+            print(json.dumps(summary, indent=2))
+        else:
+            for key, value in summary.items():
+                print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+    elif args.command == 'show':
+        print(json.dumps(queue.job(args.job_id), indent=2))
+    elif args.command == 'cancel':
+        print("Cancelled" if queue.cancel(args.job_id) else "Job is not queued")
+    elif args.command == 'requeue':
+        print("Re-queued" if queue.requeue(args.job_id) else "Job is not failed or cancelled")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,423 @@
+"""
+Bayesian Posterior Sampling
+Adaptive Metropolis and affine-invariant ensemble samplers over model parameters,
+with parallel chains, disk checkpoints and optional surrogate screening
+"""
+
+import json
+from collections import OrderedDict
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from checkpoint import write_checkpoint
+from fitting import from_search_space, to_search_space
+from parallel import parallel_map
+
+
+class LogPosterior:
+    """
+    Log-posterior over log10 parameters with a flat prior inside bounds
+
+    Parameters:
+    -----------
+    log_likelihood : callable
+        Takes a dict of parameter values and returns the log-likelihood
+        (e.g. trial_data.TrialLikelihood)
+    names : list of str
+        Sampled parameters
+    bounds : dict
+        Mapping name -> (lower, upper) in natural units, e.g. from
+        model_params.log_uniform_bounds
+    fixed : dict or None
+        Parameters held constant and passed through to the likelihood
+    """
+
+    def __init__(self, log_likelihood, names, bounds, fixed=None):
+        self.log_likelihood = log_likelihood
+        self.names = list(names)
+        self.fixed = dict(fixed or {})
+        self.lower = to_search_space([bounds[name][0] for name in self.names])
+        self.upper = to_search_space([bounds[name][1] for name in self.names])
+
+    def params(self, z):
+        return {**self.fixed, **dict(zip(self.names, from_search_space(z)))}
+
+    def __call__(self, z):
+        z = np.asarray(z, dtype=float)
+        if np.any(z < self.lower) or np.any(z > self.upper):
+            return -np.inf
+        value = self.log_likelihood(self.params(z))
+        return float(value) if np.isfinite(value) else -np.inf
+
+
+class CachedLogProb:
+    """
+    Least-recently-used cache in front of an expensive log-probability
+
+    Points are keyed by their rounded coordinates, so revisits (e.g. after a
+    resumed chain replays its last state) skip the Geerts network solve.
+    """
+
+    def __init__(self, log_prob, maxsize=4096, decimals=12):
+        self.log_prob = log_prob
+        self.maxsize = maxsize
+        self.decimals = decimals
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, z):
+        key = np.round(np.asarray(z, dtype=float), self.decimals).tobytes()
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        value = self.log_prob(z)
+        self.cache[key] = value
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return value
+
+
+class AdaptiveMetropolis:
+    """
+    Adaptive Metropolis sampler (Haario et al 2001)
+
+    The Gaussian proposal covariance is learned from the chain history. When a
+    cheap screen_log_prob (e.g. a surrogate emulator) is given, proposals are
+    first accepted or rejected on the screen and only survivors are evaluated
+    on the full model (delayed acceptance, Christen and Fox 2005), which keeps
+    the chain exact while skipping most expensive solves.
+
+    Parameters:
+    -----------
+    log_prob : callable
+        Log-posterior of a parameter vector
+    x0 : array-like
+        Starting point
+    proposal_scale : float, default 0.05
+        Standard deviation of the initial isotropic proposal
+    adapt_start : int, default 200
+        Number of steps before the proposal covariance is adapted
+    epsilon : float, default 1e-10
+        Regularisation added to the adapted covariance
+    screen_log_prob : callable or None
+        Cheap approximation of log_prob used for delayed acceptance
+    seed : int or None
+        Random seed
+    state : dict or None
+        Saved state() to resume from, which skips evaluating log_prob at x0
+    """
+
+    def __init__(self, log_prob, x0, proposal_scale=0.05, adapt_start=200, epsilon=1e-10,
+                 screen_log_prob=None, seed=None, state=None):
+        self.log_prob = log_prob
+        self.screen_log_prob = screen_log_prob
+        self.x = np.asarray(x0, dtype=float).copy()
+        self.dim = self.x.size
+        self.proposal_scale = proposal_scale
+        self.adapt_start = adapt_start
+        self.epsilon = epsilon
+        self.rng = np.random.default_rng(seed)
+        self.n = 0
+        self.mean = np.zeros(self.dim)
+        self.m2 = np.zeros((self.dim, self.dim))
+        self.n_accepted = 0
+        self.n_screened_out = 0
+        if state is not None:
+            self.load_state(state)
+        else:
+            self.logp = log_prob(self.x)
+            self.screen_logp = screen_log_prob(self.x) if screen_log_prob is not None else 0.0
+
+    def _proposal_cov(self):
+        if self.n < self.adapt_start:
+            return np.eye(self.dim) * self.proposal_scale ** 2
+        cov = self.m2 / (self.n - 1)
+        return (2.38 ** 2 / self.dim) * (cov + self.epsilon * np.eye(self.dim))
+
+    def _update_moments(self):
+        self.n += 1
+        delta = self.x - self.mean
+        self.mean += delta / self.n
+        self.m2 += np.outer(delta, self.x - self.mean)
+
+    def step(self):
+        """
+        Advance the chain by one step and return (position, log-probability)
+        """
+        y = self.rng.multivariate_normal(self.x, self._proposal_cov())
+        log_u = np.log(self.rng.uniform())
+
+        if self.screen_log_prob is None:
+            logp_y = self.log_prob(y)
+            accept = log_u < logp_y - self.logp
+            screen_y = 0.0
+        else:
+            screen_y = self.screen_log_prob(y)
+            if not log_u < screen_y - self.screen_logp:
+                self.n_screened_out += 1
+                accept = False
+            else:
+                logp_y = self.log_prob(y)
+                log_u2 = np.log(self.rng.uniform())
+                accept = log_u2 < (logp_y - self.logp) - (screen_y - self.screen_logp)
+
+        if accept:
+            self.x, self.logp, self.screen_logp = y, logp_y, screen_y
+            self.n_accepted += 1
+        self._update_moments()
+        return self.x.copy(), self.logp
+
+    def state(self):
+        return {'x': self.x, 'logp': self.logp, 'screen_logp': self.screen_logp, 'n': self.n,
+                'mean': self.mean, 'm2': self.m2, 'n_accepted': self.n_accepted,
+                'n_screened_out': self.n_screened_out}
+
+    def load_state(self, state):
+        self.x = np.asarray(state['x'], dtype=float)
+        self.mean = np.asarray(state['mean'], dtype=float)
+        self.m2 = np.asarray(state['m2'], dtype=float)
+        for key in ('logp', 'screen_logp'):
+            setattr(self, key, float(state[key]))
+        for key in ('n', 'n_accepted', 'n_screened_out'):
+            setattr(self, key, int(state[key]))
+
+
+class EnsembleSampler:
+    """
+    Affine-invariant ensemble sampler with the stretch move (Goodman and Weare 2010)
+
+    Parameters:
+    -----------
+    log_prob : callable
+        Log-posterior of a parameter vector
+    x0 : array-like
+        Initial walker positions, shape (n_walkers, dim) with n_walkers >= 2 * dim
+    stretch : float, default 2.0
+        Stretch-move scale parameter
+    seed : int or None
+        Random seed
+    state : dict or None
+        Saved state() to resume from, which skips evaluating log_prob at every walker
+    """
+
+    def __init__(self, log_prob, x0, stretch=2.0, seed=None, state=None):
+        self.log_prob = log_prob
+        self.x = np.array(x0, dtype=float)
+        self.n_walkers, self.dim = self.x.shape
+        if self.n_walkers < 2 * self.dim:
+            raise ValueError("The ensemble needs at least twice as many walkers as parameters")
+        self.stretch = stretch
+        self.rng = np.random.default_rng(seed)
+        self.n_accepted = 0
+        if state is not None:
+            self.load_state(state)
+        else:
+            self.logp = np.array([log_prob(x) for x in self.x])
+
+    def step(self):
+        """
+        Update every walker once and return (positions, log-probabilities)
+        """
+        a = self.stretch
+        for k in range(self.n_walkers):
+            j = self.rng.integers(self.n_walkers - 1)
+            j += j >= k
+            z = ((a - 1.0) * self.rng.uniform() + 1.0) ** 2 / a
+            y = self.x[j] + z * (self.x[k] - self.x[j])
+            logp_y = self.log_prob(y)
+            log_ratio = (self.dim - 1) * np.log(z) + logp_y - self.logp[k]
+            if np.log(self.rng.uniform()) < log_ratio:
+                self.x[k], self.logp[k] = y, logp_y
+                self.n_accepted += 1
+        return self.x.copy(), self.logp.copy()
+
+    def state(self):
+        return {'x': self.x, 'logp': self.logp, 'n_accepted': self.n_accepted}
+
+    def load_state(self, state):
+        self.x = np.asarray(state['x'], dtype=float).copy()
+        self.logp = np.asarray(state['logp'], dtype=float).copy()
+        self.n_accepted = int(state['n_accepted'])
+
+
+SAMPLERS = {'adaptive_metropolis': AdaptiveMetropolis, 'ensemble': EnsembleSampler}
+
+
+def _write_checkpoint(path, samples, log_probs, n_done, sampler):
+    """
+    Atomically write a chain checkpoint (samples so far, sampler and RNG state)
+    """
+    state = {f'state_{key}': np.asarray(value) for key, value in sampler.state().items()}
+    write_checkpoint(path, samples=samples[:n_done], log_probs=log_probs[:n_done], n_done=n_done,
+                     rng_state=json.dumps(sampler.rng.bit_generator.state), **state)
+
+
+def _read_checkpoint(path):
+    """
+    Read a chain checkpoint: (sampler state, RNG state, samples, log_probs, n_done)
+    """
+    with np.load(path) as data:
+        state = {key[len('state_'):]: data[key] for key in data.files if key.startswith('state_')}
+        return (state, json.loads(str(data['rng_state'])), data['samples'], data['log_probs'],
+                int(data['n_done']))
+
+
+def run_chain(log_prob, x0, n_steps, sampler='adaptive_metropolis', checkpoint_path=None,
+              checkpoint_every=100, seed=None, cache_size=0, **sampler_options):
+    """
+    Run one chain, resuming from its checkpoint file if one exists
+
+    Parameters:
+    -----------
+    log_prob : callable
+        Log-posterior of a parameter vector (e.g. LogPosterior)
+    x0 : array-like
+        Starting point, or walker positions for the ensemble sampler
+    n_steps : int
+        Total number of steps, including any already in the checkpoint
+    sampler : str, default 'adaptive_metropolis'
+        'adaptive_metropolis' or 'ensemble'
+    checkpoint_path : str or Path or None
+        Checkpoint file (.npz), no checkpointing when None
+    checkpoint_every : int, default 100
+        Steps between checkpoints
+    seed : int or None
+        Random seed
+    cache_size : int, default 0
+        Size of the LRU cache in front of log_prob, disabled when 0
+    **sampler_options
+        Passed to the sampler class
+
+    Returns:
+    --------
+    dict
+        'samples', 'log_probs' and 'acceptance_rate'
+    """
+    if cache_size:
+        log_prob = CachedLogProb(log_prob, maxsize=cache_size)
+    state = None
+    if checkpoint_path is not None and Path(checkpoint_path).exists():
+        state, rng_state, done_samples, done_log_probs, n_done = _read_checkpoint(checkpoint_path)
+    # A restored sampler takes its log-probabilities from the checkpoint
+    chain = SAMPLERS[sampler](log_prob, x0, seed=seed, state=state, **sampler_options)
+    shape = (n_steps,) + chain.x.shape
+    samples = np.empty(shape)
+    log_probs = np.empty(shape[:-1])
+
+    if state is None:
+        n_done = 0
+    else:
+        chain.rng.bit_generator.state = rng_state
+        n_done = min(n_done, n_steps)
+        samples[:n_done] = done_samples[:n_done]
+        log_probs[:n_done] = done_log_probs[:n_done]
+        print(f"Resumed chain from {checkpoint_path} at step {n_done}")
+
+    for i in range(n_done, n_steps):
+        samples[i], log_probs[i] = chain.step()
+        if checkpoint_path is not None and ((i + 1) % checkpoint_every == 0 or i + 1 == n_steps):
+            _write_checkpoint(checkpoint_path, samples, log_probs, i + 1, chain)
+
+    n_proposals = n_steps * (chain.n_walkers if sampler == 'ensemble' else 1)
+    return {'samples': samples, 'log_probs': log_probs,
+            'acceptance_rate': chain.n_accepted / max(n_proposals, 1)}
+
+
+def _chain_job(job, log_prob, n_steps, sampler, checkpoint_dir, options):
+    index, x0, seed = job
+    path = None if checkpoint_dir is None else Path(checkpoint_dir) / f"chain_{index}.npz"
+    return run_chain(log_prob, x0, n_steps, sampler=sampler, checkpoint_path=path, seed=seed,
+                     **options)
+
+
+def run_chains(log_prob, starts, n_steps, sampler='adaptive_metropolis', checkpoint_dir=None,
+               processes=None, seed=0, **options):
+    """
+    Run independent chains in parallel processes
+
+    Parameters:
+    -----------
+    log_prob : callable
+        Picklable log-posterior (e.g. LogPosterior)
+    starts : list of array-like
+        One starting point (or walker array) per chain
+    n_steps : int
+        Steps per chain
+    sampler : str, default 'adaptive_metropolis'
+        'adaptive_metropolis' or 'ensemble'
+    checkpoint_dir : str or Path or None
+        Directory for chain_<i>.npz checkpoints; rerunning with the same
+        directory resumes every chain where it stopped
+    processes : int or None
+        Number of worker processes, None for one per CPU
+    seed : int, default 0
+        Base seed, chain i uses seed + i
+    **options
+        Passed to run_chain (checkpoint_every, cache_size, sampler options)
+
+    Returns:
+    --------
+    list of dict
+        run_chain result per chain
+    """
+    if checkpoint_dir is not None:
+        Path(checkpoint_dir).mkdir(parents=True, exist_ok=True)
+    jobs = [(i, start, seed + i) for i, start in enumerate(starts)]
+    job = partial(_chain_job, log_prob=log_prob, n_steps=n_steps, sampler=sampler,
+                  checkpoint_dir=checkpoint_dir, options=options)
+    return parallel_map(job, jobs, processes=processes)
+
+
+def gelman_rubin(chains):
+    """
+    Potential scale reduction factor (R-hat) per parameter
+
+    Parameters:
+    -----------
+    chains : numpy.ndarray
+        Post burn-in samples, shape (n_chains, n_steps, dim)
+
+    Returns:
+    --------
+    numpy.ndarray
+        R-hat per parameter
+    """
+    chains = np.asarray(chains, dtype=float)
+    n = chains.shape[1]
+    within = chains.var(axis=1, ddof=1).mean(axis=0)
+    between = n * chains.mean(axis=1).var(axis=0, ddof=1)
+    pooled = (n - 1) / n * within + between / n
+    return np.sqrt(pooled / within)
+
+
+def posterior_summary(results, names, burn_in=0):
+    """
+    Summarise chains in natural parameter units
+
+    Parameters:
+    -----------
+    results : list of dict
+        Output of run_chains
+    names : list of str
+        Parameter names, in sampling order
+    burn_in : int, default 0
+        Steps discarded from the start of every chain
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Median, 2.5% and 97.5% quantiles and R-hat per parameter
+    """
+    chains = np.stack([result['samples'][burn_in:] for result in results])
+    if chains.ndim == 4:
+        chains = chains.transpose(0, 2, 1, 3).reshape(-1, chains.shape[1], chains.shape[3])
+    flat = from_search_space(chains.reshape(-1, chains.shape[-1]))
+    quantiles = np.quantile(flat, [0.025, 0.5, 0.975], axis=0)
+    return pd.DataFrame({'parameter': names, 'median': quantiles[1], 'q2.5': quantiles[0],
+                         'q97.5': quantiles[2], 'r_hat': gelman_rubin(chains)})
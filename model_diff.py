@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Reaction-List Model Diff
+Compares two revisions of the Geerts reaction list by canonical hashes and reports
+added, removed and changed reactions, species and parameters, plus stale cached results
+"""
+
+import argparse
+import ast
+import hashlib
+import importlib.util
+import json
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import chdir, redirect_stdout
+from pathlib import Path
+
+from geerts_model import (IDENTIFIER, canonical_reaction, parse_species, reaction_list_hash,
+                          split_rate_prototype)
+
+
+def load_reactions(path, stream=None):
+    """
+    Load a reaction list from a .txt dump (one dict per line) or a .py builder
+
+    Parameters:
+    -----------
+    path : str or Path
+        Geerts_all_reactions.txt-style file, or a module defining build_reactions()
+    stream : file-like or None
+        Receives what the builder prints (its reaction count), sys.stderr when
+        None so reports on stdout stay machine-readable. The builder runs in
+        a temporary working directory, so files that old builders write at
+        import (Geerts_all_reactions.txt) cannot overwrite tracked files
+
+    Returns:
+    --------
+    list of dict
+        Reaction dicts
+    """
+    path = Path(path)
+    if path.suffix == '.py':
+        spec = importlib.util.spec_from_file_location(f"_reactions_{path.stem}", path.resolve())
+        module = importlib.util.module_from_spec(spec)
+        with tempfile.TemporaryDirectory() as scratch, chdir(scratch), \
+                redirect_stdout(sys.stderr if stream is None else stream):
+            spec.loader.exec_module(module)
+            return module.build_reactions()
+    with open(path, encoding='utf-8') as f:
+        return [ast.literal_eval(line) for line in f if line.strip()]
+
+
+def _digest(value):
+    return hashlib.blake2b(repr(value).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def index_reactions(reactions):
+    """
+    Canonicalise a reaction list into hash-indexed structures
+
+    A reaction's identity is its name, reactants and products; its rate law
+    (type and prototypes) is hashed separately so that an identity present in
+    both revisions with a different rate hash is reported as changed.
+
+    Returns:
+    --------
+    dict
+        'reactions' (identity hash -> list of (rate hash, canonical form)),
+        'species' and 'parameters' (sets) and 'model_hash'
+    """
+    by_identity = defaultdict(list)
+    species, names = set(), set()
+    for reaction in reactions:
+        canonical = canonical_reaction(reaction)
+        identity = _digest(canonical[:3])
+        by_identity[identity].append((_digest(canonical[3:]), canonical))
+        species.update(parse_species(reaction['Reactants']))
+        species.update(parse_species(reaction['Products']))
+        for expression in split_rate_prototype(reaction):
+            if expression is not None:
+                names.update(IDENTIFIER.findall(expression))
+    return {'reactions': by_identity, 'species': species, 'parameters': names - species,
+            'model_hash': reaction_list_hash(reactions)}
+
+
+def _describe(canonical):
+    name, reactants, products, rate_type, forward, reverse = canonical
+    rate = forward if reverse is None else f"[{forward}, {reverse}]"
+    return (f"{name}: {' + '.join(reactants) or '0'} -> {' + '.join(products) or '0'}"
+            f" ({rate_type}: {rate})")
+
+
+def _parameters_of(canonical):
+    names = set()
+    for expression in canonical[4:]:
+        if expression is not None:
+            names.update(IDENTIFIER.findall(expression))
+    return names
+
+
+def diff_models(old_reactions, new_reactions):
+    """
+    Diff two reaction lists
+
+    Parameters:
+    -----------
+    old_reactions, new_reactions : list of dict
+        Reaction lists to compare
+
+    Returns:
+    --------
+    dict
+        'added', 'removed', 'changed' (reaction descriptions), 'species_added',
+        'species_removed', 'parameters_added', 'parameters_removed',
+        'parameters_affected' (used by any added, removed or changed reaction),
+        'old_hash' and 'new_hash'
+    """
+    old, new = index_reactions(old_reactions), index_reactions(new_reactions)
+    added, removed, changed = [], [], []
+    affected = set()
+
+    for identity in old['reactions'].keys() | new['reactions'].keys():
+        old_items = old['reactions'].get(identity, [])
+        new_items = new['reactions'].get(identity, [])
+        old_rates = {rate: canonical for rate, canonical in old_items}
+        new_rates = {rate: canonical for rate, canonical in new_items}
+        gone = [old_rates[rate] for rate in old_rates.keys() - new_rates.keys()]
+        came = [new_rates[rate] for rate in new_rates.keys() - old_rates.keys()]
+        # Duplicated identities with identical rate laws differ only in multiplicity
+        extra = len(new_items) - len(old_items)
+        if not gone and not came and extra:
+            (came if extra > 0 else gone).extend([(new_items or old_items)[0][1]] * abs(extra))
+        pairs = min(len(gone), len(came))
+        for before, after in zip(gone[:pairs], came[:pairs]):
+            changed.append({'before': _describe(before), 'after': _describe(after)})
+            affected |= _parameters_of(before) | _parameters_of(after)
+        for canonical in gone[pairs:]:
+            removed.append(_describe(canonical))
+            affected |= _parameters_of(canonical)
+        for canonical in came[pairs:]:
+            added.append(_describe(canonical))
+            affected |= _parameters_of(canonical)
+
+    affected -= old['species'] | new['species']
+    return {
+        'old_hash': old['model_hash'],
+        'new_hash': new['model_hash'],
+        'added': sorted(added),
+        'removed': sorted(removed),
+        'changed': sorted(changed, key=lambda item: item['before']),
+        'species_added': sorted(new['species'] - old['species']),
+        'species_removed': sorted(old['species'] - new['species']),
+        'parameters_added': sorted(new['parameters'] - old['parameters']),
+        'parameters_removed': sorted(old['parameters'] - new['parameters']),
+        'parameters_affected': sorted(affected),
+    }
+
+
+def stale_cache_entries(cache_dir, diff):
+    """
+    Find cached simulation and fit results invalidated by a model change
+
+    Every simulation_cache.ResultCache entry computed with the old model is
+    stale once the reaction list changes. Fits are additionally marked
+    'refit' when one of their parameters is used by a changed reaction.
+
+    Parameters:
+    -----------
+    cache_dir : str or Path
+        ResultCache directory
+    diff : dict
+        Output of diff_models
+
+    Returns:
+    --------
+    list of dict
+        'file', 'kind' and 'action' ('resimulate' or 'refit'/'revalidate')
+    """
+    if diff['old_hash'] == diff['new_hash']:
+        return []
+    affected = set(diff['parameters_affected'])
+    stale = []
+    for path in sorted(Path(cache_dir).glob('*.json')):
+        with open(path, encoding='utf-8') as f:
+            entry = json.load(f)
+        if entry.get('model_hash') != diff['old_hash']:
+            continue
+        kind = entry.get('kind', 'simulation')
+        if kind == 'fit':
+            action = 'refit' if affected & set(entry.get('parameters') or []) else 'revalidate'
+        else:
+            action = 'resimulate'
+        stale.append({'file': path.name, 'kind': kind, 'action': action})
+    return stale
+
+
+def print_diff(diff, stale=None):
+    """
+    Print a human-readable diff report
+    """
+    print(f"Old model hash: {diff['old_hash'][:16]}")
+    print(f"New model hash: {diff['new_hash'][:16]}")
+    if diff['old_hash'] == diff['new_hash']:
+        print("Reaction lists are equivalent")
+        return
+    for label, key in (('Added reactions', 'added'), ('Removed reactions', 'removed')):
+        print(f"\n{label} ({len(diff[key])}):")
+        for item in diff[key]:
+            print(f"  {item}")
+    print(f"\nChanged reactions ({len(diff['changed'])}):")
+    for item in diff['changed']:
+        print(f"  - {item['before']}\n  + {item['after']}")
+    for key in ('species_added', 'species_removed', 'parameters_added', 'parameters_removed',
+                'parameters_affected'):
+        print(f"\n{key.replace('_', ' ').capitalize()} ({len(diff[key])}): "
+              f"{', '.join(diff[key]) if diff[key] else '-'}")
+    if stale is not None:
+        print(f"\nStale cache entries ({len(stale)}):")
+        for item in stale:
+            print(f"  {item['file']} [{item['kind']}] -> {item['action']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diff two revisions of the Geerts reaction list")
+    parser.add_argument('old', help="Old reaction list (.txt dump or .py with build_reactions)")
+    parser.add_argument('new', help="New reaction list (.txt dump or .py with build_reactions)")
+    parser.add_argument('--cache-dir', help="ResultCache directory to check for stale entries")
+    parser.add_argument('--json', action='store_true', help="Print the diff as JSON")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    diff = diff_models(load_reactions(args.old), load_reactions(args.new))
+    stale = stale_cache_entries(args.cache_dir, diff) if args.cache_dir else None
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps({**diff, 'stale': stale}, indent=2))
+    else:
+        print_diff(diff, stale)
+        print(f"\nDiff computed in {elapsed * 1000:.0f} ms")
+    return 0 if diff['old_hash'] == diff['new_hash'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
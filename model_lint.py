@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+Reaction List Linter
+Fast static checks of the Geerts reaction list (builder source, duplicates, species balance,
+parameter definitions and rate units), run before model builds and fits
+
+Usage:
+    python model_lint.py [Geerts_reactions_full4.py | Geerts_all_reactions.txt] [--strict]
+"""
+
+import argparse
+import ast
+import io
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from fractions import Fraction
+from pathlib import Path
+
+from geerts_model import (DOSE_COMPARTMENTS, IDENTIFIER, canonical_reaction, parse_species,
+                          split_rate_prototype)
+from model_diff import load_reactions
+
+ROOT = Path(__file__).resolve().parent
+DEFAULT_SOURCE = ROOT / 'Geerts_reactions_full4.py'
+PARAM_FILES = (ROOT / 'params' / 'Abeta_Params_Lin.csv', ROOT / 'params' / 'mAb_Params_Lin.csv')
+RATE_TYPES = ('MA', 'RMA', 'UDF', 'custom', 'custom_conc_per_time')
+REQUIRED_KEYS = ('Reaction_name', 'Reactants', 'Products', 'Rate_type', 'Rate_eqtn_prototype')
+SPECIES_LIST = re.compile(r'^\[(0|[A-Za-z_][A-Za-z0-9_]*(, [A-Za-z_][A-Za-z0-9_]*)*)\]$')
+
+# Dimensions are exponents of (amount, volume, time, mass); species are amounts
+BASE_UNITS = {
+    'mol': (1, 0, 0, 0), 'mmol': (1, 0, 0, 0), 'umol': (1, 0, 0, 0), 'nmol': (1, 0, 0, 0),
+    'pmol': (1, 0, 0, 0), 'M': (1, -1, 0, 0), 'mM': (1, -1, 0, 0), 'uM': (1, -1, 0, 0),
+    'nM': (1, -1, 0, 0), 'pM': (1, -1, 0, 0), 'L': (0, 1, 0, 0), 'mL': (0, 1, 0, 0),
+    'uL': (0, 1, 0, 0), 's': (0, 0, 1, 0), 'min': (0, 0, 1, 0), 'h': (0, 0, 1, 0),
+    'hr': (0, 0, 1, 0), 'day': (0, 0, 1, 0), 'g': (0, 0, 0, 1), 'mg': (0, 0, 0, 1),
+    'kg': (0, 0, 0, 1),
+}
+DIMENSIONLESS = (0, 0, 0, 0)
+AMOUNT = (1, 0, 0, 0)
+RATE = (1, 0, -1, 0)
+# Expected dimension of the full rate of each custom Rate_type
+CUSTOM_RATE_DIMENSIONS = {'custom': RATE, 'custom_conc_per_time': (1, -1, -1, 0)}
+
+
+def finding(check, severity, message, reaction=None, line=None):
+    """
+    One lint result; severity is 'error' (blocks builds), 'warning' (blocks with --strict) or 'info'
+    """
+    return {'check': check, 'severity': severity, 'message': message, 'reaction': reaction, 'line': line}
+
+
+def unappended_reactions(source):
+    """
+    Reaction dicts built in build_reactions() but never appended to the list
+
+    Within every statement block, each `Reaction_dict = ...` assignment must
+    be followed by a `<list>.append(Reaction_dict)` in the same block before
+    the dict is reassigned.
+    """
+    tree = ast.parse(Path(source).read_text(encoding='utf-8'))
+    findings = []
+
+    def is_assignment(node):
+        return (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name) and node.targets[0].id == 'Reaction_dict')
+
+    def is_append(node):
+        return (isinstance(node, ast.Expr) and isinstance(node.value, ast.Call)
+                and isinstance(node.value.func, ast.Attribute) and node.value.func.attr == 'append'
+                and any(isinstance(arg, ast.Name) and arg.id == 'Reaction_dict' for arg in node.value.args))
+
+    def text_of(value):
+        if isinstance(value, ast.JoinedStr):
+            return ''.join(part.value for part in value.values if isinstance(part, ast.Constant))
+        if isinstance(value, ast.Constant) and isinstance(value.value, str):
+            return value.value
+        return None
+
+    def name_of(statement, current):
+        # The dict's own 'Reaction_name' entry, else the latest Reaction_name assignment
+        if isinstance(statement.value, ast.Dict):
+            for key, value in zip(statement.value.keys, statement.value.values):
+                if isinstance(key, ast.Constant) and key.value == 'Reaction_name' and text_of(value):
+                    return text_of(value)
+        return current
+
+    for node in ast.walk(tree):
+        for field in ('body', 'orelse'):
+            body = getattr(node, field, None)
+            if not isinstance(body, list):
+                continue
+            pending, current = None, '?'
+            for statement in body:
+                if (isinstance(statement, ast.Assign) and isinstance(statement.targets[0], ast.Name)
+                        and statement.targets[0].id == 'Reaction_name'):
+                    current = text_of(statement.value) or '?'
+                elif is_assignment(statement):
+                    if pending is not None:
+                        findings.append(pending)
+                    pending = finding('unappended', 'warning',
+                                      f"Reaction dict '{name_of(statement, current)}' is built but never "
+                                      f"appended", line=statement.lineno)
+                elif is_append(statement):
+                    pending = None
+            if pending is not None:
+                findings.append(pending)
+    return findings
+
+
+def reaction_format(reactions):
+    """
+    Missing keys, unknown rate types, malformed prototypes and inconsistent species lists
+    """
+    findings = []
+    spacing = Counter()
+    for i, reaction in enumerate(reactions):
+        missing = [key for key in REQUIRED_KEYS if key not in reaction]
+        if missing:
+            findings.append(finding('format', 'error', f"Missing keys {missing}", i))
+            continue
+        if reaction['Rate_type'] not in RATE_TYPES:
+            findings.append(finding('format', 'error', f"Unknown Rate_type {reaction['Rate_type']!r}", i))
+        if reaction['Rate_type'] == 'RMA' and reaction['Rate_eqtn_prototype'].strip().strip('[]').count(',') != 1:
+            findings.append(finding('format', 'error', "RMA prototype must be [forward, reverse]", i))
+        for key in ('Reactants', 'Products'):
+            text = reaction[key].strip()
+            names = [name.strip() for name in text.strip('[]').split(',')]
+            if '0' in names and len(names) > 1:
+                findings.append(finding('format', 'error', f"{key} mixes the [0] sink with species", i))
+            if len(names) > 1:
+                spacing[', ' in text] += 1
+            if not SPECIES_LIST.match(re.sub(r',\s*', ', ', text)):
+                findings.append(finding('format', 'error', f"Malformed {key} {text!r}", i))
+        if not parse_species(reaction['Reactants']) and not parse_species(reaction['Products']):
+            findings.append(finding('format', 'error', "Reaction has neither reactants nor products", i))
+        try:
+            for expression in split_rate_prototype(reaction):
+                if expression is not None:
+                    ast.parse(expression, mode='eval')
+        except (SyntaxError, ValueError) as error:
+            findings.append(finding('format', 'error', f"Unparsable prototype: {error}", i))
+    if len(spacing) > 1:
+        findings.append(finding('format', 'warning',
+                                f"Inconsistent species list spacing: {spacing[True]} lists use '[A, B]', "
+                                f"{spacing[False]} use '[A,B]'"))
+    return findings
+
+
+def duplicate_reactions(reactions):
+    """
+    Reactions that are identical up to whitespace and species order
+    """
+    seen = defaultdict(list)
+    for i, reaction in enumerate(reactions):
+        try:
+            seen[canonical_reaction(reaction)].append(i)
+        except (KeyError, ValueError):
+            continue
+    return [finding('duplicate', 'error', f"Reaction '{key[0]}' appears {len(indices)} times "
+                                          f"(indices {indices})", indices[1])
+            for key, indices in seen.items() if len(indices) > 1]
+
+
+def species_balance(reactions, inputs=None):
+    """
+    Species that no reaction produces, or that no reaction consumes
+
+    Species only read by rate prototypes (modifiers) and dose targets (inputs)
+    are not reported as unproduced.
+    """
+    produced, consumed, species = set(), set(), set()
+    for reaction in reactions:
+        reactants, products = parse_species(reaction['Reactants']), parse_species(reaction['Products'])
+        consumed.update(reactants)
+        produced.update(products)
+        if reaction['Rate_type'] == 'RMA':
+            consumed.update(products)
+            produced.update(reactants)
+        species.update(reactants + products)
+    if inputs is None:
+        antibodies = {name.split('__')[1].rsplit('_', 1)[0] for name in species if '__' in name} or {'Antibody'}
+        inputs = {f"{antibody}_{compartment}" for antibody in antibodies
+                  for compartment in DOSE_COMPARTMENTS.values()}
+    findings = []
+    unproduced = sorted(species - produced - set(inputs))
+    unconsumed = sorted(species - consumed)
+    if unproduced:
+        findings.append(finding('species', 'warning',
+                                f"{len(unproduced)} species are never produced: {', '.join(unproduced)}"))
+    if unconsumed:
+        findings.append(finding('species', 'warning',
+                                f"{len(unconsumed)} species are never consumed: {', '.join(unconsumed)}"))
+    return findings
+
+
+def read_parameter_units(files=PARAM_FILES):
+    """
+    Parameter name -> unit string from the params/ tables (Name and Name_Lin columns)
+    """
+    import csv
+    units = {}
+    for path in files:
+        with open(path, encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                for column in ('Name', 'Name_Lin'):
+                    name = (row.get(column) or '').strip()
+                    if name:
+                        units.setdefault(name, (row.get('Units') or '').strip())
+    return units
+
+
+def _prototype_identifiers(reactions):
+    species = {name for reaction in reactions
+               for name in parse_species(reaction['Reactants']) + parse_species(reaction['Products'])}
+    uses = defaultdict(list)
+    for i, reaction in enumerate(reactions):
+        for name in IDENTIFIER.findall(reaction['Rate_eqtn_prototype']):
+            if name not in species:
+                uses[name].append(i)
+    return species, uses
+
+
+def undefined_parameters(reactions, units):
+    """
+    Prototype parameters missing from the parameter tables, and table entries never used
+    """
+    _, uses = _prototype_identifiers(reactions)
+    missing = sorted(set(uses) - set(units))
+    findings = []
+    if missing:
+        shown = ', '.join(missing[:12]) + (', ...' if len(missing) > 12 else '')
+        findings.append(finding('parameters', 'warning',
+                                f"{len(missing)} of {len(uses)} prototype parameters are not defined in "
+                                f"params/*.csv: {shown}"))
+    return findings
+
+
+def parse_unit(text):
+    """
+    Dimension tuple of a unit string such as '1/(nM*s)', None when not understood
+    """
+    if not text:
+        return None
+    try:
+        return _dimension(ast.parse(text.replace('^', '**'), mode='eval').body,
+                          lambda name: BASE_UNITS.get(name))
+    except (SyntaxError, _UnitMismatch):
+        return None
+
+
+class _UnitMismatch(Exception):
+    pass
+
+
+def _scale(dim, power):
+    return tuple(Fraction(d) * power for d in dim)
+
+
+def _dimension(node, lookup):
+    """
+    Dimension of an expression tree; None when any operand is unknown
+    """
+    if isinstance(node, ast.Constant):
+        return DIMENSIONLESS
+    if isinstance(node, ast.Name):
+        return lookup(node.id)
+    if isinstance(node, ast.UnaryOp):
+        return _dimension(node.operand, lookup)
+    if isinstance(node, ast.Call):
+        for arg in node.args:
+            dim = _dimension(arg, lookup)
+            if dim is not None and any(dim):
+                raise _UnitMismatch(f"argument of {ast.unparse(node.func)}() has units")
+        return DIMENSIONLESS
+    if isinstance(node, ast.BinOp):
+        left = _dimension(node.left, lookup)
+        if isinstance(node.op, ast.Pow):
+            if isinstance(node.right, ast.Constant) and left is not None:
+                return _scale(left, Fraction(node.right.value).limit_denominator())
+            right = _dimension(node.right, lookup)
+            if right is not None and any(right):
+                raise _UnitMismatch(f"exponent with units in {ast.unparse(node)}")
+            # x^h with a parameter h (Hill terms) has no fixed dimension unless x has none
+            return DIMENSIONLESS if left is not None and not any(left) and right is not None else None
+        right = _dimension(node.right, lookup)
+        if left is None or right is None:
+            return None
+        if isinstance(node.op, (ast.Add, ast.Sub)):
+            if tuple(left) != tuple(right):
+                raise _UnitMismatch(f"adding {_format(left)} and {_format(right)} in {ast.unparse(node)}")
+            return left
+        if isinstance(node.op, ast.Mult):
+            return tuple(a + b for a, b in zip(left, right))
+        if isinstance(node.op, ast.Div):
+            return tuple(a - b for a, b in zip(left, right))
+    return None
+
+
+def _format(dim):
+    parts = [f"{name}^{power}" if power != 1 else name
+             for name, power in zip(('amount', 'volume', 'time', 'mass'), dim) if power]
+    return '*'.join(parts) or '1'
+
+
+def rate_units(reactions, units):
+    """
+    Dimensional consistency of the rate prototypes
+
+    Sums must add like dimensions. With every unit known, mass-action
+    constants of order n must be amount^(1-n) (or concentration^(1-n)) per
+    time; custom prototypes must be amount per time, and
+    custom_conc_per_time prototypes concentration per time.
+
+    Returns:
+    --------
+    tuple
+        (findings, number of prototypes whose units were fully known)
+    """
+    species, _ = _prototype_identifiers(reactions)
+    dimensions = {name: parse_unit(text) for name, text in units.items()}
+
+    def lookup(name):
+        return AMOUNT if name in species else dimensions.get(name)
+
+    findings, known = [], 0
+    for i, reaction in enumerate(reactions):
+        try:
+            expressions = split_rate_prototype(reaction)
+        except ValueError:
+            continue
+        orders = [len(parse_species(reaction['Reactants'])), len(parse_species(reaction['Products']))]
+        for expression, order in zip(expressions, orders):
+            if expression is None:
+                continue
+            try:
+                dim = _dimension(ast.parse(expression, mode='eval').body, lookup)
+            except SyntaxError:
+                continue
+            except _UnitMismatch as error:
+                findings.append(finding('units', 'error', str(error), i))
+                continue
+            if dim is None:
+                continue
+            known += 1
+            if reaction['Rate_type'] in CUSTOM_RATE_DIMENSIONS:
+                expected = [CUSTOM_RATE_DIMENSIONS[reaction['Rate_type']]]
+            else:
+                expected = [(1 - order, 0, -1, 0), (1 - order, order - 1, -1, 0)]
+            if tuple(dim) not in [tuple(Fraction(d) for d in e) for e in expected]:
+                findings.append(finding('units', 'error', f"Rate '{expression}' has units {_format(dim)}, "
+                                                          f"expected {_format(expected[0])}", i))
+    return findings, known
+
+
+def lint_reactions(reactions, source=None, units=None, printed_count=None):
+    """
+    Run every check over a reaction list
+
+    Parameters:
+    -----------
+    reactions : list of dict
+        Reaction dicts as produced by build_reactions()
+    source : str or Path or None
+        Builder module, scanned for unappended reaction dicts when given
+    units : dict or None
+        Parameter name -> unit string, read_parameter_units() when None
+    printed_count : int or None
+        Reaction count printed by the builder, compared with len(reactions)
+
+    Returns:
+    --------
+    list of dict
+        Findings, see finding()
+    """
+    units = read_parameter_units() if units is None else units
+    findings = []
+    if source is not None and Path(source).suffix == '.py':
+        findings += unappended_reactions(source)
+    if printed_count is not None and printed_count != len(reactions):
+        findings.append(finding('counter', 'warning', f"Builder reports {printed_count} reactions but "
+                                                      f"returns {len(reactions)}"))
+    findings += reaction_format(reactions)
+    findings += duplicate_reactions(reactions)
+    findings += species_balance(reactions)
+    findings += undefined_parameters(reactions, units)
+    unit_findings, known = rate_units(reactions, units)
+    findings += unit_findings
+    findings.append(finding('units', 'info', f"Units known for {known} rate prototypes"))
+    return findings
+
+
+def lint_source(path=DEFAULT_SOURCE, units=None):
+    """
+    Load a reaction list (capturing the builder's count print) and lint it
+    """
+    output = io.StringIO()
+    reactions = load_reactions(path, stream=output)
+    printed = [int(line) for line in output.getvalue().split() if line.strip().isdigit()]
+    return lint_reactions(reactions, path, units, printed[-1] if printed else None), len(reactions)
+
+
+def gate(findings, strict=False):
+    """
+    True when a build may proceed: no errors, and no warnings when strict
+    """
+    blocking = ('error', 'warning') if strict else ('error',)
+    return not any(item['severity'] in blocking for item in findings)
+
+
+def print_findings(findings, stream=None):
+    stream = sys.stdout if stream is None else stream
+    for item in findings:
+        where = []
+        if item['reaction'] is not None:
+            where.append(f"reaction {item['reaction']}")
+        if item['line'] is not None:
+            where.append(f"line {item['line']}")
+        location = f" ({', '.join(where)})" if where else ''
+        print(f"{item['severity']}: [{item['check']}]{location} {item['message']}", file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lint the Geerts reaction list")
+    parser.add_argument('source', nargs='?', default=str(DEFAULT_SOURCE),
+                        help="Builder module (.py) or reaction dump (.txt)")
+    parser.add_argument('--strict', action='store_true', help="Fail on warnings as well as errors")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    findings, n_reactions = lint_source(args.source)
+    elapsed = time.perf_counter() - start
+    print_findings(findings)
+    counts = Counter(item['severity'] for item in findings)
+    print(f"\nLinted {n_reactions} reactions in {1000 * elapsed:.0f} ms: "
+          f"{counts['error']} errors, {counts['warning']} warnings")
+    return 0 if gate(findings, args.strict) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""
+Model Parameter Tables
+Loads the Lin et al parameter tables in params/ and derives sampling bounds
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PARAM_DIR = Path(__file__).resolve().parent / "params"
+PARAM_FILES = ('Abeta_Params_Lin.csv', 'mAb_Params_Lin.csv')
+
+
+def load_parameter_table(param_dir=PARAM_DIR, files=PARAM_FILES):
+    """
+    Load the parameter tables into one DataFrame
+
+    Parameters:
+    -----------
+    param_dir : str or Path
+        Directory containing the parameter CSV files
+    files : tuple of str
+        CSV files to load
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Columns of the CSVs plus 'source' (file name), one row per Name
+    """
+    frames = []
+    for file_name in files:
+        df = pd.read_csv(Path(param_dir) / file_name)
+        df['source'] = file_name
+        frames.append(df)
+    table = pd.concat(frames, ignore_index=True)
+    table['Value'] = pd.to_numeric(table['Value'], errors='coerce')
+    return table.drop_duplicates(subset='Name', keep='first').reset_index(drop=True)
+
+
+def nominal_parameters(table=None, name_column='Name'):
+    """
+    Nominal parameter values as a dict
+
+    Parameters:
+    -----------
+    table : pandas.DataFrame or None
+        Output of load_parameter_table, loaded when None
+    name_column : str, default 'Name'
+        Use 'Name_Lin' for the names used in Lin et al (2022)
+
+    Returns:
+    --------
+    dict
+        Mapping parameter name -> value
+    """
+    table = load_parameter_table() if table is None else table
+    table = table.dropna(subset=['Value'])
+    return dict(zip(table[name_column], table['Value'].astype(float)))
+
+
+def log_uniform_bounds(nominal, names=None, decades=1.0):
+    """
+    Symmetric bounds around nominal values on a log10 scale
+
+    Parameters:
+    -----------
+    nominal : dict
+        Mapping parameter name -> nominal value
+    names : list of str or None
+        Parameters to bound, all keys of nominal when None
+    decades : float, default 1.0
+        Half-width of the bounds in orders of magnitude
+
+    Returns:
+    --------
+    dict
+        Mapping name -> (lower, upper)
+    """
+    names = list(nominal) if names is None else names
+    factor = 10.0 ** decades
+    return {name: (nominal[name] / factor, nominal[name] * factor) for name in names
+            if np.isfinite(nominal[name]) and nominal[name] > 0}
@@ -0,0 +1,375 @@
+"""
+Multi-Start Fitting
+Local fits from many starting points in parallel processes, sharing one archive of evaluated
+points so near-duplicate evaluations are reused and starts heading into known basins are pruned
+"""
+
+import os
+import sqlite3
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.stats import qmc
+
+from fitting import fit_parameters, from_search_space, to_search_space
+from parallel import parallel_map
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS evaluations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    start INTEGER NOT NULL,
+    point BLOB NOT NULL,
+    value REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS basins (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    start INTEGER NOT NULL,
+    point BLOB NOT NULL,
+    value REAL NOT NULL
+);
+"""
+
+# Points added since the last rebuild that are searched by brute force
+REBUILD_EVERY = 64
+
+
+class PointIndex:
+    """
+    Nearest-neighbour index of search-space points under the max-norm
+
+    New points go to a small buffer that is scanned directly; the k-d tree
+    is rebuilt once the buffer holds REBUILD_EVERY points.
+    """
+
+    def __init__(self, n_dims):
+        self.points = np.empty((0, n_dims))
+        self.values = np.empty(0)
+        self.tree = None
+        self.n_indexed = 0
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, points, values):
+        self.points = np.concatenate([self.points, np.reshape(points, (-1, self.points.shape[1]))])
+        self.values = np.concatenate([self.values, values])
+        if len(self) - self.n_indexed >= REBUILD_EVERY:
+            self.tree = cKDTree(self.points)
+            self.n_indexed = len(self)
+
+    def nearest(self, z):
+        """
+        (distance, index) of the closest point, (inf, -1) when empty
+        """
+        best = (np.inf, -1)
+        if self.tree is not None:
+            distance, index = self.tree.query(z, p=np.inf)
+            best = (float(distance), int(index))
+        if len(self) > self.n_indexed:
+            distances = np.max(np.abs(self.points[self.n_indexed:] - z), axis=1)
+            i = int(np.argmin(distances))
+            if distances[i] < best[0]:
+                best = (float(distances[i]), self.n_indexed + i)
+        return best
+
+
+class EvaluationStore:
+    """
+    Archive of objective evaluations and found basins shared by concurrent processes
+
+    Backed by one SQLite file in WAL mode; each process keeps a PointIndex
+    of the rows and brings it up to date before every lookup. Stores on disk
+    persist, so rerunning a multi-start against the same file reuses all
+    earlier evaluations.
+
+    Parameters:
+    -----------
+    path : str or Path
+        SQLite database, created when missing
+    n_dims : int
+        Search-space dimension
+    """
+
+    def __init__(self, path, n_dims):
+        self.path = Path(path)
+        self.n_dims = n_dims
+        self._conn = None
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+        self._reset()
+
+    def _reset(self):
+        self.index = PointIndex(self.n_dims)
+        self.last_id = 0
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(str(self.path), timeout=60.0, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        return self._conn
+
+    def __getstate__(self):
+        return {'path': self.path, 'n_dims': self.n_dims}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._conn = None
+        self._reset()
+
+    def sync(self):
+        """
+        Add rows written by any process since the last sync to the index
+        """
+        rows = self._connection().execute(
+            'SELECT id, point, value FROM evaluations WHERE id > ? ORDER BY id',
+            (self.last_id,)).fetchall()
+        if rows:
+            self.index.add(np.frombuffer(b''.join(row[1] for row in rows)),
+                           np.array([row[2] for row in rows]))
+            self.last_id = rows[-1][0]
+
+    def lookup(self, z, tolerance):
+        """
+        Archived value of a point within tolerance (max-norm) of z, or None
+        """
+        self.sync()
+        distance, index = self.index.nearest(z)
+        return float(self.index.values[index]) if distance <= tolerance else None
+
+    def add(self, z, value, start):
+        self._connection().execute('INSERT INTO evaluations (start, point, value) VALUES (?, ?, ?)',
+                                   (start, np.asarray(z, dtype=float).tobytes(), float(value)))
+
+    def basins(self):
+        """
+        Found optima (points array, values array, starts list), best first
+        """
+        rows = self._connection().execute(
+            'SELECT point, value, start FROM basins ORDER BY value').fetchall()
+        points = np.array([np.frombuffer(row[0]) for row in rows]).reshape(-1, self.n_dims)
+        return points, np.array([row[1] for row in rows]), [row[2] for row in rows]
+
+    def add_basin(self, z, value, start, radius):
+        """
+        Record an optimum unless a known basin lies within radius; returns its basin id
+        """
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for basin_id, point in conn.execute('SELECT id, point FROM basins').fetchall():
+                if np.max(np.abs(np.frombuffer(point) - z)) <= radius:
+                    return basin_id
+            return conn.execute('INSERT INTO basins (start, point, value) VALUES (?, ?, ?)',
+                                (start, np.asarray(z, dtype=float).tobytes(), float(value))).lastrowid
+        finally:
+            conn.execute('COMMIT')
+
+
+class SharedObjective:
+    """
+    Search-space objective that reuses archived values within tolerance and archives new ones
+
+    Parameters:
+    -----------
+    objective : callable
+        Takes a dict of parameter values, e.g. trial_data.TrialLikelihood.negative
+    names : list of str
+        Free parameters (search-space coordinates)
+    store : EvaluationStore
+        Shared archive
+    start : int
+        Start the evaluations are attributed to
+    tolerance : float
+        Max-norm distance (log10 units when log_scale) within which a stored
+        value is reused
+    fixed : dict or None
+        Parameters held constant
+    log_scale : bool
+        Whether the search space is log10
+    """
+
+    def __init__(self, objective, names, store, start, tolerance, fixed=None, log_scale=True):
+        self.objective = objective
+        self.names = list(names)
+        self.store = store
+        self.start = start
+        self.tolerance = tolerance
+        self.fixed = dict(fixed or {})
+        self.log_scale = log_scale
+        self.n_evaluated = 0
+        self.n_reused = 0
+
+    def __call__(self, params):
+        z = to_search_space([params[name] for name in self.names], self.log_scale)
+        value = self.store.lookup(z, self.tolerance)
+        if value is not None:
+            self.n_reused += 1
+            return value
+        value = float(self.objective({**self.fixed, **params}))
+        self.n_evaluated += 1
+        self.store.add(z, value if np.isfinite(value) else np.inf, self.start)
+        return value
+
+
+def start_points(x0, names, n_starts, bounds=None, spread=1.0, log_scale=True, seed=None):
+    """
+    Starting points: x0 followed by a scrambled Halton design
+
+    Each free parameter ranges over its bounds, or `spread` decades (units
+    when not log-scaled) either side of its x0 value where unbounded.
+
+    Returns:
+    --------
+    numpy.ndarray
+        Search-space starts (n_starts x len(names))
+    """
+    bounds = bounds or {}
+    center = to_search_space([x0[name] for name in names], log_scale)
+    lower, upper = center - spread, center + spread
+    for i, name in enumerate(names):
+        low, high = bounds.get(name, (None, None))
+        if low is not None and (low > 0 or not log_scale):
+            lower[i] = to_search_space([low], log_scale)[0]
+        if high is not None:
+            upper[i] = to_search_space([high], log_scale)[0]
+    if n_starts <= 1:
+        return center[None, :]
+    design = qmc.Halton(len(names), scramble=True, seed=seed).random(n_starts - 1)
+    return np.vstack([center, qmc.scale(design, lower, upper)])
+
+
+class _Pruned(Exception):
+    pass
+
+
+_OBJECTIVE = None
+_STORE = None
+
+
+def _init_worker(objective, store):
+    global _OBJECTIVE, _STORE
+    _OBJECTIVE = objective
+    _STORE = store
+
+
+def _start_task(task):
+    """
+    One local fit with archive reuse and basin pruning
+    """
+    start, z0, names, fixed, bounds, log_scale, method, options, tolerance, basin_radius = task
+    shared = SharedObjective(_OBJECTIVE, names, _STORE, start, tolerance, fixed, log_scale)
+    x0 = dict(zip(names, from_search_space(z0, log_scale)))
+    iterations = [0]
+
+    def prune(params):
+        iterations[0] += 1
+        points, values, _ = _STORE.basins()
+        if not len(values):
+            return
+        z = to_search_space([params[name] for name in names], log_scale)
+        near = np.max(np.abs(points - z), axis=1) <= basin_radius
+        value = _STORE.lookup(z, tolerance)
+        if np.any(near) and (value is None or value >= values[near].min()):
+            raise _Pruned
+
+    try:
+        fit = fit_parameters(shared, x0, names=names, bounds=bounds, log_scale=log_scale, method=method,
+                             options=options, callback=prune)
+    except _Pruned:
+        return {'start': start, 'z0': z0, 'pruned': True, 'iterations': iterations[0],
+                'n_evaluated': shared.n_evaluated, 'n_reused': shared.n_reused}
+    z = to_search_space([fit['params'][name] for name in names], log_scale)
+    basin = _STORE.add_basin(z, fit['fun'], start, basin_radius) if np.isfinite(fit['fun']) else None
+    return {'start': start, 'z0': z0, 'pruned': False, 'iterations': iterations[0],
+            'params': fit['params'], 'fun': fit['fun'], 'success': fit['success'], 'basin': basin,
+            'n_evaluated': shared.n_evaluated, 'n_reused': shared.n_reused}
+
+
+def multistart_fit(objective, x0, names=None, fixed=None, bounds=None, n_starts=8, spread=1.0,
+                   log_scale=True, method='Nelder-Mead', options=None, tolerance=1e-4, basin_radius=0.05,
+                   store=None, processes=None, seed=None):
+    """
+    Fit from many starts in parallel, sharing evaluations and pruning starts in known basins
+
+    Every objective evaluation of every start is written to a shared
+    archive. Before evaluating, a start looks up the nearest archived point
+    and reuses its value when it lies within `tolerance`. After each
+    iteration a start whose iterate lies within `basin_radius` of an
+    optimum already found, without improving on it, is stopped. Finished
+    starts register their optimum as a basin unless one is already known
+    within `basin_radius`.
+
+    Parameters:
+    -----------
+    objective : callable
+        Picklable objective of a parameter dict, e.g. TrialLikelihood.negative
+    x0 : dict
+        Typical values of the free parameters (the first start)
+    names : list of str or None
+        Free parameter names, defaults to the keys of x0
+    fixed : dict or None
+        Parameters held constant
+    bounds : dict or None
+        Mapping name -> (lower, upper) in natural units, also the range the
+        starts are drawn from
+    n_starts : int, default 8
+        Number of local fits
+    spread : float, default 1
+        Half-width of the start range of unbounded parameters (decades when log-scaled)
+    log_scale : bool, default True
+        Optimise log10 of the parameters
+    method : str, default 'Nelder-Mead'
+        scipy.optimize.minimize method
+    options : dict or None
+        Options of the local method
+    tolerance : float, default 1e-4
+        Max-norm search-space distance within which archived values are
+        reused. Keep it below the finite-difference step of gradient-based
+        methods (0 reuses exact repeats only).
+    basin_radius : float, default 0.05
+        Max-norm search-space distance identifying a basin
+    store : str or Path or None
+        SQLite archive; a temporary file when None. Reusing a file resumes
+        an interrupted run: earlier evaluations are replayed from it
+    processes : int or None
+        Worker processes (starts run concurrently)
+    seed : int or None
+        Seed of the Halton starts
+
+    Returns:
+    --------
+    dict
+        'best' (the best finished start), 'starts' (per-start results with
+        'pruned', 'n_evaluated' and 'n_reused'), 'basins' (list of (params,
+        fun) best first), 'n_evaluated' and 'n_reused'
+    """
+    names = list(x0) if names is None else list(names)
+    z_starts = start_points(x0, names, n_starts, bounds, spread, log_scale, seed)
+    temporary = store is None
+    if temporary:
+        fd, store = tempfile.mkstemp(suffix='.sqlite', prefix='multistart_')
+        os.close(fd)
+    try:
+        shared = EvaluationStore(store, len(names))
+        tasks = [(i, z, names, fixed, bounds, log_scale, method, options, tolerance, basin_radius)
+                 for i, z in enumerate(z_starts)]
+        starts = parallel_map(_start_task, tasks, processes=processes, initializer=_init_worker,
+                              initargs=(objective, shared))
+        points, values, _ = shared.basins()
+    finally:
+        if temporary:
+            for suffix in ('', '-wal', '-shm'):
+                Path(f"{store}{suffix}").unlink(missing_ok=True)
+
+    finished = [start for start in starts if not start['pruned'] and np.isfinite(start['fun'])]
+    basins = [(dict(zip(names, from_search_space(z, log_scale))), float(value))
+              for z, value in zip(points, values)]
+    return {
+        'best': min(finished, key=lambda start: start['fun']) if finished else None,
+        'starts': starts,
+        'basins': basins,
+        'n_evaluated': sum(start['n_evaluated'] for start in starts),
+        'n_reused': sum(start['n_reused'] for start in starts),
+    }
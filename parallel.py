@@ -0,0 +1,96 @@
+"""
+Parallel Helpers
+Small process-pool wrapper shared by the fitting, sampling and sweep tools
+"""
+
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Tasks submitted ahead per worker by parallel_imap
+TASKS_IN_FLIGHT_PER_WORKER = 2
+
+
+def resolve_processes(processes=None):
+    """
+    Resolve the number of worker processes to use
+
+    Parameters:
+    -----------
+    processes : int or None
+        Requested number of processes, None for one per CPU
+
+    Returns:
+    --------
+    int
+        Number of processes, at least 1
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    return max(1, int(processes))
+
+
+def parallel_map(func, items, processes=None, initializer=None, initargs=()):
+    """
+    Map a function over items in worker processes, preserving order
+
+    Runs in the calling process when only one process is requested or there is
+    at most one item, so small jobs do not pay process start-up costs.
+
+    Parameters:
+    -----------
+    func : callable
+        Picklable function applied to each item
+    items : iterable
+        Items to process
+    processes : int or None
+        Number of worker processes, None for one per CPU
+    initializer : callable or None
+        Called once in every worker before any item is processed
+    initargs : tuple
+        Arguments passed to the initializer
+
+    Returns:
+    --------
+    list
+        Results in the same order as items
+    """
+    return list(parallel_imap(func, items, processes, initializer, initargs))
+
+
+def parallel_imap(func, items, processes=None, initializer=None, initargs=()):
+    """
+    Like parallel_map, but yield results in order as they become available
+
+    Lets callers store each result (e.g. into a preallocated array) and drop
+    it, instead of holding every result at once. Items are read lazily and
+    at most TASKS_IN_FLIGHT_PER_WORKER tasks per worker are submitted ahead
+    of the result being yielded, so neither pickled tasks nor finished
+    results pile up.
+    """
+    items = iter(items)
+    processes = resolve_processes(processes)
+    head = list(itertools.islice(items, processes))
+    processes = min(processes, max(len(head), 1))
+    items = itertools.chain(head, items)
+    if processes == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=initializer,
+                             initargs=initargs) as pool:
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(pool.submit(func, item))
+                if len(pending) >= TASKS_IN_FLIGHT_PER_WORKER * processes:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,307 @@
+"""
+Population (Mixed-Effects) Estimation
+Log-normal random effects on selected parameters, simulated as Monte Carlo virtual
+populations and matched to trial arm means and between-subject variances
+"""
+
+import numpy as np
+from scipy.special import gammaln
+
+from geerts_model import BaselineCache, simulate, simulate_baseline
+from parallel import parallel_map
+from trial_data import gaussian_log_likelihood, standard_errors
+
+# Random effect on the untreated history length, i.e. on baseline plaque
+BASELINE_EFFECT = 'baseline_years'
+
+# Trial measure -> model read-out (the tables report changes from baseline)
+DEFAULT_MEASURES = {'SUVR': 'SUVR_change', 'Centiloid': 'Centiloid_change'}
+
+
+def omega_name(effect):
+    """
+    Name of the parameter holding the log-scale SD of a random effect
+    """
+    return f"omega_{effect}"
+
+
+def standard_normal_draws(n_subjects, effects, seed=None):
+    """
+    Standard-normal subject draws, one column per random effect
+
+    Drawn once and reused for every objective evaluation (common random
+    numbers), so the Monte Carlo objective is a smooth deterministic function
+    of the population parameters.
+    """
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((n_subjects, len(effects)))
+
+
+def individual_parameters(params, effects, draws, baseline_years=20.0):
+    """
+    Subject parameter sets theta_i = theta * exp(omega * z_i)
+
+    Parameters:
+    -----------
+    params : dict
+        Typical values, plus omega_<effect> for every random effect
+    effects : list of str
+        Parameters with random effects; BASELINE_EFFECT varies the untreated
+        history length instead of a model parameter
+    draws : numpy.ndarray
+        Standard-normal draws (n_subjects x n_effects)
+    baseline_years : float, default 20
+        Typical untreated history length
+
+    Returns:
+    --------
+    list of tuple
+        (params_i, baseline_years_i) per subject
+    """
+    omegas = np.array([params.get(omega_name(effect), 0.0) for effect in effects])
+    scales = np.exp(draws * omegas)
+    subjects = []
+    for row in scales:
+        subject = dict(params)
+        years = baseline_years
+        for effect, scale in zip(effects, row):
+            if effect == BASELINE_EFFECT:
+                years = baseline_years * scale
+            else:
+                subject[effect] = params[effect] * scale
+        subjects.append((subject, years))
+    return subjects
+
+
+# Untreated states shared by every simulate_population call in this process, so
+# objective evaluations that only move treatment parameters skip the baselines
+_BASELINE_CACHE = BaselineCache(max_entries=4096)
+
+_MODEL = None
+
+
+def _init_worker(model):
+    global _MODEL
+    _MODEL = model
+
+
+def _baseline_task(task):
+    """
+    Pre-treatment state of one virtual subject, None when the integration fails
+    """
+    params, years, options = task
+    try:
+        return simulate_baseline(_MODEL, params, years, **options).final_state
+    except (ArithmeticError, ValueError, RuntimeError):
+        return None
+
+
+def _subject_task(task):
+    """
+    All arms of one virtual subject from the subject's baseline
+    """
+    params, y0, arms, t_weeks, outputs, options = task
+    try:
+        if y0 is None:
+            raise RuntimeError("Baseline integration failed")
+        results = [simulate(_MODEL, params, t_weeks, y0=y0, regimen=arm, **options) for arm in arms]
+    except (ArithmeticError, ValueError, RuntimeError):
+        return np.full((len(arms), len(outputs), len(t_weeks)), np.nan)
+    return np.array([[result.observable(name) for name in outputs] for result in results])
+
+
+def simulate_population(model, params, arms, t_eval_weeks, effects, draws, outputs=('SUVR_change',),
+                        baseline_years=20.0, processes=None, baseline_cache=None, **options):
+    """
+    Simulate every arm for every virtual subject
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    params : dict
+        Typical values and omega_<effect> SDs
+    arms : list
+        Regimen dict (or None for placebo) per arm
+    t_eval_weeks : array-like
+        Output times from treatment start, starting at 0
+    effects : list of str
+        Parameters with random effects, see individual_parameters
+    draws : numpy.ndarray
+        Standard-normal draws from standard_normal_draws
+    outputs : sequence of str
+        Read-outs, see SimulationResult.observable
+    baseline_years : float, default 20
+        Typical untreated history length
+    processes : int or None
+        Worker processes; subjects are distributed across them
+    baseline_cache : BaselineCache or None
+        Cache of the subjects' untreated states, a module-level cache that
+        persists across calls when None
+    **options
+        Passed to simulate (method, rtol, atol, backend)
+
+    Returns:
+    --------
+    numpy.ndarray
+        Read-outs (n_subjects x n_arms x n_outputs x n_times), NaN for
+        subjects whose integration failed
+    """
+    t_weeks = np.asarray(t_eval_weeks, dtype=float)
+    baseline_cache = _BASELINE_CACHE if baseline_cache is None else baseline_cache
+    baseline_options = {key: options[key] for key in ('rtol', 'atol') if key in options}
+    subjects = individual_parameters(params, effects, draws, baseline_years)
+
+    keys = [baseline_cache.key(model, subject, years) for subject, years in subjects]
+    states, missing = {}, {}
+    for key, (subject, years) in zip(keys, subjects):
+        if key in states or key in missing:
+            continue
+        state = baseline_cache.lookup(key)
+        if state is None:
+            missing[key] = (subject, years, baseline_options)
+        else:
+            states[key] = state
+    integrated = parallel_map(_baseline_task, list(missing.values()), processes=processes,
+                              initializer=_init_worker, initargs=(model,))
+    for key, state in zip(missing, integrated):
+        if state is not None:
+            baseline_cache.put(key, state)
+        states[key] = state
+
+    tasks = [(subject, states[key], list(arms), t_weeks, list(outputs), options)
+             for key, (subject, years) in zip(keys, subjects)]
+    return np.array(parallel_map(_subject_task, tasks, processes=processes,
+                                 initializer=_init_worker, initargs=(model,)))
+
+
+def variance_log_likelihood(sample_variance, variance, n):
+    """
+    Log-likelihood of sample variances given model variances
+
+    (n - 1) s^2 / sigma^2 follows a chi-squared distribution with n - 1
+    degrees of freedom for normally distributed subjects.
+    """
+    dof = np.asarray(n, dtype=float) - 1.0
+    sample_variance = np.asarray(sample_variance, dtype=float)
+    ratio = sample_variance / np.asarray(variance, dtype=float)
+    return float(np.sum(0.5 * dof * (np.log(0.5 * dof * ratio) - ratio)
+                        - np.log(sample_variance) - gammaln(0.5 * dof)))
+
+
+class PopulationLikelihood:
+    """
+    Picklable log-likelihood of population parameters against trial arms
+
+    Arm means are scored as in TrialLikelihood. Where a row has both CI and n,
+    its between-subject SD (CI / 1.96 * sqrt(n)) is also scored against the
+    simulated variance plus residual variance with variance_log_likelihood.
+
+    Parameters:
+    -----------
+    data : pandas.DataFrame
+        Output of trial_data.load_trial_data
+    model : GeertsModel
+        Compiled model
+    arms : dict
+        (study, series) -> regimen dict or None (placebo); rows of other
+        arms are dropped
+    effects : list of str
+        Parameters with random effects (and/or BASELINE_EFFECT); their SDs
+        are the omega_<effect> entries of the scored parameter sets
+    n_subjects : int, default 64
+        Virtual subjects per evaluation
+    seed : int or None
+        Seed of the common random numbers
+    measures : dict or None
+        Trial measure -> read-out, DEFAULT_MEASURES when None
+    residual_sd : dict or None
+        Trial measure -> residual (measurement) SD added to the simulated
+        between-subject variance
+    baseline_years : float, default 20
+        Typical untreated history length
+    processes : int or None
+        Worker processes per evaluation
+    **options
+        Passed to simulate_population (method, rtol, atol, backend)
+
+    Examples:
+    ---------
+    >>> arms = {('EMERGE', 'Placebo'): None, ('EMERGE', 'High-dose'): high_dose}
+    >>> likelihood = PopulationLikelihood(data, model, arms, ['Microglia_high_rate_AB42',
+    ...                                                       BASELINE_EFFECT])
+    >>> fit = fit_parameters(likelihood.negative, {'Microglia_high_rate_AB42': 1e-3,
+    ...                      'omega_Microglia_high_rate_AB42': 0.3, 'omega_baseline_years': 0.2},
+    ...                      fixed=params)
+    """
+
+    def __init__(self, data, model, arms, effects, n_subjects=64, seed=None, measures=None,
+                 residual_sd=None, baseline_years=20.0, processes=None, **options):
+        self.measures = dict(DEFAULT_MEASURES if measures is None else measures)
+        keys = list(zip(data['study'], data['series']))
+        keep = [key in arms and measure in self.measures for key, measure in zip(keys, data['measure'])]
+        self.data = data[keep].reset_index(drop=True)
+        if self.data.empty:
+            raise ValueError("No trial rows match the given arms and measures")
+        self.model = model
+        self.arm_keys = list(dict.fromkeys(zip(self.data['study'], self.data['series'])))
+        self.arms = [arms[key] for key in self.arm_keys]
+        self.effects = list(effects)
+        self.draws = standard_normal_draws(n_subjects, self.effects, seed)
+        self.outputs = list(dict.fromkeys(self.measures[m] for m in self.data['measure']))
+        self.t_weeks = np.union1d([0.0], self.data['time_weeks'].to_numpy(dtype=float))
+        self.baseline_years = baseline_years
+        self.processes = processes
+        self.options = options
+
+        self.se = standard_errors(self.data)
+        self.index = (
+            np.array([self.arm_keys.index(key) for key in zip(self.data['study'], self.data['series'])]),
+            np.array([self.outputs.index(self.measures[m]) for m in self.data['measure']]),
+            np.searchsorted(self.t_weeks, self.data['time_weeks'].to_numpy(dtype=float)),
+        )
+        n = self.data['n'].to_numpy(dtype=float)
+        sample_sd = self.data['CI'].to_numpy(dtype=float) / 1.96 * np.sqrt(n)
+        self.has_spread = np.isfinite(sample_sd) & (sample_sd > 0) & (n >= 2)
+        self.sample_variance = sample_sd[self.has_spread] ** 2
+        self.n = n[self.has_spread]
+        residual_sd = residual_sd or {}
+        self.residual_variance = np.array([residual_sd.get(m, 0.0) ** 2
+                                           for m in self.data['measure']])[self.has_spread]
+
+    def arm_moments(self, params):
+        """
+        Simulated mean and variance of every trial row
+
+        Returns:
+        --------
+        tuple
+            (mean, variance) arrays aligned with self.data
+        """
+        values = simulate_population(self.model, params, self.arms, self.t_weeks, self.effects,
+                                     self.draws, self.outputs, self.baseline_years,
+                                     self.processes, **self.options)
+        if not np.all(np.isfinite(values)):
+            raise RuntimeError("Integration failed for some virtual subjects")
+        arm, output, time = self.index
+        rows = values[:, arm, output, time]
+        return rows.mean(axis=0), rows.var(axis=0, ddof=1)
+
+    def __call__(self, params):
+        try:
+            mean, variance = self.arm_moments(params)
+        except (ArithmeticError, ValueError, RuntimeError):
+            return -np.inf
+        log_likelihood = gaussian_log_likelihood(self.data, mean, self.se)
+        if np.any(self.has_spread):
+            total = variance[self.has_spread] + self.residual_variance
+            if np.any(total <= 0):
+                return -np.inf
+            log_likelihood += variance_log_likelihood(self.sample_variance, total, self.n)
+        return log_likelihood
+
+    def negative(self, params):
+        """
+        Negative log-likelihood, the objective used by fitting and profiling
+        """
+        return -self(params)
@@ -0,0 +1,228 @@
+"""
+Profile Likelihood Engine
+Profiles fitted parameters (e.g. kcatADCP, konPP) with warm-started constrained re-fits
+and classifies their identifiability
+"""
+
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2
+
+from fitting import fit_parameters, from_search_space, to_search_space
+from parallel import parallel_map
+
+# Likelihood-ratio threshold for a pointwise 95% interval on the negative log-likelihood
+DELTA_NLL_95 = 0.5 * chi2.ppf(0.95, df=1)
+
+
+def _walk(objective, best_params, best_nll, name, free_names, fixed, bounds, log_scale, step,
+          max_steps, threshold, direction, fit_options):
+    """
+    Step one parameter away from the optimum in one direction, re-fitting the rest
+
+    Every re-fit starts from the neighbouring point's solution, which keeps the
+    number of objective evaluations per step small.
+    """
+    rows = []
+    center = to_search_space([best_params[name]], log_scale)[0]
+    lower, upper = (bounds or {}).get(name, (None, None))
+    warm_start = {other: best_params[other] for other in free_names}
+
+    for k in range(1, max_steps + 1):
+        value = from_search_space([center + direction * k * step], log_scale)[0]
+        if (lower is not None and value < lower) or (upper is not None and value > upper):
+            break
+        held = {**fixed, name: value}
+        if free_names:
+            fit = fit_parameters(objective, warm_start, names=free_names, fixed=held,
+                                 bounds=bounds, log_scale=log_scale, options=fit_options)
+            warm_start = fit['params']
+            nll, success, nfev = fit['fun'], fit['success'], fit['nfev']
+        else:
+            nll, success, nfev = objective(held), True, 1
+        rows.append({'value': value, 'nll': nll, 'delta_nll': nll - best_nll,
+                     'success': success, 'nfev': nfev, **warm_start})
+        if nll - best_nll > threshold:
+            break
+    return rows
+
+
+def profile_parameter(objective, best_params, name, free_names=None, fixed=None, bounds=None,
+                      log_scale=True, step=0.1, max_steps=20, threshold=DELTA_NLL_95,
+                      fit_options=None):
+    """
+    Compute the profile likelihood of a single parameter
+
+    Parameters:
+    -----------
+    objective : callable
+        Negative log-likelihood taking a dict of parameter values
+    best_params : dict
+        Maximum-likelihood values of all free parameters
+    name : str
+        Parameter to profile
+    free_names : list of str or None
+        Parameters re-optimised at every profile point, defaults to all other
+        keys of best_params
+    fixed : dict or None
+        Parameters held constant throughout
+    bounds : dict or None
+        Mapping name -> (lower, upper) in natural units
+    log_scale : bool, default True
+        Step and re-fit in log10 space
+    step : float, default 0.1
+        Grid spacing (in log10 units when log_scale is True)
+    max_steps : int, default 20
+        Maximum number of grid points on each side of the optimum
+    threshold : float
+        Increase in negative log-likelihood at which a side is considered bounded
+    fit_options : dict or None
+        Options for the inner re-fits
+
+    Returns:
+    --------
+    dict
+        'estimate', 'profile' (DataFrame sorted by value), 'ci' (lower, upper),
+        'flag' and 'log_scale'
+    """
+    fixed = dict(fixed or {})
+    if free_names is None:
+        free_names = [other for other in best_params if other != name]
+    free_names = [other for other in free_names if other != name]
+    best_nll = objective({**fixed, **best_params})
+
+    sides = {}
+    for direction in (-1, 1):
+        sides[direction] = _walk(objective, best_params, best_nll, name, free_names, fixed, bounds,
+                                 log_scale, step, max_steps, threshold, direction, fit_options)
+
+    center = {'value': best_params[name], 'nll': best_nll, 'delta_nll': 0.0, 'success': True,
+              'nfev': 0, **{other: best_params[other] for other in free_names}}
+    profile = pd.DataFrame(sides[-1][::-1] + [center] + sides[1])
+    ci, flag = _confidence_interval(profile, len(sides[-1]), threshold, log_scale)
+    return {'name': name, 'estimate': best_params[name], 'profile': profile, 'ci': ci,
+            'flag': flag, 'log_scale': log_scale}
+
+
+def _confidence_interval(profile, i0, threshold, log_scale):
+    """
+    Interpolate the threshold crossings of a profile and classify identifiability
+    """
+    values = profile['value'].to_numpy()
+    delta = profile['delta_nll'].to_numpy()
+    x = to_search_space(values, log_scale)
+
+    bounds = []
+    for indices in (range(i0, 0, -1), range(i0, len(x) - 1)):
+        crossing = None
+        for i in indices:
+            j = i - 1 if indices.step < 0 else i + 1
+            if delta[j] > threshold >= delta[i]:
+                frac = (threshold - delta[i]) / (delta[j] - delta[i])
+                crossing = from_search_space([x[i] + frac * (x[j] - x[i])], log_scale)[0]
+                break
+        bounds.append(crossing)
+
+    lower, upper = bounds
+    if lower is not None and upper is not None:
+        flag = 'identifiable'
+    elif np.nanmax(delta) < 0.1 * threshold:
+        flag = 'structurally non-identifiable'
+    else:
+        flag = 'practically non-identifiable'
+    return (lower, upper), flag
+
+
+def _profile_job(name, objective, best_params, options):
+    return profile_parameter(objective, best_params, name, **options)
+
+
+def profile_likelihood(objective, best_params, names=None, processes=None, **options):
+    """
+    Profile several parameters, one worker process per parameter
+
+    Parameters:
+    -----------
+    objective : callable
+        Picklable negative log-likelihood taking a dict of parameter values
+    best_params : dict
+        Maximum-likelihood values of all free parameters
+    names : list of str or None
+        Parameters to profile, defaults to all keys of best_params
+    processes : int or None
+        Number of worker processes, None for one per CPU
+    **options
+        Passed to profile_parameter (free_names, fixed, bounds, step, ...)
+
+    Returns:
+    --------
+    dict
+        Mapping parameter name -> profile_parameter result
+    """
+    names = list(best_params) if names is None else list(names)
+    job = partial(_profile_job, objective=objective, best_params=best_params, options=options)
+    results = parallel_map(job, names, processes=processes)
+    return dict(zip(names, results))
+
+
+def identifiability_table(results):
+    """
+    Summarise profile results as one row per parameter
+
+    Parameters:
+    -----------
+    results : dict
+        Output of profile_likelihood
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Columns: parameter, estimate, ci_lower, ci_upper, flag
+    """
+    rows = []
+    for name, result in results.items():
+        rows.append({'parameter': name, 'estimate': result['estimate'], 'ci_lower': result['ci'][0],
+                     'ci_upper': result['ci'][1], 'flag': result['flag']})
+    return pd.DataFrame(rows)
+
+
+def plot_profiles(results, threshold=DELTA_NLL_95, save_path=None):
+    """
+    Plot the profile of every parameter with the 95% threshold
+
+    Parameters:
+    -----------
+    results : dict
+        Output of profile_likelihood
+    threshold : float
+        Threshold line drawn on each panel
+    save_path : str or Path or None
+        Where to save the figure, not saved when None
+    """
+    import matplotlib.pyplot as plt
+
+    n = len(results)
+    ncols = min(n, 3)
+    nrows = int(np.ceil(n / ncols))
+    fig, axes = plt.subplots(nrows, ncols, figsize=(5 * ncols, 4 * nrows), squeeze=False)
+
+    for ax, (name, result) in zip(axes.flat, results.items()):
+        profile = result['profile']
+        ax.plot(profile['value'], profile['delta_nll'], marker='o', linewidth=2)
+        ax.axhline(threshold, color='red', linestyle='--', alpha=0.7)
+        if result.get('log_scale', True):
+            ax.set_xscale('log')
+        ax.set_xlabel(name, fontsize=12, fontweight='bold')
+        ax.set_ylabel('Δ negative log-likelihood', fontsize=12)
+        ax.set_title(result['flag'], fontsize=11)
+        ax.grid(True, alpha=0.4, linestyle='--')
+    for ax in list(axes.flat)[n:]:
+        ax.set_visible(False)
+
+    plt.tight_layout()
+    if save_path is not None:
+        plt.savefig(save_path, dpi=300, bbox_inches='tight')
+        print(f"Plot saved as '{save_path}'")
+    plt.show()
@@ -0,0 +1,416 @@
+"""
+Rapid-Equilibrium Reduction
+Finds fast reversible reactions by their relaxation time, replaces them by equilibrium
+relations and integrates the smaller, less stiff ODE in the slow species and pool totals
+"""
+
+import time
+
+import numpy as np
+from scipy import sparse
+from scipy.linalg import null_space, qr
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import splu
+
+from geerts_model import (SECONDS_PER_WEEK, SimulationResult, _integrate, _jacobian_options,
+                          dose_schedule, observable, simulate)
+
+# Reactions relaxing faster than this are treated as always at equilibrium
+DEFAULT_MAX_TIMESCALE_S = 3600.0
+NEWTON_TOLERANCE = 1e-12
+NEWTON_MAX_ITERATIONS = 50
+
+
+def reversible_pairs(model):
+    """
+    Forward/reverse flux pairs eligible for rapid equilibrium
+
+    A pair is an RMA reaction, or two mass-action reactions that are each
+    other's reverse. Both sides must be non-empty (synthesis/clearance pairs
+    are not equilibria) and both rate constants state-independent.
+
+    Returns:
+    --------
+    list of tuple
+        (forward flux, reverse flux) indices into model.fluxes
+    """
+    static = set(model.static_flux.tolist())
+    by_sides = {}
+    for j, flux in enumerate(model.fluxes):
+        if len(flux['mass_action']) != len(flux['consumed']) or j not in static:
+            continue
+        by_sides.setdefault((tuple(sorted(flux['consumed'])), tuple(sorted(flux['produced']))), []).append(j)
+    pairs = []
+    for (consumed, produced), forward in by_sides.items():
+        if not consumed or not produced or consumed == produced or (consumed, produced) > (produced, consumed):
+            continue
+        reverse = by_sides.get((produced, consumed))
+        if reverse and len(forward) == 1 and len(reverse) == 1:
+            pairs.append((forward[0], reverse[0]))
+    return pairs
+
+
+def _monomial_derivatives(model, flux, sign):
+    """
+    (species, other factors) per occurrence of a mass-action reactant
+    """
+    names = model.fluxes[flux]['mass_action']
+    return [(model.species_index[name],
+             [model.species_index[other] for q, other in enumerate(names) if q != position], sign, flux)
+            for position, name in enumerate(names)]
+
+
+def relaxation_rates(model, params, pairs, y_ref=None):
+    """
+    Relaxation rate (1/s) of each reversible pair at a reference state
+
+    For net rate g = v_forward - v_reverse and net stoichiometry s the rate
+    is -dg/dy . s, e.g. kon (A + B) + koff for A + B <-> C. At the default
+    zero state this is the reverse rate constant (plus the forward one for
+    unimolecular steps), a lower bound for any non-negative state.
+    """
+    p = model.parameter_vector(params)
+    k = model.rate_constants(p)
+    y = np.zeros(model.n_species) if y_ref is None else np.asarray(y_ref, dtype=float)
+    S = model.stoichiometry.tocsc()
+    rates = []
+    for forward, reverse in pairs:
+        s = S[:, forward].toarray().ravel()
+        rate = 0.0
+        for species, others, sign, flux in (_monomial_derivatives(model, forward, 1.0)
+                                             + _monomial_derivatives(model, reverse, -1.0)):
+            rate -= sign * k[flux] * np.prod(y[others]) * s[species]
+        rates.append(rate)
+    return np.array(rates)
+
+
+def fast_reversible_reactions(model, params, y_ref=None, max_timescale_s=DEFAULT_MAX_TIMESCALE_S):
+    """
+    Reversible pairs whose relaxation time is below max_timescale_s
+
+    Returns:
+    --------
+    list of dict
+        'forward', 'reverse' (flux indices), 'reaction' (index into
+        model.reactions) and 'timescale_s', fastest first
+    """
+    pairs = reversible_pairs(model)
+    rates = relaxation_rates(model, params, pairs, y_ref)
+    fast = [{'forward': forward, 'reverse': reverse, 'reaction': int(model.flux_reaction[forward]),
+             'timescale_s': 1.0 / rate}
+            for (forward, reverse), rate in zip(pairs, rates) if rate > 1.0 / max_timescale_s]
+    return sorted(fast, key=lambda item: item['timescale_s'])
+
+
+def conservation_laws(block, reactant_only):
+    """
+    Basis of the conserved totals of a fast subsystem
+
+    The basis of the left null space is re-expressed with the species that
+    only ever react (e.g. free FcRn and free ligands) as pivots, which gives
+    the usual non-negative totals such as FcRn + sum of FcRn complexes. The
+    orthonormal basis is kept when no such form exists.
+
+    Parameters:
+    -----------
+    block : numpy.ndarray
+        Net stoichiometry of the subsystem (species x fast reactions)
+    reactant_only : numpy.ndarray of bool
+        Species never produced by the forward direction of a fast reaction
+    """
+    basis = null_space(block.T).T
+    if not len(basis):
+        return basis
+    order = np.concatenate([np.flatnonzero(reactant_only), np.flatnonzero(~reactant_only)])
+    pivots = []
+    for column in order:
+        trial = pivots + [column]
+        if np.linalg.matrix_rank(basis[:, trial]) == len(trial):
+            pivots = trial
+        if len(pivots) == len(basis):
+            break
+    laws = np.linalg.solve(basis[:, pivots], basis)
+    laws[np.abs(laws) < 1e-12] = 0.0
+    return laws if np.all(laws >= 0) else basis
+
+
+class ReducedModel:
+    """
+    Rapid-equilibrium reduction of a compiled model for one parameter set
+
+    Species touched by fast reactions are grouped into connected components.
+    Each component keeps only its conserved totals (pools, the left null
+    space of its fast stoichiometry) as states; its species are recovered by
+    Newton's method from the pool totals and the equilibrium relations
+    k_forward * prod(reactants) = k_reverse * prod(products) of an
+    independent subset of its fast reactions. All other species are states
+    as before. The fast fluxes cancel exactly in the pool derivatives.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    params : dict
+        Parameter set (equilibrium constants are fixed by it)
+    fast : list of dict or None
+        Output of fast_reversible_reactions, computed when None
+    y_ref : numpy.ndarray or None
+        Reference state for the timescale screen
+    max_timescale_s : float
+        Timescale threshold for the screen
+    """
+
+    def __init__(self, model, params, fast=None, y_ref=None, max_timescale_s=DEFAULT_MAX_TIMESCALE_S):
+        self.model = model
+        self.params = dict(params)
+        self.fast = fast_reversible_reactions(model, params, y_ref, max_timescale_s) if fast is None else fast
+        self.p = model.parameter_vector(params)
+        self.k = model.rate_constants(self.p)
+        n = model.n_species
+        S = model.stoichiometry.tocsc()
+        columns = [pair['forward'] for pair in self.fast]
+
+        # Components of species linked by fast reactions
+        fast_species = sorted({i for j in columns for i in S.indices[S.indptr[j]:S.indptr[j + 1]]})
+        self.fast_species = np.array(fast_species, dtype=int)
+        position = {species: q for q, species in enumerate(fast_species)}
+        edges = sparse.lil_matrix((len(fast_species), len(fast_species)))
+        for j in columns:
+            members = [position[i] for i in S.indices[S.indptr[j]:S.indptr[j + 1]]]
+            for a in members:
+                for b in members:
+                    edges[a, b] = 1
+        n_components, labels = connected_components(edges.tocsr(), directed=False) if fast_species else (0, [])
+
+        pool_rows, equilibria, self.component_pools = [], [], []
+        for component in range(n_components):
+            members = self.fast_species[np.asarray(labels) == component]
+            member_set = set(members.tolist())
+            reactions = [q for q, j in enumerate(columns)
+                         if member_set & set(S.indices[S.indptr[j]:S.indptr[j + 1]].tolist())]
+            block = S[members][:, [columns[q] for q in reactions]].toarray()
+            _, R, pivots = qr(block, pivoting=True)
+            rank = int(np.sum(np.abs(np.diag(R)) > 1e-10 * max(1.0, np.abs(R).max())))
+            equilibria += [reactions[q] for q in sorted(pivots[:rank])]
+            basis = conservation_laws(block, np.all(block <= 0, axis=1))
+            start = len(pool_rows)
+            for row in basis:
+                full = np.zeros(n)
+                full[members] = row
+                pool_rows.append(full)
+            self.component_pools.append((members, np.arange(start, len(pool_rows))))
+        self.equilibria = [self.fast[q] for q in equilibria]
+
+        # Reduced state u = P y: slow species first, then pool totals
+        in_fast = np.zeros(n, dtype=bool)
+        in_fast[self.fast_species] = True
+        self.slow_species = np.flatnonzero(~in_fast)
+        n_slow = len(self.slow_species)
+        slow_rows = sparse.csr_matrix((np.ones(n_slow), (np.arange(n_slow), self.slow_species)),
+                                      shape=(n_slow, n))
+        self.pools = sparse.csr_matrix(np.array(pool_rows).reshape(-1, n))
+        self.projection = sparse.vstack([slow_rows, self.pools]).tocsr()
+        self.n_states = self.projection.shape[0]
+        self._pool_block = self.pools[:, self.fast_species].tocsr()
+
+        # Derivative entries of the equilibrium residuals w.r.t. the fast species
+        entries = []
+        for row, pair in enumerate(self.equilibria):
+            for species, others, sign, flux in (_monomial_derivatives(model, pair['forward'], 1.0)
+                                                 + _monomial_derivatives(model, pair['reverse'], -1.0)):
+                entries.append((row, position[species], (others + [n, n])[:2], sign, flux))
+        self._entry_rows = np.array([e[0] for e in entries], dtype=int)
+        self._entry_cols = np.array([e[1] for e in entries], dtype=int)
+        self._entry_others = np.array([e[2] for e in entries], dtype=int).reshape(-1, 2)
+        self._entry_scale = np.array([e[3] * self.k[e[4]] for e in entries])
+        forward = [pair['forward'] for pair in self.equilibria]
+        reverse = [pair['reverse'] for pair in self.equilibria]
+        self._forward = (self.k[forward], model.mass_action_index[:, forward])
+        self._reverse = (self.k[reverse], model.mass_action_index[:, reverse])
+        self._residual_scale = 1.0 / np.maximum(
+            relaxation_rates(model, params, [(pair['forward'], pair['reverse']) for pair in self.equilibria]),
+            1e-300)
+        self._guess = None
+
+        # Sparsity of du/dt: fast species depend on every pool of their component
+        dependence = sparse.lil_matrix((n, self.n_states))
+        dependence[self.slow_species, np.arange(n_slow)] = 1
+        for members, pools in self.component_pools:
+            for i in members:
+                dependence[i, n_slow + pools] = 1
+        pattern = abs(self.projection) @ model.jac_sparsity @ dependence.tocsr()
+        self.jac_sparsity = (pattern != 0).astype(float)
+
+    def __repr__(self):
+        return (f"<ReducedModel {self.model.n_species} -> {self.n_states} states, "
+                f"{len(self.fast)} fast reactions>")
+
+    def to_reduced(self, y):
+        """
+        Reduced state u = P y of a full state (or states as columns)
+        """
+        return self.projection @ y
+
+    def _net_rates(self, y_ext):
+        k_f, index_f = self._forward
+        k_r, index_r = self._reverse
+        return k_f * np.prod(y_ext[index_f], axis=0) - k_r * np.prod(y_ext[index_r], axis=0)
+
+    def _residual(self, x, totals, y_ext):
+        y_ext[self.fast_species] = x
+        return np.concatenate([self._pool_block @ x - totals,
+                               self._net_rates(y_ext) * self._residual_scale])
+
+    def _factor(self, y_ext):
+        values = self._entry_scale * np.prod(y_ext[self._entry_others], axis=1)
+        derivative = sparse.csr_matrix(
+            (values * self._residual_scale[self._entry_rows], (self._entry_rows, self._entry_cols)),
+            shape=(len(self.equilibria), len(self.fast_species)))
+        return splu(sparse.vstack([self._pool_block, derivative]).tocsc())
+
+    def _solve_fast(self, totals, guess):
+        """
+        Fast species with the given pool totals at equilibrium (Newton with backtracking)
+        """
+        n = self.model.n_species
+        y_ext = np.zeros(n + 1)
+        y_ext[n] = 1.0
+        x = np.array(guess, dtype=float)
+        residual = self._residual(x, totals, y_ext)
+        norm = np.max(np.abs(residual))
+        for _ in range(NEWTON_MAX_ITERATIONS):
+            scale = max(np.abs(totals).max(), np.abs(x).max())
+            if norm <= NEWTON_TOLERANCE * scale:
+                return x
+            step = self._factor(y_ext).solve(-residual)
+            alpha = 1.0
+            while True:
+                trial = x + alpha * step
+                trial_residual = self._residual(trial, totals, y_ext)
+                trial_norm = np.max(np.abs(trial_residual))
+                if trial_norm < norm or alpha < 1e-4:
+                    break
+                alpha *= 0.5
+            if trial_norm >= norm:
+                # No further decrease: converged to round-off
+                if norm <= 1e3 * np.finfo(float).eps * max(scale, np.abs(step).max()):
+                    return x
+                break
+            x, residual, norm = trial, trial_residual, trial_norm
+        raise RuntimeError("Equilibrium solve did not converge")
+
+    def to_full(self, u, guess=None):
+        """
+        Full state from a reduced state, solving the fast equilibria
+
+        Parameters:
+        -----------
+        u : numpy.ndarray
+            Reduced state
+        guess : numpy.ndarray or None
+            Full-state starting point for the fast species (the previous
+            solution is used when None)
+        """
+        n_slow = len(self.slow_species)
+        y = np.zeros(self.model.n_species)
+        y[self.slow_species] = u[:n_slow]
+        if len(self.fast_species):
+            if guess is not None:
+                start = np.asarray(guess)[self.fast_species]
+            elif self._guess is not None:
+                start = self._guess
+            else:
+                start = np.zeros(len(self.fast_species))
+            self._guess = self._solve_fast(u[n_slow:], start)
+            y[self.fast_species] = self._guess
+        return y
+
+    def equilibrate(self, y):
+        """
+        Project a full state onto the equilibrium manifold, keeping its pool totals
+        """
+        return self.to_full(self.to_reduced(y), guess=y)
+
+    def rhs_function(self):
+        """
+        f(t, u) of the reduced ODE
+        """
+        def f(t, u):
+            return self.projection @ self.model.rhs(self.to_full(u), self.p, self.k)
+        return f
+
+
+def simulate_reduced(reduced, t_eval_weeks, y0=None, regimen=None, doses=None, method='BDF',
+                     rtol=1e-6, atol=1e-12):
+    """
+    Integrate the reduced model and return full states
+
+    Doses are applied to the reduced state through the projection (a dose
+    into a pooled species raises its pool totals), and the trajectory is
+    mapped back to all species, so the result supports every read-out.
+
+    Returns:
+    --------
+    SimulationResult
+    """
+    model = reduced.model
+    t_eval = np.asarray(t_eval_weeks, dtype=float) * SECONDS_PER_WEEK
+    if doses is None:
+        doses = dose_schedule(regimen, reduced.params) if regimen is not None else []
+    projection = reduced.projection.tocsc()
+    reduced_doses = []
+    for t, name, amount in doses:
+        i = model.species_index[name]
+        for row, weight in zip(projection.indices[projection.indptr[i]:projection.indptr[i + 1]],
+                               projection.data[projection.indptr[i]:projection.indptr[i + 1]]):
+            reduced_doses.append((t * SECONDS_PER_WEEK, row, amount * weight))
+    reduced_doses = sorted(dose for dose in reduced_doses if t_eval[0] <= dose[0] < t_eval[-1])
+
+    y = model.initial_state() if y0 is None else np.asarray(y0, dtype=float)
+    u = reduced.to_reduced(y)
+    options = _jacobian_options(reduced.jac_sparsity, method)
+    t_out, out, _, u = _integrate(reduced.rhs_function(), u, t_eval, reduced_doses, method, rtol, atol,
+                                  options)
+    states = np.column_stack([reduced.to_full(column) for column in out.T])
+    return SimulationResult(model, t_out / SECONDS_PER_WEEK, states, reduced.params,
+                            final_state=reduced.to_full(u))
+
+
+def check_reduction(reduced, t_eval_weeks, y0=None, regimen=None,
+                    quantities=('plaque', 'SUVR', 'Centiloid'), tolerance=1e-3, **options):
+    """
+    Compare the reduced model with the full model on one scenario
+
+    The full model starts from y0 as given; the reduced model starts from its
+    pool totals. Errors are relative to the largest magnitude of each
+    quantity over the trajectory, floored at the absolute tolerance so that
+    quantities that stay at zero do not divide by zero.
+
+    Returns:
+    --------
+    dict
+        'errors' (quantity -> max relative error), 'passed' (all below
+        tolerance), 'full_s' and 'reduced_s' (wall times), 'states'
+        (full and reduced state counts) and 'timescales_s' of the lumped
+        reactions
+    """
+    start = time.perf_counter()
+    full = simulate(reduced.model, reduced.params, t_eval_weeks, y0=y0, regimen=regimen,
+                    backend='numpy', **options)
+    full_s = time.perf_counter() - start
+    start = time.perf_counter()
+    approx = simulate_reduced(reduced, t_eval_weeks, y0=y0, regimen=regimen, **options)
+    reduced_s = time.perf_counter() - start
+
+    errors = {}
+    for name in quantities:
+        if name in reduced.model.species_index:
+            a, b = full.species(name), approx.species(name)
+        else:
+            a = observable(reduced.model, full.y, name, reduced.params)
+            b = observable(reduced.model, approx.y, name, reduced.params)
+        errors[name] = float(np.max(np.abs(a - b)) / max(np.max(np.abs(a)), options.get('atol', 1e-12)))
+    return {'errors': errors, 'passed': all(error <= tolerance for error in errors.values()),
+            'full_s': full_s, 'reduced_s': reduced_s,
+            'states': (reduced.model.n_species, reduced.n_states),
+            'timescales_s': [pair['timescale_s'] for pair in reduced.fast]}
@@ -0,0 +1,247 @@
+"""
+Dose-Regimen Optimizer
+Searches dose, interval, route (IV or SC via Antibody_SubCutComp) and titration for
+regimens reaching a target plaque reduction while limiting peak Antibody_ISF
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from geerts_model import (DEFAULT_MW_ANTIBODY, BaselineCache, dose_schedule, parameter_hash,
+                          simulate)
+from parallel import parallel_map
+from simulation_cache import ResultCache, cache_key
+
+DEFAULT_SEARCH_SPACE = {
+    'dose_mg_per_kg': (1.0, 15.0),
+    'interval_weeks': [2, 4],
+    'route': ['IV', 'SC'],
+    'titration_doses': [0, 2, 4],
+}
+
+
+def build_regimen(dose_mg_per_kg, interval_weeks, route, titration_doses, treatment_weeks,
+                  body_weight_kg=70.0, antibody='Antibody'):
+    """
+    Regimen dict for one candidate
+
+    Titration doses are given at half the maintenance dose before the
+    maintenance phase, as in the aducanumab and gantenerumab up-titration.
+
+    Returns:
+    --------
+    dict
+        Regimen accepted by geerts_model.dose_schedule
+    """
+    regimen = {'dose_mg_per_kg': float(dose_mg_per_kg), 'interval_weeks': float(interval_weeks),
+               'route': route, 'duration_weeks': float(treatment_weeks),
+               'body_weight_kg': float(body_weight_kg), 'antibody': antibody}
+    if titration_doses:
+        regimen['titration'] = [{'dose_mg_per_kg': 0.5 * float(dose_mg_per_kg),
+                                 'n_doses': int(titration_doses)}]
+    return regimen
+
+
+class RegimenEvaluator:
+    """
+    Picklable evaluation of a regimen over the treatment window only
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    params : dict
+        Parameter set of the virtual patient
+    baseline_state : numpy.ndarray
+        Untreated state at treatment start
+    treatment_weeks : float
+        Length of the treatment window
+    output_step_weeks : float, default 1/7
+        Output spacing used to find the peak ISF antibody
+    """
+
+    def __init__(self, model, params, baseline_state, treatment_weeks, output_step_weeks=1.0 / 7.0):
+        self.model = model
+        self.params = params
+        self.baseline_state = np.asarray(baseline_state, dtype=float)
+        self.treatment_weeks = float(treatment_weeks)
+        self.t_weeks = np.arange(0.0, self.treatment_weeks + 1e-9, output_step_weeks)
+        if self.t_weeks[-1] < self.treatment_weeks:
+            self.t_weeks = np.append(self.t_weeks, self.treatment_weeks)
+
+    def key(self, regimen):
+        return cache_key('regimen', self.model.model_hash, parameter_hash(self.params),
+                         self.baseline_state.tobytes(), self.t_weeks, regimen)
+
+    def __call__(self, regimen):
+        try:
+            result = simulate(self.model, self.params, self.t_weeks, y0=self.baseline_state,
+                              regimen=regimen)
+        except RuntimeError as e:
+            print(f"Regimen failed: {e}")
+            return {'plaque_reduction': np.nan, 'peak_isf_antibody': np.nan}
+        plaque = result.observable('plaque')
+        antibody = regimen.get('antibody', 'Antibody')
+        return {
+            'plaque_reduction': float(1.0 - plaque[-1] / plaque[0]) if plaque[0] > 0 else np.nan,
+            'peak_isf_antibody': float(result.species(f"{antibody}_ISF").max()),
+        }
+
+
+def total_dose_mg(regimen, params=None):
+    """
+    Total antibody administered by a regimen in mg
+    """
+    params = params or {}
+    antibody = regimen.get('antibody', 'Antibody')
+    mw = params.get(f"MW_{antibody}", params.get('MW_Antibody', DEFAULT_MW_ANTIBODY))
+    return sum(amount for _, _, amount in dose_schedule(regimen, params)) * mw / 1e6
+
+
+def evaluate_regimens(evaluator, regimens, cache=None, processes=None):
+    """
+    Evaluate regimens in parallel, reusing cached results
+
+    Returns:
+    --------
+    list of dict
+        Metrics per regimen, in order
+    """
+    cache = ResultCache() if cache is None else cache
+    keys = [evaluator.key(regimen) for regimen in regimens]
+    results = [cache.get(key) for key in keys]
+    todo = [i for i, result in enumerate(results) if result is None]
+    for i, result in zip(todo, parallel_map(evaluator, [regimens[i] for i in todo],
+                                            processes=processes)):
+        cache.put(keys[i], result, model_hash=evaluator.model.model_hash,
+                  parameters=sorted(evaluator.params))
+        results[i] = result
+    return results
+
+
+def _score(rows, target_reduction, max_isf_antibody):
+    df = pd.DataFrame(rows)
+    df['feasible'] = df['plaque_reduction'] >= target_reduction
+    if max_isf_antibody is not None:
+        df['feasible'] &= df['peak_isf_antibody'] <= max_isf_antibody
+    return df
+
+
+def optimize_regimen(model, params, target_reduction, max_isf_antibody=None, treatment_weeks=78.0,
+                     baseline_years=20.0, baseline_state=None, search_space=None, n_dose_levels=6,
+                     refine_steps=5, n_refine=3, body_weight_kg=70.0, antibody='Antibody',
+                     processes=None, cache=None, baseline_cache=None):
+    """
+    Find the regimen with the least total drug that meets the plaque target
+
+    A grid over the discrete choices (interval, route, titration) and
+    log-spaced dose levels is evaluated in parallel. For the most promising
+    discrete combinations the maintenance dose is then bisected down to the
+    smallest dose that still meets the target. All candidates start from one
+    precomputed untreated baseline and integrate only the treatment window.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    params : dict
+        Parameter set of the virtual patient
+    target_reduction : float
+        Required fractional plaque reduction at the end of treatment (e.g. 0.5)
+    max_isf_antibody : float or None
+        Upper limit on peak Antibody_ISF
+    treatment_weeks : float, default 78
+        Treatment window
+    baseline_years : float, default 20
+        Untreated history before treatment, used when baseline_state is None
+    baseline_state : numpy.ndarray or None
+        Precomputed pre-treatment state
+    search_space : dict or None
+        Overrides for DEFAULT_SEARCH_SPACE
+    n_dose_levels : int, default 6
+        Log-spaced dose levels in the initial grid
+    refine_steps : int, default 5
+        Bisection steps on the dose
+    n_refine : int, default 3
+        Number of discrete combinations refined
+    processes : int or None
+        Number of worker processes
+    cache : ResultCache or None
+        Cache of regimen evaluations, shared across calls
+    baseline_cache : BaselineCache or None
+        Cache of untreated baselines
+
+    Returns:
+    --------
+    dict
+        'best' (regimen dict or None), 'best_metrics' and 'evaluations' (DataFrame)
+    """
+    space = {**DEFAULT_SEARCH_SPACE, **(search_space or {})}
+    cache = ResultCache() if cache is None else cache
+    if baseline_state is None:
+        baseline_cache = BaselineCache() if baseline_cache is None else baseline_cache
+        baseline_state = baseline_cache.get(model, params, baseline_years)
+    evaluator = RegimenEvaluator(model, params, baseline_state, treatment_weeks)
+
+    low, high = space['dose_mg_per_kg']
+    doses = np.geomspace(low, high, n_dose_levels)
+    combos = list(itertools.product(space['interval_weeks'], space['route'],
+                                    space['titration_doses']))
+
+    def make(dose, combo):
+        return build_regimen(dose, *combo, treatment_weeks, body_weight_kg, antibody)
+
+    rows = []
+
+    def run(candidates):
+        regimens = [make(dose, combo) for dose, combo in candidates]
+        for (dose, combo), regimen, metrics in zip(candidates, regimens,
+                                                   evaluate_regimens(evaluator, regimens, cache,
+                                                                     processes)):
+            rows.append({'dose_mg_per_kg': dose, 'interval_weeks': combo[0], 'route': combo[1],
+                         'titration_doses': combo[2],
+                         'total_dose_mg': total_dose_mg(regimen, params), **metrics})
+
+    print(f"Evaluating {len(doses) * len(combos)} grid regimens...")
+    run([(dose, combo) for combo in combos for dose in doses])
+    grid = _score(rows, target_reduction, max_isf_antibody)
+
+    # Bracket the smallest feasible dose of each promising combination
+    brackets = []
+    for combo, group in grid.groupby(['interval_weeks', 'route', 'titration_doses'], sort=False):
+        feasible = group[group['feasible']].sort_values('dose_mg_per_kg')
+        if feasible.empty:
+            continue
+        hi = feasible['dose_mg_per_kg'].iloc[0]
+        below = group[group['dose_mg_per_kg'] < hi]['dose_mg_per_kg']
+        lo = below.max() if not below.empty else hi
+        brackets.append([combo, lo, hi, feasible['total_dose_mg'].iloc[0]])
+    brackets = sorted(brackets, key=lambda b: b[3])[:n_refine]
+
+    for step in range(refine_steps):
+        active = [b for b in brackets if b[2] - b[1] > 1e-3 * b[2]]
+        if not active:
+            break
+        print(f"Refinement step {step + 1}: bisecting {len(active)} combinations")
+        mids = [np.sqrt(b[1] * b[2]) for b in active]
+        n_before = len(rows)
+        run([(mid, tuple(b[0])) for mid, b in zip(mids, active)])
+        new = _score(rows[n_before:], target_reduction, max_isf_antibody)
+        for b, mid, ok in zip(active, mids, new['feasible']):
+            if ok:
+                b[2] = mid
+            else:
+                b[1] = mid
+
+    evaluations = _score(rows, target_reduction, max_isf_antibody)
+    feasible = evaluations[evaluations['feasible']]
+    if feasible.empty:
+        print("No evaluated regimen meets the constraints")
+        return {'best': None, 'best_metrics': None, 'evaluations': evaluations}
+
+    best = feasible.sort_values(['total_dose_mg', 'peak_isf_antibody']).iloc[0]
+    regimen = make(best['dose_mg_per_kg'], (best['interval_weeks'], best['route'],
+                                            int(best['titration_doses'])))
+    return {'best': regimen, 'best_metrics': best.to_dict(), 'evaluations': evaluations}
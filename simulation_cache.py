@@ -0,0 +1,98 @@
+"""
+Simulation Result Cache
+Content-addressed cache of simulation and fit results, in memory and optionally on disk
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def _jsonable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, bytes):
+        return hashlib.sha256(value).hexdigest()
+    raise TypeError(f"Cannot serialise {type(value).__name__}")
+
+
+def cache_key(*parts):
+    """
+    SHA-256 of JSON-serialisable parts (dicts are key-sorted)
+    """
+    text = json.dumps(parts, sort_keys=True, default=_jsonable)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache of JSON-serialisable results keyed by cache_key
+
+    On disk every entry is one <key>.json file that also records the model
+    hash and the parameters it depends on, so entries made stale by a change
+    to the reaction list can be found later (see model_diff.py).
+
+    Parameters:
+    -----------
+    directory : str or Path or None
+        Cache directory, memory only when None
+    """
+
+    def __init__(self, directory=None):
+        self.directory = None if directory is None else Path(directory)
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.memory = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return self.directory / f"{key}.json"
+
+    def get(self, key):
+        """
+        Cached result for key, or None
+        """
+        if key in self.memory:
+            self.hits += 1
+            return self.memory[key]
+        if self.directory is not None and self._path(key).exists():
+            with open(self._path(key), encoding='utf-8') as f:
+                value = json.load(f)['result']
+            self.memory[key] = value
+            self.hits += 1
+            return value
+        self.misses += 1
+        return None
+
+    def put(self, key, value, model_hash=None, kind='simulation', parameters=None):
+        """
+        Store a result; on disk the write is atomic
+
+        Parameters:
+        -----------
+        key : str
+            Output of cache_key
+        value : object
+            JSON-serialisable result
+        model_hash : str or None
+            Hash of the reaction list the result was computed with
+        kind : str, default 'simulation'
+            'simulation' or 'fit'
+        parameters : list of str or None
+            Parameters the result depends on (e.g. the free parameters of a fit)
+        """
+        self.memory[key] = value
+        if self.directory is None:
+            return
+        entry = {'model_hash': model_hash, 'kind': kind, 'parameters': parameters,
+                 'result': value}
+        tmp_path = self._path(key).with_suffix('.json.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, default=_jsonable)
+        os.replace(tmp_path, self._path(key))
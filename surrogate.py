@@ -0,0 +1,319 @@
+"""
+Surrogate Emulator
+NumPy Gaussian-process emulator of Geerts model outputs (parameters plus regimen ->
+SUVR/Centiloid time courses) with uncertainty and active learning
+"""
+
+import numpy as np
+import pandas as pd
+
+from parallel import parallel_map
+
+
+def latin_hypercube(bounds, n, seed=None, log_scale=True):
+    """
+    Latin hypercube design over named inputs
+
+    Parameters:
+    -----------
+    bounds : dict
+        Mapping name -> (lower, upper)
+    n : int
+        Number of design points
+    seed : int or None
+        Random seed
+    log_scale : bool or set, default True
+        Sample uniformly in log10; a set restricts this to the named inputs
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per design point, one column per input
+    """
+    rng = np.random.default_rng(seed)
+    names = list(bounds)
+    strata = (rng.permuted(np.tile(np.arange(n), (len(names), 1)), axis=1).T
+              + rng.uniform(size=(n, len(names)))) / n
+    design = {}
+    for i, name in enumerate(names):
+        lower, upper = bounds[name]
+        if log_scale is True or (not isinstance(log_scale, bool) and name in log_scale):
+            design[name] = 10.0 ** (np.log10(lower) + strata[:, i] * (np.log10(upper) - np.log10(lower)))
+        else:
+            design[name] = lower + strata[:, i] * (upper - lower)
+    return pd.DataFrame(design)
+
+
+class InputEncoder:
+    """
+    Maps dicts of parameters and regimen settings to emulator feature vectors
+
+    Parameters:
+    -----------
+    names : list of str
+        Input names in feature order (e.g. ['kcatADCP', 'konPP', 'dose_mg_per_kg'])
+    log_names : iterable of str or None
+        Inputs encoded as log10, defaults to all of them
+    """
+
+    def __init__(self, names, log_names=None):
+        self.names = list(names)
+        log_names = self.names if log_names is None else set(log_names)
+        self.log_mask = np.array([name in log_names for name in self.names])
+
+    def __call__(self, inputs):
+        if isinstance(inputs, pd.DataFrame):
+            values = inputs[self.names].to_numpy(dtype=float, copy=True)
+        else:
+            if isinstance(inputs, dict):
+                inputs = [inputs]
+            values = np.array([[float(item[name]) for name in self.names] for item in inputs])
+        values[:, self.log_mask] = np.log10(values[:, self.log_mask])
+        return values
+
+
+def _adam(gradient_fn, theta, n_iter=200, learning_rate=0.05):
+    """
+    Maximise an objective with Adam given a function returning (value, gradient)
+    """
+    m = np.zeros_like(theta)
+    v = np.zeros_like(theta)
+    best_theta, best_value = theta.copy(), -np.inf
+    for t in range(1, n_iter + 1):
+        value, grad = gradient_fn(theta)
+        if value > best_value:
+            best_theta, best_value = theta.copy(), value
+        m = 0.9 * m + 0.1 * grad
+        v = 0.999 * v + 0.001 * grad ** 2
+        theta = theta + learning_rate * (m / (1 - 0.9 ** t)) / (np.sqrt(v / (1 - 0.999 ** t)) + 1e-8)
+    return best_theta, best_value
+
+
+class GaussianProcessEmulator:
+    """
+    Multi-output Gaussian-process emulator with a shared squared-exponential kernel
+
+    All outputs (e.g. SUVR change at each observation time) share one
+    correlation structure with per-output amplitude, so predicting a whole time
+    course costs a single kernel solve. Hyperparameters (ARD length scales and
+    nugget) maximise the concentrated marginal likelihood with Adam, using only
+    NumPy.
+
+    Parameters:
+    -----------
+    n_restarts : int, default 3
+        Random restarts of the hyperparameter optimisation
+    n_iter : int, default 200
+        Adam iterations per restart
+    min_nugget : float, default 1e-8
+        Lower limit on the relative noise variance
+    seed : int or None
+        Random seed for the restarts
+    """
+
+    def __init__(self, n_restarts=3, n_iter=200, min_nugget=1e-8, seed=None):
+        self.n_restarts = n_restarts
+        self.n_iter = n_iter
+        self.min_nugget = min_nugget
+        self.rng = np.random.default_rng(seed)
+        self.X = None
+        self.Y = None
+
+    def _correlation(self, A, B, length_scales):
+        diff = (A[:, None, :] - B[None, :, :]) / length_scales
+        return np.exp(-0.5 * np.sum(diff ** 2, axis=-1)), diff
+
+    def _log_marginal_likelihood(self, theta):
+        """
+        Concentrated log marginal likelihood and its gradient w.r.t. log hyperparameters
+        """
+        n, m = self.Yn.shape
+        length_scales = np.exp(theta[:-1])
+        nugget = self.min_nugget + np.exp(theta[-1])
+        K, diff = self._correlation(self.Xn, self.Xn, length_scales)
+        R = K + nugget * np.eye(n)
+        try:
+            L = np.linalg.cholesky(R)
+        except np.linalg.LinAlgError:
+            return -np.inf, np.zeros_like(theta)
+        R_inv = np.linalg.solve(L.T, np.linalg.solve(L, np.eye(n)))
+        alpha = R_inv @ self.Yn
+        quad = np.maximum(np.sum(self.Yn * alpha, axis=0) / n, 1e-300)
+        value = -0.5 * (m * 2.0 * np.sum(np.log(np.diag(L))) + n * np.sum(np.log(quad)))
+
+        # dL/dtheta = 0.5 * tr((W - m R^-1) dR), W = sum_j alpha_j alpha_j^T / quad_j
+        W = (alpha / quad) @ alpha.T - m * R_inv
+        grad = np.empty_like(theta)
+        for i in range(len(length_scales)):
+            dR = K * diff[:, :, i] ** 2
+            grad[i] = 0.5 * np.sum(W * dR)
+        grad[-1] = 0.5 * np.trace(W) * (nugget - self.min_nugget)
+        return value, grad
+
+    def fit(self, X, Y):
+        """
+        Fit the emulator to a design of simulations
+
+        Parameters:
+        -----------
+        X : array-like
+            Encoded inputs, shape (n, d)
+        Y : array-like
+            Outputs, shape (n, m) (e.g. SUVR change at m observation times)
+
+        Returns:
+        --------
+        GaussianProcessEmulator
+            self
+        """
+        self.X = np.atleast_2d(np.asarray(X, dtype=float))
+        Y = np.asarray(Y, dtype=float)
+        self.Y = Y.reshape(len(Y), -1)
+        self.x_mean = self.X.mean(axis=0)
+        self.x_std = np.where(self.X.std(axis=0) > 0, self.X.std(axis=0), 1.0)
+        self.y_mean = self.Y.mean(axis=0)
+        self.y_std = np.where(self.Y.std(axis=0) > 0, self.Y.std(axis=0), 1.0)
+        self.Xn = (self.X - self.x_mean) / self.x_std
+        self.Yn = (self.Y - self.y_mean) / self.y_std
+
+        best_theta, best_value = None, -np.inf
+        for _ in range(self.n_restarts):
+            theta0 = np.append(self.rng.uniform(-0.5, 1.0, self.X.shape[1]),
+                               self.rng.uniform(-10.0, -4.0))
+            theta, value = _adam(self._log_marginal_likelihood, theta0, n_iter=self.n_iter)
+            if value > best_value:
+                best_theta, best_value = theta, value
+        self.theta = best_theta
+        self.log_marginal_likelihood = best_value
+        self._factorise()
+        return self
+
+    def _factorise(self):
+        n = len(self.Xn)
+        self.length_scales = np.exp(self.theta[:-1])
+        self.nugget = self.min_nugget + np.exp(self.theta[-1])
+        K, _ = self._correlation(self.Xn, self.Xn, self.length_scales)
+        self.L = np.linalg.cholesky(K + self.nugget * np.eye(n))
+        self.alpha = np.linalg.solve(self.L.T, np.linalg.solve(self.L, self.Yn))
+        self.amplitude = np.sum(self.Yn * self.alpha, axis=0) / n
+
+    def predict(self, X, return_std=True):
+        """
+        Predict outputs at new inputs
+
+        Parameters:
+        -----------
+        X : array-like
+            Encoded inputs, shape (n_new, d)
+        return_std : bool, default True
+            Also return the predictive standard deviation
+
+        Returns:
+        --------
+        numpy.ndarray or tuple
+            Mean of shape (n_new, m), and standard deviation of the same shape
+        """
+        Xn = (np.atleast_2d(np.asarray(X, dtype=float)) - self.x_mean) / self.x_std
+        k, _ = self._correlation(Xn, self.Xn, self.length_scales)
+        mean = self.y_mean + (k @ self.alpha) * self.y_std
+        if not return_std:
+            return mean
+        v = np.linalg.solve(self.L, k.T)
+        reduction = np.clip(1.0 + self.nugget - np.sum(v ** 2, axis=0), 0.0, None)
+        std = np.sqrt(np.outer(reduction, self.amplitude)) * self.y_std
+        return mean, std
+
+
+def run_design(simulate, inputs, processes=None):
+    """
+    Run the real simulator over a design in parallel
+
+    Parameters:
+    -----------
+    simulate : callable
+        Picklable simulate(input_dict) -> array of outputs (e.g. SUVR time course)
+    inputs : pandas.DataFrame or list of dict
+        Design points (parameters plus regimen settings)
+    processes : int or None
+        Number of worker processes, None for one per CPU
+
+    Returns:
+    --------
+    numpy.ndarray
+        Outputs, shape (n, m)
+    """
+    if isinstance(inputs, pd.DataFrame):
+        inputs = inputs.to_dict('records')
+    return np.array([np.ravel(y) for y in parallel_map(simulate, inputs, processes=processes)])
+
+
+def active_learning(emulator, encoder, simulate, inputs, outputs, candidates, n_rounds=5,
+                    batch_size=4, processes=None, tolerance=None):
+    """
+    Refine an emulator by simulating where it is least certain
+
+    Each round scores all candidates by their largest standardised predictive
+    SD, simulates the most uncertain batch (skipping near-duplicates in feature
+    space) with the real model, and refits.
+
+    Parameters:
+    -----------
+    emulator : GaussianProcessEmulator
+        Emulator to refine (refit in place)
+    encoder : InputEncoder
+        Maps input dicts to features
+    simulate : callable
+        Picklable real simulator, see run_design
+    inputs : list of dict
+        Inputs already simulated
+    outputs : array-like
+        Outputs for those inputs
+    candidates : pandas.DataFrame or list of dict
+        Pool of inputs the learner may add
+    n_rounds : int, default 5
+        Number of acquisition rounds
+    batch_size : int, default 4
+        Simulations per round (run in parallel)
+    processes : int or None
+        Number of worker processes
+    tolerance : float or None
+        Stop early once the largest standardised SD falls below this
+
+    Returns:
+    --------
+    dict
+        'emulator', 'inputs', 'outputs' and per-round 'max_std' history
+    """
+    if isinstance(candidates, pd.DataFrame):
+        candidates = candidates.to_dict('records')
+    inputs = list(inputs)
+    outputs = np.asarray(outputs, dtype=float)
+    pool = list(candidates)
+    history = []
+    emulator.fit(encoder(inputs), outputs)
+
+    for _ in range(n_rounds):
+        if not pool:
+            break
+        features = encoder(pool)
+        _, std = emulator.predict(features)
+        score = np.max(std / emulator.y_std, axis=1)
+        history.append(float(score.max()))
+        if tolerance is not None and score.max() < tolerance:
+            break
+
+        chosen = []
+        min_distance = 0.5 * np.min(emulator.length_scales) * np.min(emulator.x_std)
+        for index in np.argsort(score)[::-1]:
+            if all(np.linalg.norm(features[index] - features[j]) > min_distance for j in chosen):
+                chosen.append(index)
+            if len(chosen) == batch_size:
+                break
+
+        new_inputs = [pool[i] for i in chosen]
+        outputs = np.vstack([outputs, run_design(simulate, new_inputs, processes=processes)])
+        inputs.extend(new_inputs)
+        pool = [item for i, item in enumerate(pool) if i not in set(chosen)]
+        emulator.fit(encoder(inputs), outputs)
+
+    return {'emulator': emulator, 'inputs': inputs, 'outputs': outputs, 'max_std': history}
@@ -0,0 +1,263 @@
+"""
+Parameter and Dose-Response Sweeps
+Cartesian or Latin-hypercube designs over named parameter and regimen axes, run in
+parallel with shared untreated baselines and returned as a labelled N-D array
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from geerts_model import BaselineCache, simulate, simulate_baseline
+from parallel import parallel_map
+from surrogate import latin_hypercube
+
+# Regimen settings understood by geerts_model.dose_schedule
+REGIMEN_KEYS = ('dose_mg_per_kg', 'dose_mg', 'interval_weeks', 'n_doses', 'duration_weeks', 'route',
+                'start_weeks', 'body_weight_kg', 'antibody', 'titration')
+
+
+class LabeledArray:
+    """
+    N-D array with named dimensions and coordinates (a minimal xarray.DataArray)
+
+    Parameters:
+    -----------
+    values : numpy.ndarray
+        Data
+    dims : list of str
+        Dimension names, one per axis
+    coords : dict
+        Dimension name -> coordinate values (same length as the axis)
+    name : str or None
+        Name of the data
+    """
+
+    def __init__(self, values, dims, coords, name=None):
+        self.values = np.asarray(values)
+        self.dims = list(dims)
+        self.coords = {dim: np.asarray(coords[dim]) for dim in self.dims}
+        self.name = name
+        if self.values.ndim != len(self.dims):
+            raise ValueError(f"{self.values.ndim}-D values for dims {self.dims}")
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __repr__(self):
+        sizes = ', '.join(f"{dim}: {len(self.coords[dim])}" for dim in self.dims)
+        return f"<LabeledArray {self.name or ''} ({sizes})>"
+
+    def isel(self, **indexers):
+        """
+        Select by integer position; scalar indexers drop the dimension
+        """
+        index, dims, coords = [], [], {}
+        for dim in self.dims:
+            selection = indexers.get(dim, slice(None))
+            index.append(selection)
+            if not np.isscalar(selection):
+                dims.append(dim)
+                coords[dim] = self.coords[dim][selection]
+        return LabeledArray(self.values[tuple(index)], dims, coords, self.name)
+
+    def sel(self, **indexers):
+        """
+        Select by coordinate value (exact match, or nearest for numeric coordinates)
+        """
+        positions = {}
+        for dim, value in indexers.items():
+            coord = self.coords[dim]
+            values = np.atleast_1d(value)
+            found = []
+            for item in values:
+                matches = np.flatnonzero(coord == item)
+                if not len(matches) and np.issubdtype(coord.dtype, np.number):
+                    matches = [int(np.argmin(np.abs(coord - item)))]
+                if not len(matches):
+                    raise KeyError(f"{item!r} not in {dim}")
+                found.append(int(matches[0]))
+            positions[dim] = found[0] if np.isscalar(value) else found
+        return self.isel(**positions)
+
+    def to_dataframe(self):
+        """
+        Long-format DataFrame, one row per element
+        """
+        grids = np.meshgrid(*[np.arange(len(self.coords[dim])) for dim in self.dims], indexing='ij')
+        data = {dim: self.coords[dim][grid.ravel()] for dim, grid in zip(self.dims, grids)}
+        data[self.name or 'value'] = self.values.ravel()
+        return pd.DataFrame(data)
+
+    def to_xarray(self):
+        """
+        Convert to xarray.DataArray (requires xarray)
+        """
+        import xarray as xr
+        return xr.DataArray(self.values, dims=self.dims, coords=self.coords, name=self.name)
+
+
+def sweep_design(axes, design='grid', n=None, seed=None, log_scale=True):
+    """
+    Points of a sweep design
+
+    Parameters:
+    -----------
+    axes : dict
+        Axis name -> list of values (grid) or (lower, upper) bounds (lhs)
+    design : str, default 'grid'
+        'grid' for the Cartesian product, 'lhs' for a Latin hypercube of n points
+    n : int or None
+        Number of points for 'lhs'
+    seed : int or None
+        Random seed for 'lhs'
+    log_scale : bool or set, default True
+        Log-uniform sampling for 'lhs', see surrogate.latin_hypercube
+
+    Returns:
+    --------
+    list of dict
+        One dict of axis values per point, in C order for grids
+    """
+    if design == 'grid':
+        names = list(axes)
+        return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+    if design == 'lhs':
+        return latin_hypercube(axes, n, seed=seed, log_scale=log_scale).to_dict('records')
+    raise ValueError(f"Unknown design: {design}")
+
+
+_MODEL = None
+
+
+def _init_worker(model):
+    global _MODEL
+    _MODEL = model
+
+
+def _baseline_task(task):
+    params, years, options = task
+    return simulate_baseline(_MODEL, params, years, **options).final_state
+
+
+def _outputs(result, outputs):
+    rows = []
+    for name in outputs:
+        if name in _MODEL.species_index:
+            rows.append(result.species(name))
+        else:
+            rows.append(result.observable(name))
+    return np.array(rows)
+
+
+def _treatment_task(task):
+    """
+    Simulate the treatment window of one sweep point from its baseline
+    """
+    params, y0, regimen, t_weeks, outputs, options = task
+    return _outputs(simulate(_MODEL, params, t_weeks, y0=y0, regimen=regimen, **options), outputs)
+
+
+def run_sweep(model, params, axes, regimen=None, times_weeks=(0.0, 78.0),
+              outputs=('SUVR_change', 'Centiloid'), design='grid', n=None, seed=None,
+              baseline_years=20.0, processes=None, baseline_cache=None,
+              log_scale=True, **options):
+    """
+    Run a dose-response or parameter sweep
+
+    Each axis is either a regimen setting (see REGIMEN_KEYS; a dose of 0 is
+    placebo) or a parameter. Points sharing the parameters that the untreated
+    phase depends on share one baseline integration. Baselines and the
+    treatment window of every point each run in parallel.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    params : dict
+        Base parameter set
+    axes : dict
+        Axis name -> values (grid) or (lower, upper) (lhs)
+    regimen : dict or None
+        Base regimen that regimen axes override
+    times_weeks : sequence of float, default (0, 78)
+        Output times in weeks from treatment start
+    outputs : sequence of str
+        Read-outs ('SUVR', 'Centiloid', their '_change', 'plaque') or species
+    design : str, default 'grid'
+        'grid' or 'lhs', see sweep_design
+    n, seed : int or None
+        Latin hypercube size and seed
+    baseline_years : float, default 20
+        Untreated history before treatment
+    processes : int or None
+        Worker processes
+    baseline_cache : BaselineCache or None
+        Cache consulted before integrating baselines, updated with new ones
+    log_scale : bool or set, default True
+        Log-uniform sampling for 'lhs', see sweep_design; use False (or the
+        set of log-scaled axes) when an axis starts at 0, e.g. a placebo dose
+    **options
+        Passed to simulate (e.g. rtol, atol, backend)
+
+    Returns:
+    --------
+    LabeledArray
+        Dimensions are the axes (grid) or 'sample' (lhs, with the sampled
+        axis values in .points), then 'output' and 'time_weeks'
+    """
+    regimen = dict(regimen or {})
+    points = sweep_design(axes, design, n, seed, log_scale)
+    times = np.asarray(times_weeks, dtype=float)
+    t_weeks = np.union1d([0.0], times)
+    keep = np.searchsorted(t_weeks, times)
+    baseline_cache = BaselineCache() if baseline_cache is None else baseline_cache
+    solver_options = {key: options[key] for key in ('method', 'rtol', 'atol', 'backend') if key in options}
+
+    point_params, point_regimens = [], []
+    for point in points:
+        point_params.append({**params, **{k: v for k, v in point.items() if k not in REGIMEN_KEYS}})
+        arm = {**regimen, **{k: v for k, v in point.items() if k in REGIMEN_KEYS}}
+        dose = arm.get('dose_mg', arm.get('dose_mg_per_kg', 0.0))
+        point_regimens.append(arm if arm and dose > 0 else None)
+
+    # Untreated baselines, deduplicated on the parameters they depend on
+    baseline_keys = [baseline_cache.key(model, p, baseline_years) for p in point_params]
+    baselines, missing = {}, {}
+    for key, p in zip(baseline_keys, point_params):
+        if key in baselines or key in missing:
+            continue
+        state = baseline_cache.lookup(key)
+        if state is None:
+            missing[key] = p
+        else:
+            baselines[key] = state
+    print(f"Sweep: {len(points)} points, {len(set(baseline_keys))} distinct baselines "
+          f"({len(missing)} to integrate)")
+    states = parallel_map(_baseline_task, [(p, baseline_years, solver_options) for p in missing.values()],
+                          processes=processes, initializer=_init_worker, initargs=(model,))
+    for key, state in zip(missing, states):
+        baseline_cache.put(key, state)
+        baselines[key] = state
+
+    # Treatment windows, one task per point
+    tasks = [(p, baselines[key], arm, t_weeks, list(outputs), options)
+             for p, key, arm in zip(point_params, baseline_keys, point_regimens)]
+    values = np.empty((len(points), len(outputs), len(times)))
+    for i, result in enumerate(parallel_map(_treatment_task, tasks, processes=processes,
+                                            initializer=_init_worker, initargs=(model,))):
+        values[i] = result[:, keep]
+
+    coords = {'output': list(outputs), 'time_weeks': times}
+    if design == 'grid':
+        dims = list(axes)
+        coords.update({name: list(axes[name]) for name in dims})
+        values = values.reshape([len(axes[name]) for name in dims] + [len(outputs), len(times)])
+    else:
+        dims = ['sample']
+        coords['sample'] = np.arange(len(points))
+    result = LabeledArray(values, dims + ['output', 'time_weeks'], coords, name='response')
+    result.points = pd.DataFrame(points)
+    return result
@@ -0,0 +1,190 @@
+"""
+Compartment Transport Operator
+Collects the first-order flows, BBB/BCSFB exchange and clearance reactions into one
+parameter-dependent sparse matrix, applied with a single matvec per right-hand side call
+"""
+
+import numpy as np
+from scipy import sparse
+
+from c_backend import COMPLEX_STEP
+from complex_step import column_groups
+
+
+def transport_fluxes(model):
+    """
+    Fluxes that are linear in the state
+
+    A flux qualifies when its rate constant does not depend on the state
+    and it consumes exactly its single mass-action reactant, e.g.
+    "Flow ISF to PVS" with rate (1.0 - sigma_ISF_PVS_proto) * Q_PVS * y.
+    Besides the compartment flows these are the BBB/BCSFB degradation and
+    return reactions, central and subcutaneous clearance and the other
+    first-order losses.
+
+    Returns:
+    --------
+    numpy.ndarray
+        Flux indices, sorted
+    """
+    static = set(model.static_flux.tolist())
+    return np.array([j for j, flux in enumerate(model.fluxes)
+                     if j in static and len(flux['mass_action']) == 1
+                     and flux['consumed'] == flux['mass_action']], dtype=int)
+
+
+class TransportOperator:
+    """
+    Linear part of the network as a sparse matrix T(p), with dy/dt = T(p) y + S_r v_r(y, p)
+
+    T(p) = S[:, L] diag(k_L(p)) E_L, where L are the transport fluxes and E_L
+    selects their reactants. Its sparsity pattern and the map from rate
+    constants to its entries are fixed at construction; the entries are
+    recomputed only when a parameter of a transport flux (the flows Q_*,
+    sigma_* reflection coefficients, clearances) changes. T(p) is also the
+    exact Jacobian of the transport part; jacobian_function adds the
+    complex-step Jacobian of the nonlinear remainder to it.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    fluxes : array-like or None
+        Fluxes to include, transport_fluxes(model) when None; each must be
+        linear in the state
+    """
+
+    def __init__(self, model, fluxes=None):
+        self.model = model
+        self.fluxes = transport_fluxes(model) if fluxes is None else np.sort(np.asarray(fluxes, dtype=int))
+        self.remainder = np.setdiff1d(np.arange(model.n_fluxes), self.fluxes)
+        n = model.n_species
+        reactants = model.mass_action_index[0, self.fluxes]
+        if np.any(reactants >= n) or np.any(model.mass_action_index[1:, self.fluxes] < n):
+            raise ValueError("Transport fluxes must be first order in one species")
+
+        # Each stoichiometric entry S[i, l] contributes S[i, l] * k_l to T[i, reactant_l]
+        columns = model.stoichiometry[:, self.fluxes].tocoo()
+        rows, cols = columns.row, reactants[columns.col]
+        pattern = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+        pattern.sort_indices()
+        positions = np.array([pattern.indptr[i] + np.searchsorted(
+            pattern.indices[pattern.indptr[i]:pattern.indptr[i + 1]], c) for i, c in zip(rows, cols)],
+            dtype=int)
+        self._entries = sparse.csr_matrix((columns.data, (positions, columns.col)),
+                                          shape=(pattern.nnz, len(self.fluxes)))
+        self._indptr, self._indices = pattern.indptr, pattern.indices
+        self.parameters = np.unique(model.flux_parameters[self.fluxes].indices)
+        multipliers = model.flux_multipliers
+        self._multipliers = None if multipliers is None else multipliers[self.fluxes]
+        self._remainder_multipliers = None if multipliers is None else multipliers[self.remainder]
+        self._key = None
+        self._matrix = None
+
+        # Nonlinear remainder, evaluated as in GeertsModel.flux_rates
+        self._stoichiometry = model.stoichiometry[:, self.remainder].tocsr()
+        self._mass_action_index = model.mass_action_index[:, self.remainder]
+        self._dynamic = np.searchsorted(self.remainder, model.dynamic_flux)
+        self._remainder_pattern = model.flux_dependencies[self.remainder].tocsr()
+        self._remainder_groups = column_groups(self._remainder_pattern)
+        self.remainder_sparsity = ((abs(self._stoichiometry) @ self._remainder_pattern)
+                                   != 0).astype(float)
+
+    def __repr__(self):
+        return (f"<TransportOperator {len(self.fluxes)} linear fluxes, "
+                f"{len(self.remainder)} remaining, {len(self._indices)} entries>")
+
+    def matrix(self, p, k=None):
+        """
+        T(p) as a CSR matrix, rebuilt only when a transport parameter changed
+
+        Parameters:
+        -----------
+        p : numpy.ndarray
+            Parameter vector from GeertsModel.parameter_vector
+        k : numpy.ndarray or None
+            Precomputed GeertsModel.rate_constants(p)
+        """
+        key = np.asarray(p)[self.parameters].tobytes()
+        if key != self._key:
+            k = self.model.rate_constants(p) if k is None else k
+            rates = k[self.fluxes] if self._multipliers is None else k[self.fluxes] * self._multipliers
+            values = self._entries @ rates
+            n = self.model.n_species
+            self._matrix = sparse.csr_matrix((values, self._indices, self._indptr), shape=(n, n))
+            self._key = key
+        return self._matrix
+
+    def jacobian(self, p):
+        """
+        Exact Jacobian of the transport part, i.e. T(p)
+        """
+        return self.matrix(p)
+
+    def remainder_rates(self, y, p, k):
+        """
+        Fluxes of the non-transport reactions (see GeertsModel.flux_rates for shapes)
+        """
+        k = k[self.remainder]
+        if y.ndim == 2:
+            k = np.repeat(k[:, None], y.shape[1], axis=1)
+        else:
+            k = k.copy()
+        k = k.astype(np.result_type(k, y), copy=False)
+        if len(self._dynamic):
+            k[self._dynamic] = self.model._dynamic_rates(y, p)
+        y_ext = np.concatenate([y, np.ones((1,) + y.shape[1:], dtype=y.dtype)])
+        for order in range(self._mass_action_index.shape[0]):
+            k = k * y_ext[self._mass_action_index[order]]
+        if self._remainder_multipliers is not None:
+            multipliers = self._remainder_multipliers
+            k = k * (multipliers[:, None] if k.ndim == 2 else multipliers)
+        return k
+
+    def remainder_jacobian(self, y, p, k):
+        """
+        Exact Jacobian of the nonlinear remainder, S_r dv_r/dy (sparse, n_species x n_species)
+
+        dv_r/dy comes from complex steps of remainder_rates, perturbing the
+        species that no remainder flux shares together (see
+        complex_step.RateDerivatives).
+        """
+        pattern, groups = self._remainder_pattern, self._remainder_groups
+        seeds = np.zeros((len(groups), int(groups.max()) + 1))
+        seeds[np.arange(len(groups)), groups] = COMPLEX_STEP
+        derivatives = self.remainder_rates(np.asarray(y, dtype=float)[:, None] + 1j * seeds, p, k).imag
+        rows = np.repeat(np.arange(pattern.shape[0]), np.diff(pattern.indptr))
+        data = derivatives[rows, groups[pattern.indices]] / COMPLEX_STEP
+        return self._stoichiometry @ sparse.csr_matrix((data, pattern.indices, pattern.indptr),
+                                                       shape=pattern.shape)
+
+    def rhs(self, y, p, k=None):
+        """
+        Time derivative T(p) y + S_r v_r(y, p); equal to GeertsModel.rhs
+        """
+        k = self.model.rate_constants(p) if k is None else k
+        return self.matrix(p, k) @ y + self._stoichiometry @ self.remainder_rates(y, p, k)
+
+    def rhs_function(self, params):
+        """
+        Build f(t, y) for a fixed parameter set, as used by the integrators
+        """
+        p = self.model.parameter_vector(params)
+        k = self.model.rate_constants(p)
+        matrix = self.matrix(p, k)
+
+        def f(t, y):
+            return matrix @ y + self._stoichiometry @ self.remainder_rates(y, p, k)
+        return f
+
+    def jacobian_function(self, params):
+        """
+        Build the exact jac(t, y) = T(p) + S_r dv_r/dy for the implicit integrators
+        """
+        p = self.model.parameter_vector(params)
+        k = self.model.rate_constants(p)
+        matrix = self.matrix(p, k)
+
+        def jac(t, y):
+            return (matrix + self.remainder_jacobian(y, p, k)).tocsc()
+        return jac
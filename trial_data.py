@@ -0,0 +1,181 @@
+"""
+Clinical Trial Data Loader
+Loads all anti-amyloid trial tables in data/SUVR into one long table and scores
+model predictions against them
+"""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DATA_DIR = Path(__file__).resolve().parent / "data" / "SUVR"
+
+# Study name -> (file, drug)
+TRIAL_FILES = {
+    'PRIME': ('SUVR_PRIME_ADUCANUMAB.xlsx', 'Aducanumab'),
+    'EMERGE': ('EMERGE_ADUCANUMAB.xlsx', 'Aducanumab'),
+    'ENGAGE': ('ENGAGE_ADUCANUMAB.xlsx', 'Aducanumab'),
+    'LECANEMAB_PHASE2B': ('Phase_2b_LECANEMAB_Swanson_2021.xlsx', 'Lecanemab'),
+    'LECANEMAB_PHASE3': ('Phase_3_LECANEMAB_van_Dyck_2022.xlsx', 'Lecanemab'),
+    'TRAILBLAZER-ALZ2': ('Ph_3_DONANEMAB_Sims_2023.xlsx', 'Donanemab'),
+    'DIAN-TU': ('DIAN-TU_GANT.xlsx', 'Gantenerumab'),
+}
+
+WEEKS_PER_YEAR = 52.0
+WEEKS_PER_MONTH = 52.0 / 12.0
+
+# Between-subject SD of the change from baseline, used when a table has no CI.
+# The SUVR value is implied by the PRIME CIs (CI ~ 0.02 with n ~ 27).
+DEFAULT_CHANGE_SD = {'SUVR': 0.055, 'Centiloid': 20.0, 'CSF AB42/40 CentiMarker': 25.0}
+# Arm size assumed when a table has no n column
+DEFAULT_N = 50
+
+
+def _measure_type(observation):
+    """
+    Classify an Observation label as SUVR, Centiloid or CSF marker
+    """
+    label = str(observation)
+    if 'SUVR' in label:
+        return 'SUVR'
+    if 'CSF' in label:
+        return 'CSF AB42/40 CentiMarker'
+    if 'entiloid' in label:
+        return 'Centiloid'
+    return label
+
+
+def _time_in_weeks(df):
+    """
+    Convert whichever time column a table has to weeks
+    """
+    for column, factor in (('Time (weeks)', 1.0), ('Time (months)', WEEKS_PER_MONTH),
+                           ('Time (years)', WEEKS_PER_YEAR)):
+        if column in df.columns:
+            return pd.to_numeric(df[column], errors='coerce') * factor
+    raise ValueError(f"No time column in {list(df.columns)}")
+
+
+def load_trial_data(data_dir=DATA_DIR, studies=None):
+    """
+    Load trial tables into one long table with times in weeks
+
+    Parameters:
+    -----------
+    data_dir : str or Path
+        Directory containing the trial Excel files
+    studies : list of str or None
+        Studies to load (keys of TRIAL_FILES), all when None
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Columns: study, drug, series, measure, time_weeks, measurement, n, CI.
+        Rows without a numeric time (e.g. the DIAN-TU OLE baseline) are dropped
+    """
+    data_dir = Path(data_dir)
+    frames = []
+    for study in (studies or TRIAL_FILES):
+        file_name, drug = TRIAL_FILES[study]
+        df = pd.read_excel(data_dir / file_name)
+        df = df.dropna(subset=['Observation'])
+        frame = pd.DataFrame({
+            'study': study,
+            'drug': drug,
+            'series': df['Series'] if 'Series' in df.columns else drug,
+            'measure': df['Observation'].map(_measure_type),
+            'time_weeks': _time_in_weeks(df),
+            'measurement': pd.to_numeric(df['measurement'], errors='coerce'),
+            'n': pd.to_numeric(df['n'], errors='coerce') if 'n' in df.columns else np.nan,
+            'CI': pd.to_numeric(df['CI'], errors='coerce') if 'CI' in df.columns else np.nan,
+        })
+        frames.append(frame.dropna(subset=['time_weeks', 'measurement']))
+    return pd.concat(frames, ignore_index=True)
+
+
+def standard_errors(data, default_sd=None, default_n=DEFAULT_N):
+    """
+    Standard error of every arm mean
+
+    The CI columns are 95% half-widths, so SE = CI / 1.96. Without a CI the SE
+    is the default between-subject SD over sqrt(n).
+
+    Parameters:
+    -----------
+    data : pandas.DataFrame
+        Output of load_trial_data
+    default_sd : dict or None
+        Per-measure SD overriding DEFAULT_CHANGE_SD
+    default_n : int
+        Arm size used when n is missing
+
+    Returns:
+    --------
+    numpy.ndarray
+        Standard error per row
+    """
+    sd = {**DEFAULT_CHANGE_SD, **(default_sd or {})}
+    n = data['n'].fillna(default_n).clip(lower=1).to_numpy(dtype=float)
+    fallback = data['measure'].map(sd).to_numpy(dtype=float) / np.sqrt(n)
+    se = data['CI'].to_numpy(dtype=float) / 1.96
+    return np.where(np.isfinite(se) & (se > 0), se, fallback)
+
+
+def gaussian_log_likelihood(data, predictions, se=None):
+    """
+    Gaussian log-likelihood of arm-mean predictions
+
+    Parameters:
+    -----------
+    data : pandas.DataFrame
+        Output of load_trial_data
+    predictions : array-like
+        Model prediction for every row of data
+    se : array-like or None
+        Standard errors, computed with standard_errors when None
+
+    Returns:
+    --------
+    float
+        Log-likelihood, -inf if any prediction is not finite
+    """
+    predictions = np.asarray(predictions, dtype=float)
+    if not np.all(np.isfinite(predictions)):
+        return -np.inf
+    se = standard_errors(data) if se is None else np.asarray(se, dtype=float)
+    residuals = (data['measurement'].to_numpy(dtype=float) - predictions) / se
+    return float(-0.5 * np.sum(residuals ** 2 + np.log(2.0 * np.pi * se ** 2)))
+
+
+class TrialLikelihood:
+    """
+    Picklable log-likelihood of a parameter set against the trial tables
+
+    Parameters:
+    -----------
+    data : pandas.DataFrame
+        Output of load_trial_data
+    predict : callable
+        predict(params, data) -> array with one prediction per row of data
+    default_sd : dict or None
+        Passed to standard_errors
+    """
+
+    def __init__(self, data, predict, default_sd=None):
+        self.data = data.reset_index(drop=True)
+        self.predict = predict
+        self.se = standard_errors(self.data, default_sd)
+
+    def __call__(self, params):
+        try:
+            predictions = self.predict(params, self.data)
+        except (ArithmeticError, ValueError, RuntimeError):
+            return -np.inf
+        return gaussian_log_likelihood(self.data, predictions, self.se)
+
+    def negative(self, params):
+        """
+        Negative log-likelihood, the objective used by fitting and profiling
+        """
+        return -self(params)
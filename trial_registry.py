@@ -0,0 +1,385 @@
+"""
+Trial Registry
+Declarative study definitions (trials.toml) compiled into one simulation plan in which every
+distinct baseline and dosing schedule across the registered trials is simulated once
+"""
+
+import argparse
+import tomllib
+from pathlib import Path
+
+import numpy as np
+
+from geerts_model import DOSE_COMPARTMENTS, dose_schedule, simulate, simulate_baseline
+from parallel import parallel_map
+from population import DEFAULT_MEASURES
+
+REGISTRY_PATH = Path(__file__).resolve().parent / "trials.toml"
+
+# Regimen keys (see geerts_model.dose_schedule) a study may set for all of its arms
+STUDY_REGIMEN_KEYS = ('body_weight_kg', 'route', 'interval_weeks', 'duration_weeks', 'start_weeks',
+                      'antibody')
+REGIMEN_KEYS = STUDY_REGIMEN_KEYS + ('dose_mg_per_kg', 'dose_mg', 'n_doses', 'titration')
+DEFAULT_BASELINE_YEARS = 20.0
+
+
+def _arm_regimen(study, entry, arm):
+    """
+    Regimen dict of one arm with the study-level defaults filled in, None for placebo
+    """
+    if arm.get('placebo', False):
+        return None
+    regimen = {key: entry[key] for key in STUDY_REGIMEN_KEYS if key in entry}
+    regimen.update({key: arm[key] for key in REGIMEN_KEYS if key in arm})
+    if 'dose_mg' not in regimen and 'dose_mg_per_kg' not in regimen:
+        raise ValueError(f"{study} / {arm['series']}: no dose (set dose_mg, dose_mg_per_kg or placebo)")
+    if regimen.get('route', 'IV') not in DOSE_COMPARTMENTS:
+        raise ValueError(f"{study} / {arm['series']}: unknown route {regimen['route']}")
+    try:
+        dose_schedule(regimen)
+    except KeyError as error:
+        raise ValueError(f"{study} / {arm['series']}: regimen is missing {error}") from None
+    return regimen
+
+
+def load_registry(path=REGISTRY_PATH):
+    """
+    Read and validate a trial registry
+
+    Parameters:
+    -----------
+    path : str or Path
+        TOML file with one table per study, see trials.toml
+
+    Returns:
+    --------
+    dict
+        Study -> {'drug', 'measures', 'times_weeks', 'baseline_years', 'arms', ...}
+        where every arm has 'series', 'label' and 'regimen' (None for placebo)
+    """
+    with open(path, 'rb') as f:
+        raw = tomllib.load(f)
+    registry = {}
+    for study, entry in raw.items():
+        if not entry.get('arms'):
+            raise ValueError(f"{study}: no arms")
+        if 'times_weeks' not in entry:
+            raise ValueError(f"{study}: no times_weeks")
+        series = [arm.get('series') for arm in entry['arms']]
+        if None in series or len(set(series)) < len(series):
+            raise ValueError(f"{study}: every arm needs a distinct series")
+        registry[study] = {
+            **{key: value for key, value in entry.items() if key not in REGIMEN_KEYS},
+            'measures': list(entry.get('measures', [])),
+            'times_weeks': sorted(float(t) for t in entry['times_weeks']),
+            'baseline_years': float(entry.get('baseline_years', DEFAULT_BASELINE_YEARS)),
+            'arms': [{'series': arm['series'], 'label': arm.get('label', arm['series']),
+                      'regimen': _arm_regimen(study, entry, arm)} for arm in entry['arms']],
+        }
+    return registry
+
+
+def arm_labels(registry):
+    """
+    Canonical label of every (study, series) of the data tables
+    """
+    return {(study, arm['series']): arm['label']
+            for study, entry in registry.items() for arm in entry['arms']}
+
+
+def schedule_key(regimen):
+    """
+    Identity of a regimen by the doses it gives, None for placebo
+
+    Regimens written differently (mg/kg at a body weight vs a flat dose,
+    n_doses vs duration_weeks, study defaults vs arm settings) share a key
+    when they expand to the same doses.
+    """
+    if regimen is None:
+        return None
+    return tuple((round(t, 9), species, float(f"{amount:.12g}"))
+                 for t, species, amount in dose_schedule(regimen))
+
+
+class SimulationPlan:
+    """
+    Deduplicated simulations behind a set of trial arms
+
+    Attributes:
+    -----------
+    baselines : list of float
+        Distinct untreated history lengths (years)
+    regimens : list of dict or None
+        Distinct dosing schedules (None is placebo)
+    tasks : list of dict
+        One treatment-window simulation per distinct (baseline, regimen):
+        'baseline' and 'regimen' indices, 't_weeks' (union of the visits of
+        its arms, from 0) and 'outputs'
+    arms : dict
+        (study, series) -> {'task', 'label', 'outputs', 't_weeks'}
+    skipped : list of tuple
+        (study, measure) pairs without a model read-out
+    """
+
+    def __init__(self):
+        self.baselines = []
+        self.regimens = []
+        self.tasks = []
+        self.arms = {}
+        self.skipped = []
+
+    def __repr__(self):
+        return (f"<SimulationPlan {len(self.arms)} arms -> {len(self.tasks)} simulations, "
+                f"{len(self.baselines)} baselines>")
+
+
+def compile_plan(registry, studies=None, data=None, measures=None):
+    """
+    Compile registered trials into a SimulationPlan
+
+    Arms with the same baseline and the same dose schedule map to one task,
+    within and across studies (e.g. every placebo arm, or lecanemab 10 mg/kg
+    Q2W in the phase 2b and phase 3 trials).
+
+    Parameters:
+    -----------
+    registry : dict
+        Output of load_registry
+    studies : list of str or None
+        Studies to include, all when None
+    data : pandas.DataFrame or None
+        Output of trial_data.load_trial_data; the times of its rows are added
+        to the visits of their arms so predictions need no interpolation
+    measures : dict or None
+        Trial measure -> read-out, population.DEFAULT_MEASURES when None
+
+    Returns:
+    --------
+    SimulationPlan
+    """
+    measures = dict(DEFAULT_MEASURES if measures is None else measures)
+    plan = SimulationPlan()
+    regimen_index, task_index = {}, {}
+    for study in studies or registry:
+        entry = registry[study]
+        outputs = [measures[m] for m in entry['measures'] if m in measures]
+        plan.skipped += [(study, m) for m in entry['measures'] if m not in measures]
+        if entry['baseline_years'] not in plan.baselines:
+            plan.baselines.append(entry['baseline_years'])
+        baseline = plan.baselines.index(entry['baseline_years'])
+        for arm in entry['arms']:
+            times = {0.0, *entry['times_weeks']}
+            if data is not None:
+                rows = ((data['study'] == study) & (data['series'] == arm['series'])
+                        & data['measure'].isin([m for m in entry['measures'] if m in measures]))
+                times.update(data.loc[rows, 'time_weeks'].astype(float))
+            key = schedule_key(arm['regimen'])
+            if key not in regimen_index:
+                regimen_index[key] = len(plan.regimens)
+                plan.regimens.append(arm['regimen'])
+            pair = (baseline, regimen_index[key])
+            if pair not in task_index:
+                task_index[pair] = len(plan.tasks)
+                plan.tasks.append({'baseline': pair[0], 'regimen': pair[1], 't_weeks': set(), 'outputs': []})
+            task = plan.tasks[task_index[pair]]
+            task['t_weeks'].update(times)
+            task['outputs'] += [name for name in outputs if name not in task['outputs']]
+            plan.arms[(study, arm['series'])] = {'task': task_index[pair], 'label': arm['label'],
+                                                 'outputs': outputs, 't_weeks': np.array(sorted(times))}
+    for task in plan.tasks:
+        task['t_weeks'] = np.array(sorted(task['t_weeks']))
+    return plan
+
+
+_MODEL = None
+
+
+def _init_worker(model):
+    global _MODEL
+    _MODEL = model
+
+
+def _plan_task(task):
+    """
+    One treatment window from a given pre-treatment state
+    """
+    params, y0, regimen, t_weeks, outputs, options = task
+    levels = list(dict.fromkeys(name[:-len('_change')] if name.endswith('_change') else name
+                                for name in outputs))
+    try:
+        result = simulate(_MODEL, params, t_weeks, y0=y0, regimen=regimen, outputs=levels, **options)
+    except (ArithmeticError, ValueError, RuntimeError):
+        return np.full((len(outputs), len(t_weeks)), np.nan)
+    return np.array([result.observable(name) for name in outputs])
+
+
+def run_plan(model, params, plan, processes=None, **options):
+    """
+    Simulate every task of a plan for one parameter set
+
+    Each distinct baseline is integrated once; the treatment windows then
+    start from its final state and run in parallel.
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    params : dict
+        Parameter set
+    plan : SimulationPlan
+        Output of compile_plan
+    processes : int or None
+        Worker processes
+    **options
+        Passed to simulate (method, rtol, atol, backend)
+
+    Returns:
+    --------
+    list of numpy.ndarray
+        Read-outs per task (len(task['outputs']) x len(task['t_weeks'])), NaN
+        when the integration failed
+    """
+    solver_options = {key: options[key] for key in ('method', 'rtol', 'atol', 'backend') if key in options}
+    states = [simulate_baseline(model, params, years, **solver_options).final_state for years in plan.baselines]
+    tasks = [(params, states[task['baseline']], plan.regimens[task['regimen']], task['t_weeks'],
+              task['outputs'], options) for task in plan.tasks]
+    return parallel_map(_plan_task, tasks, processes=processes, initializer=_init_worker, initargs=(model,))
+
+
+def arm_values(plan, results, study, series, output):
+    """
+    Read-out of one arm at its own visits
+
+    Returns:
+    --------
+    tuple
+        (t_weeks, values)
+    """
+    arm = plan.arms[(study, series)]
+    task = plan.tasks[arm['task']]
+    values = results[arm['task']][task['outputs'].index(output)]
+    return arm['t_weeks'], np.interp(arm['t_weeks'], task['t_weeks'], values)
+
+
+def _row_arm(plan, measures, study, series, measure):
+    arm = plan.arms.get((study, series))
+    if arm is None or measure not in measures or measures[measure] not in arm['outputs']:
+        return None
+    return arm
+
+
+def covered_rows(plan, data, measures=None):
+    """
+    Mask of the rows of a trial table that the plan predicts
+
+    Parameters:
+    -----------
+    plan : SimulationPlan
+        Output of compile_plan
+    data : pandas.DataFrame
+        Output of trial_data.load_trial_data
+    measures : dict or None
+        Trial measure -> read-out, as passed to compile_plan
+    """
+    measures = dict(DEFAULT_MEASURES if measures is None else measures)
+    return np.array([_row_arm(plan, measures, *row) is not None
+                     for row in zip(data['study'], data['series'], data['measure'])], dtype=bool)
+
+
+def predict_rows(plan, results, data, measures=None):
+    """
+    Prediction for every row of a trial table, NaN for rows the plan does not cover
+
+    Parameters:
+    -----------
+    plan : SimulationPlan
+        Output of compile_plan
+    results : list of numpy.ndarray
+        Output of run_plan
+    data : pandas.DataFrame
+        Output of trial_data.load_trial_data
+    measures : dict or None
+        Trial measure -> read-out, as passed to compile_plan
+    """
+    measures = dict(DEFAULT_MEASURES if measures is None else measures)
+    predictions = np.full(len(data), np.nan)
+    for i, (study, series, measure, t) in enumerate(zip(data['study'], data['series'], data['measure'],
+                                                        data['time_weeks'])):
+        arm = _row_arm(plan, measures, study, series, measure)
+        if arm is None:
+            continue
+        task = plan.tasks[arm['task']]
+        values = results[arm['task']][task['outputs'].index(measures[measure])]
+        predictions[i] = np.interp(float(t), task['t_weeks'], values)
+    return predictions
+
+
+class PlanPredictor:
+    """
+    Picklable predict(params, data) for trial_data.TrialLikelihood backed by a SimulationPlan
+
+    Parameters:
+    -----------
+    model : GeertsModel
+        Compiled model
+    plan : SimulationPlan
+        Output of compile_plan, ideally compiled with the same data
+    measures : dict or None
+        Trial measure -> read-out, as passed to compile_plan
+    processes : int or None
+        Worker processes per evaluation
+    **options
+        Passed to simulate (method, rtol, atol, backend)
+
+    Examples:
+    ---------
+    >>> data = load_trial_data()
+    >>> plan = compile_plan(load_registry(), data=data)
+    >>> data = data[covered_rows(plan, data)]
+    >>> likelihood = TrialLikelihood(data, PlanPredictor(model, plan))
+    """
+
+    def __init__(self, model, plan, measures=None, processes=None, **options):
+        self.model = model
+        self.plan = plan
+        self.measures = measures
+        self.processes = processes
+        self.options = options
+
+    def __call__(self, params, data):
+        results = run_plan(self.model, params, self.plan, self.processes, **self.options)
+        return predict_rows(self.plan, results, data, self.measures)
+
+
+def print_plan(plan, stream=None):
+    """
+    List the tasks of a plan and the trial arms each one serves
+    """
+    served = {}
+    for (study, series), arm in plan.arms.items():
+        served.setdefault(arm['task'], []).append(f"{study}: {arm['label']}")
+    for i, task in enumerate(plan.tasks):
+        regimen = plan.regimens[task['regimen']]
+        kind = 'placebo' if regimen is None else f"{len(dose_schedule(regimen))} doses"
+        print(f"task {i} ({kind}, {plan.baselines[task['baseline']]:g} y baseline, "
+              f"{len(task['t_weeks'])} times): {'; '.join(served[i])}", file=stream)
+    for study, measure in plan.skipped:
+        print(f"{study}: no read-out for '{measure}', not simulated", file=stream)
+    print(f"{len(plan.arms)} arms -> {len(plan.tasks)} simulations", file=stream)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the trial registry into a simulation plan")
+    parser.add_argument('--registry', default=REGISTRY_PATH, help="Registry TOML file")
+    parser.add_argument('--studies', nargs='+', default=None, help="Studies to include (default: all)")
+    args = parser.parse_args(argv)
+    registry = load_registry(args.registry)
+    unknown = set(args.studies or []) - set(registry)
+    if unknown:
+        parser.error(f"unknown studies: {', '.join(sorted(unknown))}")
+    print_plan(compile_plan(registry, args.studies))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())